@@ -0,0 +1,443 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from eth_abi import decode, encode
+from langchain_core.callbacks import BaseCallbackHandler
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from metrics import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    npc TEXT NOT NULL,
+    tool TEXT NOT NULL,
+    args TEXT NOT NULL,
+    result_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    root TEXT NOT NULL,
+    first_action INTEGER NOT NULL,
+    last_action INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    tx_hash TEXT,
+    attestation_id INTEGER,
+    submitted_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS batches_last_action ON batches (last_action);
+"""
+
+ACTION_COLUMNS = "id, npc, tool, args, result_hash, status, created_at"
+BATCH_COLUMNS = "id, root, first_action, last_action, size, created_at, status, tx_hash, attestation_id, submitted_at"
+
+# Attested data: the Merkle root and the range of action ids under it. The
+# Sign Protocol schema must have these fields in this order
+ATTESTATION_DATA_TYPES = ["bytes32", "uint256", "uint256", "uint256"]
+ATTESTATION_MADE_TOPIC = Web3.to_hex(Web3.keccak(text="AttestationMade(uint64,string)"))
+
+
+def hash_text(text: str) -> str:
+    return Web3.to_hex(Web3.keccak(text=text))
+
+
+def leaf_hash(action: dict) -> bytes:
+    """
+    Leaf of an action, double hashed over its ABI encoding like OpenZeppelin's
+    StandardMerkleTree so a leaf can't be passed off as an inner node.
+    """
+    encoded = encode(
+        ["uint256", "string", "string", "bytes32", "bytes32", "string", "uint256"],
+        [
+            action["id"],
+            action["npc"],
+            action["tool"],
+            Web3.to_bytes(hexstr=hash_text(action["args"])),
+            Web3.to_bytes(hexstr=action["result_hash"]),
+            action["status"],
+            action["created_at"],
+        ],
+    )
+    return Web3.keccak(Web3.keccak(encoded))
+
+
+def hash_pair(a: bytes, b: bytes) -> bytes:
+    # Sorted pairs, so proofs need no left/right flags (OpenZeppelin MerkleProof)
+    return Web3.keccak(a + b if a < b else b + a)
+
+
+def merkle_levels(leaves: Sequence[bytes]) -> List[List[bytes]]:
+    """Every level of the tree from the leaves up to the root. An odd node out moves up unpaired."""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_proof(levels: List[List[bytes]], index: int) -> List[bytes]:
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf: bytes, proof: Sequence[bytes], root: bytes) -> bool:
+    node = leaf
+    for sibling in proof:
+        node = hash_pair(node, sibling)
+    return node == root
+
+
+class ActionLog:
+    """
+    Append-only log of every tool call made by NPC agents, attested in batches.
+
+    Each action (NPC, tool, arguments, hash of the result) is appended to a
+    SQLite table. `roll` takes the actions not yet in a batch, builds a Merkle
+    tree over them and records its root; only the root is attested, so a
+    batch of thousands of actions costs one Sign Protocol transaction.
+    `proof` returns the path from an action's leaf to its batch root, which
+    anyone holding the action can check against the attestation.
+
+    Args:
+        path: SQLite file holding the log
+        max_batch: Most actions rolled into one batch
+        attester: Optional SignProtocolAttester publishing batch roots
+        proof_cache_size: Number of batch trees kept for serving proofs
+        submit_timeout: Seconds after which a submitted batch without a receipt is checked on chain
+    """
+
+    def __init__(
+        self,
+        path: str = "action_log.sqlite",
+        max_batch: int = 10000,
+        attester: Optional["SignProtocolAttester"] = None,
+        proof_cache_size: int = 8,
+        submit_timeout: float = 900,
+    ):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if "submitted_at" not in {row[1] for row in self.conn.execute("PRAGMA table_info(batches)")}:
+            # Logs created before submissions were timed
+            self.conn.execute("ALTER TABLE batches ADD COLUMN submitted_at INTEGER")
+        self.max_batch = max_batch
+        self.attester = attester
+        self.proof_cache_size = proof_cache_size
+        self.submit_timeout = submit_timeout
+        self._trees: "OrderedDict[int, List[List[bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Recording
+
+    def append(self, npc: str, tool: str, args: str, result: str, status: str = "success") -> int:
+        """Record a tool call, returning its action id."""
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO actions (npc, tool, args, result_hash, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (npc, tool, args, hash_text(result), status, int(time.time())),
+            )
+            return cursor.lastrowid
+
+    def get_action(self, action_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute(f"SELECT {ACTION_COLUMNS} FROM actions WHERE id = ?", (action_id,)).fetchone()
+        return dict(zip(ACTION_COLUMNS.split(", "), row)) if row else None
+
+    def _actions(self, first: int, last: int) -> List[dict]:
+        rows = self.conn.execute(
+            f"SELECT {ACTION_COLUMNS} FROM actions WHERE id BETWEEN ? AND ? ORDER BY id", (first, last)
+        ).fetchall()
+        return [dict(zip(ACTION_COLUMNS.split(", "), row)) for row in rows]
+
+    # Batches
+
+    def roll(self) -> Optional[dict]:
+        """Put the oldest actions not in a batch yet into a new batch. Returns it, or None when there are none."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT MAX(last_action) FROM batches").fetchone()
+                after = row[0] or 0
+                rows = self.conn.execute(
+                    f"SELECT {ACTION_COLUMNS} FROM actions WHERE id > ? ORDER BY id LIMIT ?", (after, self.max_batch)
+                ).fetchall()
+                if not rows:
+                    return None
+                actions = [dict(zip(ACTION_COLUMNS.split(", "), r)) for r in rows]
+                levels = merkle_levels([leaf_hash(action) for action in actions])
+                cursor = self.conn.execute(
+                    "INSERT INTO batches (root, first_action, last_action, size, created_at, status) VALUES (?, ?, ?, ?, ?, 'pending')",
+                    (Web3.to_hex(levels[-1][0]), actions[0]["id"], actions[-1]["id"], len(actions), int(time.time())),
+                )
+                batch_id = cursor.lastrowid
+            finally:
+                self.conn.execute("COMMIT")
+            self._cache_tree(batch_id, levels)
+        return self.get_batch(batch_id)
+
+    def get_batch(self, batch_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute(f"SELECT {BATCH_COLUMNS} FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return dict(zip(BATCH_COLUMNS.split(", "), row)) if row else None
+
+    def batches(self, limit: int = 50, status: Optional[str] = None) -> List[dict]:
+        """Most recent batches first."""
+        query = f"SELECT {BATCH_COLUMNS} FROM batches"
+        params: tuple = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(zip(BATCH_COLUMNS.split(", "), row)) for row in rows]
+
+    def update_batch(self, batch_id: int, **fields: Any) -> None:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self.conn.execute(f"UPDATE batches SET {assignments} WHERE id = ?", (*fields.values(), batch_id))
+
+    def _cache_tree(self, batch_id: int, levels: List[List[bytes]]) -> None:
+        self._trees[batch_id] = levels
+        self._trees.move_to_end(batch_id)
+        while len(self._trees) > self.proof_cache_size:
+            self._trees.popitem(last=False)
+
+    # Proofs
+
+    def proof(self, action_id: int) -> Optional[dict]:
+        """
+        Inclusion proof of an action in its batch, or None for unknown actions.
+        Actions not rolled into a batch yet come back without a proof.
+        """
+        action = self.get_action(action_id)
+        if action is None:
+            return None
+        leaf = leaf_hash(action)
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {BATCH_COLUMNS} FROM batches WHERE first_action <= ? AND last_action >= ?",
+                (action_id, action_id),
+            ).fetchone()
+            batch = dict(zip(BATCH_COLUMNS.split(", "), row)) if row else None
+            if batch is None:
+                return {"action": action, "leaf": Web3.to_hex(leaf), "batch": None, "proof": None}
+            levels = self._trees.get(batch["id"])
+            if levels is None:
+                actions = self._actions(batch["first_action"], batch["last_action"])
+                levels = merkle_levels([leaf_hash(a) for a in actions])
+            self._cache_tree(batch["id"], levels)
+            # Position in the batch, ids may skip numbers
+            index = self.conn.execute(
+                "SELECT COUNT(*) FROM actions WHERE id >= ? AND id < ?", (batch["first_action"], action_id)
+            ).fetchone()[0]
+        proof = merkle_proof(levels, index)
+        return {
+            "action": action,
+            "leaf": Web3.to_hex(leaf),
+            "batch": batch,
+            "proof": [Web3.to_hex(node) for node in proof],
+            "verified": verify_proof(leaf, proof, Web3.to_bytes(hexstr=batch["root"])),
+        }
+
+    # Attestation
+
+    def attest_pending(self) -> int:
+        """Submit the roots of batches not attested yet. Returns the number submitted."""
+        if self.attester is None:
+            return 0
+        self.recheck_submitted()
+        submitted = 0
+        for batch in reversed(self.batches(limit=100, status="pending")):
+            try:
+                tx_hash = self.attester.attest(batch, self._on_attested(batch["id"]))
+            except Exception as e:
+                logger.error(f"Action log: error attesting batch {batch['id']}: {e}")
+                break
+            self.update_batch(batch["id"], status="submitted", tx_hash=tx_hash, submitted_at=int(time.time()))
+            submitted += 1
+        return submitted
+
+    def recheck_submitted(self) -> int:
+        """
+        Settle batches submitted over `submit_timeout` seconds ago whose receipt
+        never reached us, e.g. across a restart: mined ones are recorded, and
+        ones the chain doesn't know are reset to pending to be attested again.
+        Returns the number settled.
+        """
+        cutoff = time.time() - self.submit_timeout
+        settled = 0
+        for batch in reversed(self.batches(limit=100, status="submitted")):
+            if (batch["submitted_at"] or 0) > cutoff:
+                continue
+            try:
+                receipt = self.attester.receipt(batch["tx_hash"])
+            except TransactionNotFound:
+                logger.warning(f"Action log: attestation {batch['tx_hash']} of batch {batch['id']} was dropped, resubmitting")
+                self.update_batch(batch["id"], status="pending", tx_hash=None, submitted_at=None)
+                settled += 1
+                continue
+            except Exception as e:
+                logger.error(f"Action log: error checking attestation of batch {batch['id']}: {e}")
+                break
+            if receipt is not None:
+                self._on_attested(batch["id"])(receipt)
+                settled += 1
+        return settled
+
+    def _on_attested(self, batch_id: int) -> Callable[[dict], None]:
+        def on_mined(receipt):
+            if receipt["status"] != 1:
+                logger.warning(f"Action log: attestation of batch {batch_id} reverted, resubmitting")
+                self.update_batch(batch_id, status="pending", tx_hash=None, submitted_at=None)
+                return
+            self.update_batch(batch_id, status="attested", attestation_id=attestation_id_from(receipt))
+        return on_mined
+
+    def stats(self) -> dict:
+        with self._lock:
+            actions = self.conn.execute("SELECT COUNT(*), MAX(id) FROM actions").fetchone()
+            rolled = self.conn.execute("SELECT MAX(last_action) FROM batches").fetchone()[0] or 0
+            statuses = dict(self.conn.execute("SELECT status, COUNT(*) FROM batches GROUP BY status").fetchall())
+        return {
+            "actions": actions[0],
+            "unbatched": (actions[1] or 0) - rolled,
+            "batches": statuses,
+            "attesting": self.attester is not None,
+        }
+
+    async def run(self, interval: float = 300, should_roll: Callable[[], bool] = lambda: True) -> None:
+        """
+        Every `interval` seconds, roll new actions into batches and attest their
+        roots, off the event loop. `should_roll` lets one worker do it for all.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await asyncio.to_thread(should_roll):
+                    continue
+                while await asyncio.to_thread(self.roll) is not None:
+                    pass
+                await asyncio.to_thread(self.attest_pending)
+            except Exception as e:
+                logger.error(f"Action log: error rolling batches: {e}")
+
+
+def attestation_id_from(receipt: dict) -> Optional[int]:
+    """The attestation id from the `AttestationMade` event of a mined `attest`."""
+    for log in receipt.get("logs", []):
+        topics = [Web3.to_hex(t) for t in log["topics"]]
+        if topics and topics[0] == ATTESTATION_MADE_TOPIC:
+            return decode(["uint64", "string"], bytes(log["data"]))[0]
+    return None
+
+
+class SignProtocolAttester:
+    """
+    Attests batch roots on chain with Sign Protocol, sent without waiting
+    through the transaction manager. The schema's data is `(bytes32 root,
+    uint256 firstAction, uint256 lastAction, uint256 size)`.
+
+    Args:
+        tx_manager: TransactionManager of the attesting key
+        address: Sign Protocol contract
+        schema_id: Registered schema of the attestations
+    """
+
+    def __init__(self, tx_manager, address: str, schema_id: int):
+        self.tx_manager = tx_manager
+        self.contract = tx_manager.client.sign_protocol(address)
+        self.schema_id = schema_id
+
+    def attest(self, batch: dict, on_mined: Optional[Callable[[dict], None]] = None) -> str:
+        data = encode(
+            ATTESTATION_DATA_TYPES,
+            [Web3.to_bytes(hexstr=batch["root"]), batch["first_action"], batch["last_action"], batch["size"]],
+        )
+        attestation = (
+            self.schema_id,
+            0,  # linkedAttestationId
+            0,  # attestTimestamp, set by the contract
+            0,  # revokeTimestamp
+            self.tx_manager.account.address,
+            0,  # validUntil
+            0,  # dataLocation ONCHAIN
+            False,
+            [],
+            data,
+        )
+        return self.tx_manager.send(
+            self.contract.functions.attest(attestation, f"npc-actions-{batch['id']}", b"", b""),
+            on_mined=on_mined,
+            purpose=f"attest action batch {batch['id']}",
+        )
+
+    def receipt(self, tx_hash: str) -> Optional[dict]:
+        """
+        Receipt of a mined attestation, None while it is pending. Raises
+        TransactionNotFound when the chain doesn't know the transaction.
+        """
+        w3 = self.tx_manager.client.w3
+        try:
+            return w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            w3.eth.get_transaction(tx_hash)
+            return None
+
+
+class ActionLogHandler(BaseCallbackHandler):
+    """
+    LangChain callback appending every tool call of an agent run to the log.
+    The NPC comes from the run's `npc` metadata.
+    """
+
+    def __init__(self, log: ActionLog):
+        self.log = log
+        self._started: Dict[UUID, tuple] = {}
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        npc = (kwargs.get("metadata") or {}).get("npc", "unknown")
+        args = kwargs.get("inputs")
+        with self._lock:
+            self._started[run_id] = (
+                npc,
+                (serialized or {}).get("name", "unknown"),
+                json.dumps(args, sort_keys=True, default=str) if args is not None else input_str,
+            )
+
+    def _record(self, run_id: UUID, result: Any, status: str) -> None:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        try:
+            self.log.append(*started, result=str(result), status=status)
+        except Exception as e:
+            # Logging an action never fails the tool call
+            logger.error(f"Action log: error recording {started[1]}: {e}")
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._record(run_id, output, "success")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._record(run_id, error, "error")
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class AgentPool:
+    """
+    Registry of per-NPC agent executors.
+
+    Executors are built lazily on first use through `build_agent` and kept in an
+    LRU ordered map. Entries idle for longer than `ttl` seconds, or pushed out
+    once the pool holds more than `max_size` agents, are evicted and rebuilt on
+    demand from their stored NPC config.
+
+    Args:
+        build_agent: Callable taking an NPC config dict and returning an executor
+        load_config: Optional callable used to look up configs for NPCs the pool
+            has not seen yet (e.g. ones created before a restart)
+        max_size: Maximum number of live executors
+        ttl: Seconds an executor may stay idle before it is evicted
+    """
+
+    def __init__(
+        self,
+        build_agent: Callable[[dict], Any],
+        load_config: Optional[Callable[[str], Optional[dict]]] = None,
+        max_size: int = 256,
+        ttl: float = 1800,
+    ):
+        self.build_agent = build_agent
+        self.load_config = load_config
+        self.max_size = max_size
+        self.ttl = ttl
+        self._configs: Dict[str, dict] = {}
+        self._agents: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, npc_id: str, config: dict) -> None:
+        """Store the config for an NPC, dropping any executor built from an older one."""
+        with self._lock:
+            self._configs[npc_id] = config
+            self._agents.pop(npc_id, None)
+
+    def config_for(self, npc_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._configs.get(npc_id)
+
+    def __contains__(self, npc_id: str) -> bool:
+        with self._lock:
+            if npc_id in self._configs:
+                return True
+        return self._load(npc_id)
+
+    def _load(self, npc_id: str) -> bool:
+        if self.load_config is None:
+            return False
+        config = self.load_config(npc_id)
+        if config is None:
+            return False
+        with self._lock:
+            self._configs.setdefault(npc_id, config)
+        return True
+
+    def get(self, npc_id: str) -> Any:
+        """Return the executor for an NPC, building it if it is not live."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._agents.get(npc_id)
+            if entry is not None:
+                self._agents[npc_id] = (entry[0], now)
+                self._agents.move_to_end(npc_id)
+                return entry[0]
+            config = self._configs.get(npc_id)
+            known = npc_id in self._configs
+
+        if not known:
+            if not self._load(npc_id):
+                raise KeyError(f"Unknown NPC: {npc_id}")
+            config = self.config_for(npc_id)
+
+        # Build outside the lock so one slow construction doesn't stall other NPCs
+        agent = self.build_agent(config)
+
+        with self._lock:
+            entry = self._agents.get(npc_id)
+            if entry is not None:
+                # Another caller finished first, keep theirs
+                agent = entry[0]
+            self._agents[npc_id] = (agent, time.monotonic())
+            self._agents.move_to_end(npc_id)
+            while len(self._agents) > self.max_size:
+                self._agents.popitem(last=False)
+        return agent
+
+    def evict_idle(self) -> int:
+        """Drop executors that have been idle longer than the TTL. Returns the count removed."""
+        with self._lock:
+            return self._evict_expired(time.monotonic())
+
+    def _evict_expired(self, now: float) -> int:
+        removed = 0
+        # Entries are kept in least-recently-used order, so stop at the first fresh one
+        while self._agents:
+            npc_id, (_, last_used) = next(iter(self._agents.items()))
+            if now - last_used < self.ttl:
+                break
+            self._agents.popitem(last=False)
+            removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "registered": len(self._configs),
+                "live": len(self._agents),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
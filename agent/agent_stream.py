@@ -0,0 +1,183 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, AsyncIterator, Callable, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+CHUNK = "chunk"
+TOKEN = "token"
+_ERROR = "error"
+_DONE = "done"
+
+
+class _StreamCancelled(Exception):
+    pass
+
+
+class _TokenHandler(BaseCallbackHandler):
+    """Forwards each generated token to the run's queue."""
+
+    # Raising from the callback aborts the model call once the consumer is gone
+    raise_error = True
+
+    def __init__(self, put: Callable[[tuple], bool]):
+        self._put = put
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        # Tool call deltas arrive as empty tokens
+        if token and not self._put((TOKEN, token)):
+            raise _StreamCancelled()
+
+
+class AgentStreamer:
+    """
+    Runs synchronous `agent_executor.stream(...)` calls on a bounded worker pool
+    and hands their chunks back to the event loop through an asyncio queue.
+
+    At most `max_concurrent` agent runs execute at once, later runs wait for a
+    free worker. Each run has its own bounded queue, so a slow consumer pauses
+    its producer thread instead of buffering the whole response. Closing the
+    async iterator (for example because the websocket went away) cancels the
+    run at the next chunk boundary.
+
+    Args:
+        max_concurrent: Maximum number of agent runs executing at the same time
+        queue_size: Maximum number of chunks buffered per run
+    """
+
+    def __init__(self, max_concurrent: int = 8, queue_size: int = 64):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent,
+            thread_name_prefix="agent-stream",
+        )
+        self._active = 0
+        self._lock = threading.Lock()
+
+    async def stream(self, agent: Any, inputs: dict, config: dict, tokens: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Yield `(CHUNK, graph_update)` pairs and, with `tokens`, `(TOKEN, text)`
+        pairs for each token the model generates. Token streaming needs a model
+        created with `streaming=True`.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        cancelled = threading.Event()
+
+        def put(item) -> bool:
+            while not cancelled.is_set():
+                future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    # Queue is full, re-check for cancellation unless the put landed meanwhile
+                    if not future.cancel():
+                        return True
+            return False
+
+        if tokens:
+            config = {**config, "callbacks": [*(config.get("callbacks") or []), _TokenHandler(put)]}
+
+        def run():
+            if cancelled.is_set():
+                return
+            with self._lock:
+                self._active += 1
+            try:
+                for chunk in agent.stream(inputs, config):
+                    if cancelled.is_set() or not put((CHUNK, chunk)):
+                        break
+            except Exception as e:
+                if not cancelled.is_set():
+                    put((_ERROR, e))
+            finally:
+                with self._lock:
+                    self._active -= 1
+                put((_DONE, None))
+
+        loop.run_in_executor(self._executor, run)
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == _DONE:
+                    break
+                if kind == _ERROR:
+                    raise payload
+                yield kind, payload
+        finally:
+            cancelled.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"active": self._active, "max_concurrent": self.max_concurrent}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def coalesce_tokens(
+    items: AsyncIterator[Tuple[str, Any]],
+    max_delay: float = 0.05,
+    max_chars: int = 256,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Merge consecutive `(TOKEN, text)` items from `AgentStreamer.stream` into
+    larger deltas, passing other items through in order.
+
+    The first token of a run is yielded right away to keep time-to-first-byte
+    low. After that a delta is yielded once it holds `max_chars` characters or
+    its oldest token is `max_delay` seconds old. While the consumer is busy
+    sending, tokens keep queueing up and are merged into the next delta, so a
+    slow client gets fewer, larger frames.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = items.__aiter__()
+    buffer: list = []
+    size = 0
+    deadline = None
+    first = True
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield TOKEN, "".join(buffer)
+                buffer, size, deadline = [], 0, None
+                continue
+
+            finished, pending = pending, None
+            try:
+                kind, payload = finished.result()
+            except StopAsyncIteration:
+                break
+
+            if kind != TOKEN:
+                if buffer:
+                    yield TOKEN, "".join(buffer)
+                    buffer, size, deadline = [], 0, None
+                yield kind, payload
+                continue
+
+            buffer.append(payload)
+            size += len(payload)
+            if first or size >= max_chars:
+                first = False
+                yield TOKEN, "".join(buffer)
+                buffer, size, deadline = [], 0, None
+            elif deadline is None:
+                deadline = loop.time() + max_delay
+
+        if buffer:
+            yield TOKEN, "".join(buffer)
+    finally:
+        # Stop the underlying run, which cancels the agent at its next step
+        if pending is not None:
+            pending.cancel()
+        else:
+            await iterator.aclose()
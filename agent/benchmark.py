@@ -0,0 +1,368 @@
+"""
+End-to-end benchmark of the API.
+
+Starts the FastAPI app in-process on a local port with a fake LLM, fake CDP
+wallets, an in-memory NPC store and fake domain registration (or a local EVM
+node with --rpc-url), then drives /create-wallet, /npc-config and /ws (whole
+replies, and time to the first streamed token) and reports throughput,
+latency percentiles, event loop blocking and memory per stage. Cold start is
+measured as the time to import the app in a fresh interpreter and the time
+from server start until /ready reports the warm-up done:
+
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+import uvicorn
+import websockets
+
+from simulate import percentiles
+
+BENCH_NPC = {
+    "name": "Bench NPC",
+    "background": "A trader spun up to measure the creation pipeline.",
+    "appearance": "Plain grey avatar.",
+    "personality": {"riskTolerance": 50, "rationality": 50, "autonomy": 50},
+    "core_values": ["speed"],
+    "primary_aims": ["throughput"],
+    "voice": {"type": "neutral", "sample": None},
+}
+
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked by sleeping for `interval` and
+    recording how late each wake-up is.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+    def reset(self) -> None:
+        self.samples = []
+
+    def report(self) -> dict:
+        lag = percentiles(self.samples)
+        return {
+            "max_ms": round(max(self.samples, default=0) * 1000, 2),
+            "p99_ms": lag["p99"],
+            "blocked_ms": round(sum(self.samples) * 1000, 2),
+        }
+
+
+async def run_stage(
+    name: str,
+    monitor: LoopLagMonitor,
+    count: int,
+    concurrency: int,
+    call: Callable[[int], Awaitable[Optional[List[float]]]],
+) -> dict:
+    """
+    Run `call(i)` for `count` values of i, `concurrency` at a time. A call may
+    return its own list of latencies (e.g. one per chat message); otherwise the
+    duration of the call is recorded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                measured = await call(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+            latencies.extend(measured if measured is not None else [time.perf_counter() - started])
+
+    monitor.reset()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "operations": len(latencies),
+        "errors": len(errors),
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": percentiles(latencies),
+        "event_loop": monitor.report(),
+    }
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        result["memory_kb"] = {
+            "peak": round((peak - memory_before) / 1024, 1),
+            "retained": round((current - memory_before) / 1024, 1),
+        }
+    if errors:
+        result["first_error"] = errors[0]
+    print(f"{name}: {result['operations']} ops, {result['throughput']}/s, p95 {result['latency_ms']['p95']} ms", file=sys.stderr)
+    return result
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions of `report` against `baseline` beyond `tolerance` (a fraction)."""
+    regressions = []
+    for stage, metrics in report["stages"].items():
+        if metrics["errors"]:
+            regressions.append(f"{stage}: {metrics['errors']} errors ({metrics.get('first_error')})")
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        if base["throughput"] and metrics["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{stage}: throughput {metrics['throughput']}/s vs {base['throughput']}/s")
+        for p in ("p50", "p95", "p99"):
+            now, before = metrics["latency_ms"][p], base["latency_ms"][p]
+            if now is not None and before is not None and now > before * (1 + tolerance):
+                regressions.append(f"{stage}: {p} {now} ms vs {before} ms")
+        # Sub-millisecond jitter isn't a regression
+        now, before = metrics["event_loop"]["max_ms"], base["event_loop"]["max_ms"]
+        if now > max(before * (1 + tolerance), 5):
+            regressions.append(f"{stage}: event loop blocked {now} ms vs {before} ms")
+        if "memory_kb" in metrics and "memory_kb" in base:
+            now, before = metrics["memory_kb"]["peak"], base["memory_kb"]["peak"]
+            if now > max(before * (1 + tolerance), 1024):
+                regressions.append(f"{stage}: peak memory {now} KB vs {before} KB")
+    return regressions
+
+
+def prepare_app(args, workdir: str):
+    """Import the app with every external service replaced by a local stand-in."""
+    os.environ["CHECKPOINT_DB"] = os.path.join(workdir, "checkpoints.sqlite")
+    os.environ["WALLET_POOL_FILE"] = os.path.join(workdir, "wallet_pool.json")
+    os.environ["SHARED_STATE_URL"] = os.path.join(workdir, "shared_state.sqlite")
+    os.environ["ACTION_LOG_DB"] = os.path.join(workdir, "action_log.sqlite")
+    os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:54321")
+    os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+    os.environ.pop("INDEXER_START_BLOCK", None)
+    if not args.rpc_url:
+        # Balance tracking needs a chain
+        os.environ["PORTFOLIO_ENABLED"] = "false"
+        # No chain to attest action batches on
+        os.environ.pop("SIGN_PROTOCOL_ADDRESS", None)
+    if args.rpc_url:
+        os.environ["RPC_URL"] = args.rpc_url
+
+    import main
+    from conversation import build_checkpointer
+    from chain_client import CONTRACT_ADDRESS, get_chain_client
+    from fakes import FakeChatModel, FakeRateLimit, FakeWalletBackend, OfflineNameService, fake_register_npc_domain
+    from llm_scheduler import ScheduledChatModel
+    from npc_store import InMemoryNPCStore
+    from wallet_pool import WalletPool
+
+    main.npc_config_file = os.path.join(workdir, "npc_config.json")
+    main._npc_store = InMemoryNPCStore()
+    main.wallet_pool = WalletPool(
+        FakeWalletBackend(args.wallet_latency),
+        path=os.environ["WALLET_POOL_FILE"],
+        target_size=args.wallet_pool_size,
+        low_water=max(args.wallet_pool_size // 2, 1),
+        state=main.shared_state,
+    )
+    main._shared_resources = {
+        "llm": ScheduledChatModel(
+            model=FakeChatModel(
+                latency=args.llm_latency,
+                rate_limit=FakeRateLimit(args.llm_rpm) if args.llm_rpm else None,
+            ),
+            scheduler=main.get_llm_scheduler(),
+        ),
+        "tools": [],
+        "memory": build_checkpointer(os.environ["CHECKPOINT_DB"]),
+    }
+    if not args.rpc_url:
+        main.register_npc_domain = fake_register_npc_domain(args.registration_latency)
+        main._name_service = OfflineNameService(get_chain_client(), CONTRACT_ADDRESS, state=main.shared_state)
+    return main
+
+
+async def benchmark(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="npc-bench-")
+    main = prepare_app(args, workdir)
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    booting = time.perf_counter()
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    serving_after = time.perf_counter() - booting
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}") as http:
+        while (await http.get("/ready")).status_code != 200:
+            await asyncio.sleep(0.01)
+    ready_after = time.perf_counter() - booting
+
+    monitor = LoopLagMonitor()
+    monitoring = asyncio.create_task(monitor.run())
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    run_id = uuid.uuid4().hex[:8]
+    wallets: List[str] = []
+    stages = {}
+    try:
+        async def cold_import(i: int) -> None:
+            # A fresh interpreter, like a new worker or a reload
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-c", "import main",
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+            if process.returncode:
+                lines = stderr.decode().strip().splitlines()
+                raise RuntimeError(lines[-1] if lines else f"exit status {process.returncode}")
+
+        stages["cold_import"] = await run_stage("cold_import", monitor, args.cold_starts, 1, cold_import)
+
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+            async def create_wallet(i: int) -> None:
+                response = await http.post("/create-wallet")
+                response.raise_for_status()
+
+            async def create_npc(i: int) -> None:
+                response = await http.post(
+                    "/npc-config",
+                    json={**BENCH_NPC, "name": f"Bench {run_id} {i}"},
+                    headers={"Idempotency-Key": f"{run_id}-{i}"},
+                )
+                response.raise_for_status()
+                wallets.append(response.json()["wallet"]["wallet_address"])
+
+            stages["create_wallet"] = await run_stage("create_wallet", monitor, args.requests, args.concurrency, create_wallet)
+            stages["npc_config"] = await run_stage("npc_config", monitor, args.requests, args.concurrency, create_npc)
+
+        async def chat(i: int) -> List[float]:
+            npc = wallets[i % len(wallets)] if wallets else ""
+            latencies = []
+            async with websockets.connect(f"ws://127.0.0.1:{args.port}/ws?npc={npc}") as ws:
+                frame = json.loads(await ws.recv())
+                if frame.get("type") != "session":
+                    raise RuntimeError(f"Unexpected frame {frame}")
+                for n in range(args.messages):
+                    started = time.perf_counter()
+                    await ws.send(json.dumps({"message": f"Benchmark message {n}"}))
+                    while True:
+                        frame = json.loads(await ws.recv())
+                        if frame.get("type") == "agent":
+                            # Failed runs are reported as agent frames too
+                            if str(frame.get("content", "")).startswith("Error processing message"):
+                                raise RuntimeError(frame["content"])
+                            break
+                        if frame.get("type") == "error":
+                            raise RuntimeError(frame.get("content"))
+                    latencies.append(time.perf_counter() - started)
+            return latencies
+
+        async def first_token(i: int) -> List[float]:
+            npc = wallets[i % len(wallets)] if wallets else ""
+            latencies = []
+            async with websockets.connect(f"ws://127.0.0.1:{args.port}/ws?npc={npc}&stream=tokens") as ws:
+                json.loads(await ws.recv())
+                for n in range(args.messages):
+                    started = time.perf_counter()
+                    first = None
+                    await ws.send(json.dumps({"message": f"Benchmark message {n}"}))
+                    while True:
+                        frame = json.loads(await ws.recv())
+                        if frame.get("type") == "delta" and first is None:
+                            first = time.perf_counter() - started
+                        elif frame.get("type") == "agent_end":
+                            if first is None:
+                                raise RuntimeError("Reply finished without streamed tokens")
+                            break
+                        elif frame.get("type") in ("agent", "error"):
+                            raise RuntimeError(frame.get("content"))
+                    latencies.append(first)
+            return latencies
+
+        stages["ws_chat"] = await run_stage("ws_chat", monitor, args.connections, args.connections, chat)
+        stages["ws_first_token"] = await run_stage("ws_first_token", monitor, args.connections, args.connections, first_token)
+    finally:
+        tracemalloc.stop()
+        monitoring.cancel()
+        server.should_exit = True
+        await serving
+
+    return {
+        "created_at": time.time(),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "connections": args.connections,
+            "cold_starts": args.cold_starts,
+            "messages": args.messages,
+            "llm_latency": args.llm_latency,
+            "llm_rpm": args.llm_rpm,
+            "wallet_latency": args.wallet_latency,
+            "wallet_pool_size": args.wallet_pool_size,
+            "chain": args.rpc_url or "fake",
+            "tracemalloc": args.tracemalloc,
+        },
+        "startup": {
+            "serving_ms": round(serving_after * 1000, 2),
+            "ready_ms": round(ready_after * 1000, 2),
+        },
+        "stages": stages,
+        "llm_scheduler": main.get_llm_scheduler().stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark NPC creation and chat against local stand-ins")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per HTTP stage")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent HTTP requests")
+    parser.add_argument("--connections", type=int, default=20, help="Concurrent websocket connections")
+    parser.add_argument("--messages", type=int, default=5, help="Chat messages per connection")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake LLM latency in seconds")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="Requests per minute the fake LLM allows before answering 429")
+    parser.add_argument("--wallet-latency", type=float, default=0.2, help="Fake CDP wallet creation latency in seconds")
+    parser.add_argument("--wallet-pool-size", type=int, default=5, help="Wallets kept ready by the pool")
+    parser.add_argument("--registration-latency", type=float, default=0.05, help="Fake domain registration latency in seconds")
+    parser.add_argument("--rpc-url", help="Local EVM node for real domain registrations (needs CONTRACT_ADDRESS and ETH_PRIVATE_KEY)")
+    parser.add_argument("--cold-starts", type=int, default=3, help="Fresh interpreter imports of the app to time")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false", help="Skip memory tracing, which slows everything down")
+    parser.add_argument("--baseline", help="Baseline report to compare against, exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression as a fraction of the baseline")
+    parser.add_argument("--save-baseline", help="Write this run's report to a file")
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,254 @@
+import os
+import threading
+import time
+from functools import cached_property
+from typing import Dict, List, Sequence, Tuple
+
+import requests
+from eth_abi import decode, encode
+from eth_account import Account
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+
+from metrics import rpc_calls, rpc_seconds
+
+RPC_URL = os.getenv("RPC_URL", "https://base-sepolia.blockpi.network/v1/rpc/public")
+CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0xab8CF91658009e0Eb123c60bCe2120A7E13C9ff2")
+# L2Registrar exposing registerBatch, registrations are sent one by one when unset
+REGISTRAR_ADDRESS = os.getenv("REGISTRAR_ADDRESS")
+
+# Multicall3 is deployed at the same address on every major chain, including Base Sepolia
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+AGGREGATE3_SELECTOR = Web3.keccak(text="aggregate3((address,bool,bytes)[])")[:4]
+
+# Functions of L2Registry (and the register entry point shared with L2Registrar) used by the backend
+L2_REGISTRY_ABI = [
+    {
+        "inputs": [
+            {"internalType": "string", "name": "label", "type": "string"},
+            {"internalType": "address", "name": "owner", "type": "address"}
+        ],
+        "name": "register",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "bytes32", "name": "labelhash", "type": "bytes32"}],
+        "name": "addr",
+        "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "bytes32", "name": "labelhash", "type": "bytes32"},
+            {"internalType": "string", "name": "key", "type": "string"}
+        ],
+        "name": "text",
+        "outputs": [{"internalType": "string", "name": "", "type": "string"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "bytes32", "name": "labelhash", "type": "bytes32"}],
+        "name": "labelFor",
+        "outputs": [{"internalType": "string", "name": "", "type": "string"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "ownerOf",
+        "outputs": [{"internalType": "address", "name": "", "type": "address"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+]
+
+# Functions of L2Registrar used by the backend
+L2_REGISTRAR_ABI = [
+    L2_REGISTRY_ABI[0],
+    {
+        "inputs": [
+            {"internalType": "string[]", "name": "labels", "type": "string[]"},
+            {"internalType": "address[]", "name": "owners", "type": "address[]"}
+        ],
+        "name": "registerBatch",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "uint256", "name": "tokenId", "type": "uint256"}],
+        "name": "available",
+        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+]
+
+
+# Sign Protocol (SP) contract attesting action log roots, attestations are skipped when unset
+SIGN_PROTOCOL_ADDRESS = os.getenv("SIGN_PROTOCOL_ADDRESS")
+
+# The on-chain `attest` entry point of Sign Protocol and the event carrying the new attestation id
+SIGN_PROTOCOL_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "uint64", "name": "schemaId", "type": "uint64"},
+                    {"internalType": "uint64", "name": "linkedAttestationId", "type": "uint64"},
+                    {"internalType": "uint64", "name": "attestTimestamp", "type": "uint64"},
+                    {"internalType": "uint64", "name": "revokeTimestamp", "type": "uint64"},
+                    {"internalType": "address", "name": "attester", "type": "address"},
+                    {"internalType": "uint64", "name": "validUntil", "type": "uint64"},
+                    {"internalType": "enum DataLocation", "name": "dataLocation", "type": "uint8"},
+                    {"internalType": "bool", "name": "revoked", "type": "bool"},
+                    {"internalType": "bytes[]", "name": "recipients", "type": "bytes[]"},
+                    {"internalType": "bytes", "name": "data", "type": "bytes"}
+                ],
+                "internalType": "struct Attestation",
+                "name": "attestation",
+                "type": "tuple"
+            },
+            {"internalType": "string", "name": "indexingKey", "type": "string"},
+            {"internalType": "bytes", "name": "delegateSignature", "type": "bytes"},
+            {"internalType": "bytes", "name": "extraData", "type": "bytes"}
+        ],
+        "name": "attest",
+        "outputs": [{"internalType": "uint64", "name": "", "type": "uint64"}],
+        "stateMutability": "payable",
+        "type": "function"
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": False, "internalType": "uint64", "name": "attestationId", "type": "uint64"},
+            {"indexed": False, "internalType": "string", "name": "indexingKey", "type": "string"}
+        ],
+        "name": "AttestationMade",
+        "type": "event"
+    },
+]
+
+
+class InstrumentedHTTPProvider(Web3.HTTPProvider):
+    """HTTP provider counting and timing every JSON-RPC request by method."""
+
+    def make_request(self, method, params):
+        started = time.perf_counter()
+        try:
+            response = super().make_request(method, params)
+        except Exception:
+            rpc_calls.inc(method=method, status="error")
+            raise
+        finally:
+            rpc_seconds.observe(time.perf_counter() - started, method=method)
+        rpc_calls.inc(method=method, status="error" if "error" in response else "success")
+        return response
+
+
+class ChainClient:
+    """
+    Shared connection to an RPC endpoint.
+
+    Holds one Web3 instance backed by a pooled keep-alive HTTP session, builds
+    contract objects once per address and caches values that never change for
+    the lifetime of the process, such as the chain id.
+
+    Args:
+        rpc_url: URL of the RPC endpoint
+        pool_size: Maximum number of keep-alive connections to the endpoint
+        timeout: Request timeout in seconds
+    """
+
+    def __init__(self, rpc_url: str, pool_size: int = 20, timeout: float = 30):
+        self.rpc_url = rpc_url
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.session = session
+        self.w3 = Web3(InstrumentedHTTPProvider(rpc_url, session=session, request_kwargs={"timeout": timeout}))
+        self._contracts: Dict[str, object] = {}
+        self._accounts: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    @cached_property
+    def chain_id(self) -> int:
+        return self.w3.eth.chain_id
+
+    def registry(self, address: str = CONTRACT_ADDRESS):
+        """Return the L2Registry contract at `address`, built once per address."""
+        return self._contract("registry", address, L2_REGISTRY_ABI)
+
+    def registrar(self, address: str):
+        """Return the L2Registrar contract at `address`, built once per address."""
+        return self._contract("registrar", address, L2_REGISTRAR_ABI)
+
+    def sign_protocol(self, address: str):
+        """Return the Sign Protocol contract at `address`, built once per address."""
+        return self._contract("sign_protocol", address, SIGN_PROTOCOL_ABI)
+
+    def _contract(self, kind: str, address: str, abi: list):
+        key = f"{kind}:{Web3.to_checksum_address(address)}"
+        with self._lock:
+            contract = self._contracts.get(key)
+            if contract is None:
+                contract = self.w3.eth.contract(address=Web3.to_checksum_address(address), abi=abi)
+                self._contracts[key] = contract
+            return contract
+
+    def account(self, private_key: str):
+        """Return the signer for `private_key`, parsed once."""
+        with self._lock:
+            account = self._accounts.get(private_key)
+            if account is None:
+                account = Account.from_key(private_key)
+                self._accounts[private_key] = account
+            return account
+
+    def labelhash(self, label: str) -> bytes:
+        return Web3.keccak(text=label)
+
+    def aggregate(
+        self,
+        calls: Sequence[Tuple[str, bytes]],
+        batch_size: int = 500,
+        block_identifier="latest",
+    ) -> List[Tuple[bool, bytes]]:
+        """
+        Run read-only calls through Multicall3 `aggregate3`, `batch_size` calls per
+        eth_call, at `block_identifier`. Each call is `(target, calldata)`; failures
+        (e.g. reverts) are returned as `(False, revert_data)` instead of failing the
+        whole batch.
+        """
+        results: List[Tuple[bool, bytes]] = []
+        for start in range(0, len(calls), batch_size):
+            chunk = [
+                (Web3.to_checksum_address(target), True, calldata)
+                for target, calldata in calls[start:start + batch_size]
+            ]
+            data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [chunk])
+            raw = self.w3.eth.call(
+                {"to": Web3.to_checksum_address(MULTICALL3_ADDRESS), "data": data}, block_identifier
+            )
+            (decoded,) = decode(["(bool,bytes)[]"], bytes(raw))
+            results.extend((success, bytes(returndata)) for success, returndata in decoded)
+        return results
+
+
+_clients: Dict[str, ChainClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_chain_client(rpc_url: str = RPC_URL) -> ChainClient:
+    """Return the process-wide client for `rpc_url`, creating it on first use."""
+    with _clients_lock:
+        client = _clients.get(rpc_url)
+        if client is None:
+            client = ChainClient(rpc_url)
+            _clients[rpc_url] = client
+        return client
@@ -0,0 +1,173 @@
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage, ToolMessage
+
+if TYPE_CHECKING:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def thread_id_for(npc_id: str, session_id: str) -> str:
+    """Each (NPC, session) pair gets its own conversation thread."""
+    return f"{npc_id}:{session_id}"
+
+
+def build_checkpointer(db_path: str) -> "SqliteSaver":
+    """Create a SQLite backed checkpointer so conversations survive restarts."""
+    # Imported here so importing this module doesn't load langgraph
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return SqliteSaver(conn)
+
+
+def prune_checkpoints(checkpointer: "SqliteSaver", keep: int = 5) -> int:
+    """
+    Delete superseded checkpoints, keeping the newest `keep` per thread and namespace.
+
+    The latest checkpoint of a thread already holds its full message list, older
+    ones are only needed for time travel, so this bounds the database to roughly
+    one conversation's worth of rows per thread. Returns the number of rows removed.
+    """
+    conn = checkpointer.conn
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(checkpoints)")}
+    if "checkpoint_id" in columns:
+        id_column = "checkpoint_id"
+    elif "thread_ts" in columns:
+        id_column = "thread_ts"
+    else:
+        return 0
+    # Subgraphs checkpoint under their own namespace of the parent's thread
+    partition = "thread_id, checkpoint_ns" if "checkpoint_ns" in columns else "thread_id"
+    same_namespace = "AND c.checkpoint_ns = writes.checkpoint_ns" if "checkpoint_ns" in columns else ""
+
+    lock = getattr(checkpointer, "lock", None) or threading.Lock()
+    with lock:
+        cursor = conn.execute(
+            f"""
+            DELETE FROM checkpoints WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY {partition} ORDER BY {id_column} DESC
+                    ) AS position FROM checkpoints
+                ) WHERE position > ?
+            )
+            """,
+            (keep,),
+        )
+        removed = cursor.rowcount
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "writes" in tables and id_column == "checkpoint_id":
+            conn.execute(
+                f"""
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id AND c.checkpoint_id = writes.checkpoint_id
+                    {same_namespace}
+                )
+                """
+            )
+        conn.commit()
+    return removed
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """Cheap token estimate (~4 characters per token plus per-message overhead)."""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        content += str(tool_calls)
+    return len(content) // 4 + 4
+
+
+def window_messages(
+    messages: List[BaseMessage],
+    max_tokens: int,
+    count_tokens: Callable[[BaseMessage], int] = estimate_tokens,
+) -> List[BaseMessage]:
+    """
+    Keep the most recent messages that fit in `max_tokens`.
+
+    The newest message is always kept. The window never starts with a tool
+    result, since a ToolMessage without the AI message that requested it is
+    rejected by the model API.
+    """
+    window: List[BaseMessage] = []
+    used = 0
+    for message in reversed(messages):
+        cost = count_tokens(message)
+        if window and used + cost > max_tokens:
+            break
+        window.append(message)
+        used += cost
+    window.reverse()
+    while len(window) > 1 and isinstance(window[0], ToolMessage):
+        window.pop(0)
+    return window
+
+
+class HistoryMetrics:
+    """Tracks per-thread history size and what was actually sent to the model."""
+
+    def __init__(self, max_threads: int = 10000):
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, thread_id: str, stored: int, sent: int, sent_tokens: int) -> None:
+        with self._lock:
+            entry = self._threads.pop(thread_id, None) or {"turns": 0}
+            entry.update({
+                "stored_messages": stored,
+                "sent_messages": sent,
+                "sent_tokens": sent_tokens,
+                "dropped_messages": stored - sent,
+                "turns": entry["turns"] + 1,
+                "updated_at": time.time(),
+            })
+            self._threads[thread_id] = entry
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def get(self, thread_id: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            return dict(entry) if entry else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {thread_id: dict(entry) for thread_id, entry in self._threads.items()}
+
+
+def make_state_modifier(system_prompt: str, max_tokens: int, metrics: Optional[HistoryMetrics] = None):
+    """
+    Build a `state_modifier` for create_react_agent that prepends the system prompt
+    and only forwards the most recent `max_tokens` worth of history to the model.
+    """
+    system_message = SystemMessage(content=system_prompt)
+    budget = max(max_tokens - estimate_tokens(system_message), 0)
+
+    def modifier(state, config=None):
+        messages = state["messages"]
+        window = window_messages(messages, budget)
+        if metrics is not None and config:
+            thread_id = config.get("configurable", {}).get("thread_id")
+            if thread_id:
+                metrics.record(
+                    thread_id,
+                    stored=len(messages),
+                    sent=len(window),
+                    sent_tokens=sum(estimate_tokens(m) for m in window),
+                )
+        return [system_message] + window
+
+    return modifier
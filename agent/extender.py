@@ -3,6 +3,9 @@ from cdp_langchain.tools import CdpTool
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
+from prompts import compile_prompt
+from tool_cache import cache_tools, cached_tool
+from token_analytics import get_default_engine
 
 # Custom action schemas
 class PredictionMarketBet(BaseModel):
@@ -53,40 +56,76 @@ def place_prediction_bet(wallet: Wallet, bet: PredictionMarketBet) -> str:
 def analyze_token(wallet: Wallet, analysis: TokenAnalysis) -> str:
     """Analyze a token's metrics and provide insights."""
     try:
-        # Implementation would fetch on-chain data and analyze metrics
-        return f"""
-        Token Analysis for {analysis.token_address}:
-        - Liquidity: Analyzing pool depth and stability
-        - Volume: Checking 24h trading volume
-        - Holders: Analyzing holder distribution
-        - Price History: Examining price movements
-        
-        Analysis complete. Token appears to be {get_risk_assessment(analysis.token_address)}.
-        """
+        report = get_default_engine().analyze(analysis.token_address)
+        if report is None:
+            return f"No indexed on-chain data for token {analysis.token_address}."
+
+        lines = [f"Token Analysis for {analysis.token_address}:"]
+        if "liquidity" in analysis.metrics:
+            lines.append(f"- Liquidity: {report['liquidity_eth']:.2f} ETH")
+        if "volume" in analysis.metrics:
+            lines.append(f"- Volume (24h): {report['volume_24h_eth']:.2f} ETH")
+        if "holders" in analysis.metrics:
+            lines.append(
+                f"- Holders: {report['holders']} "
+                f"(top 10 hold {report['top_holders_share']:.0%}, Gini {report['gini']:.2f})"
+            )
+        if "price_history" in analysis.metrics and report["price_history"]:
+            prices = [point["price_eth"] for point in report["price_history"]]
+            change = (prices[-1] / prices[0] - 1) if prices[0] else 0.0
+            lines.append(
+                f"- Price: {prices[-1]:.8f} ETH, {change:+.1%} over the last {len(prices)} hourly points"
+            )
+        lines.append("")
+        lines.append(f"Analysis complete. Token appears to be {get_risk_assessment(analysis.token_address)}.")
+        return "\n".join(lines)
     except Exception as e:
         return f"Error analyzing token: {str(e)}"
 
 def discover_tokens(wallet: Wallet, params: TokenDiscovery) -> str:
     """Find new tokens matching specified criteria."""
     try:
-        # Implementation would scan DEXs and token listings
-        return f"""
-        Discovered tokens matching criteria:
-        1. Token A (0x123...): New DeFi protocol, 2000 ETH liquidity
-        2. Token B (0x456...): GameFi project, 1500 ETH liquidity
-        3. Token C (0x789...): DAO governance token, 3000 ETH liquidity
-        
-        Detailed analysis available using analyze_token tool.
-        """
+        tokens = get_default_engine().screen(
+            min_liquidity=params.min_liquidity or 0,
+            max_age=params.max_age,
+            min_holders=params.min_holders or 0,
+        )
+        if not tokens:
+            return "No indexed tokens match these criteria."
+
+        lines = ["Discovered tokens matching criteria:"]
+        for i, token in enumerate(tokens, 1):
+            lines.append(
+                f"{i}. {token['token_address']}: {token['liquidity_eth']:.2f} ETH liquidity, "
+                f"{token['holders']} holders, {token['age_days']:.1f} days old"
+            )
+        lines.append("")
+        lines.append("Detailed analysis available using analyze_token tool.")
+        return "\n".join(lines)
     except Exception as e:
         return f"Error discovering tokens: {str(e)}"
 
+@cached_tool("get_risk_assessment")
 def get_risk_assessment(token_address: str) -> str:
     """Helper function to assess token risk."""
-    # Implementation would analyze various risk factors
-    return "MEDIUM RISK - Moderate liquidity, growing holder base"
+    report = get_default_engine().analyze(token_address)
+    if report is None:
+        return "UNKNOWN RISK - No on-chain data indexed"
+
+    concerns = []
+    if report["liquidity_eth"] < 10:
+        concerns.append("thin liquidity")
+    if report["top_holders_share"] > 0.5:
+        concerns.append("concentrated holders")
+    if report["holders"] < 100:
+        concerns.append("small holder base")
+    if report["age_days"] is not None and report["age_days"] < 1:
+        concerns.append("less than a day old")
+
+    level = "LOW" if not concerns else "MEDIUM" if len(concerns) == 1 else "HIGH"
+    return f"{level} RISK - " + (", ".join(concerns) if concerns else "deep liquidity, distributed holders")
 
-def initialize_agent():
+def initialize_agent(npc_config: Optional[dict] = None):
     """Initialize the agent with CDP Agentkit and custom tools."""
     agentkit = CdpAgentkitWrapper(**values)
     cdp_toolkit = CdpToolkit.from_cdp_agentkit_wrapper(agentkit)
@@ -117,32 +156,15 @@ def initialize_agent():
         func=discover_tokens,
     )
 
-    # Combine all tools
-    all_tools = base_tools + [prediction_tool, analysis_tool, discovery_tool]
+    # Combine all tools, caching the read-only ones
+    all_tools = cache_tools(base_tools + [prediction_tool, analysis_tool, discovery_tool])
 
     # Store buffered conversation history in memory
     memory = MemorySaver()
     config = {"configurable": {"thread_id": "Enhanced CDP Agentkit Agent"}}
 
     # Create ReAct Agent with enhanced capabilities
-    state_modifier = """You are an advanced AI agent specialized in DeFi operations and market analysis.
-    You can:
-    1. Place bets on prediction markets with careful risk assessment
-    2. Analyze tokens using multiple metrics (liquidity, volume, holders, price)
-    3. Discover new tokens matching specific criteria
-    
-    Always explain your reasoning and provide risk warnings when appropriate.
-    Consider the NPC's personality traits when making decisions:
-    - Risk Tolerance affects bet sizes and token recommendations
-    - Rationality influences analysis depth and decision-making
-    - Autonomy determines how much confirmation you seek before actions
-    
-    Remember to:
-    - Start with analysis before making recommendations
-    - Provide clear risk warnings
-    - Explain your reasoning
-    - Consider the user's goals and risk tolerance
-    """
+    state_modifier = compile_prompt(npc_config, template="defi").text
 
     return create_react_agent(
         llm,
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from web3 import Web3
+
+from name_service import NameService
+
+FAKE_REPLY = "Greetings, traveller. The markets are quiet today, so I am holding my position and watching liquidity."
+
+
+class FakeRateLimitError(Exception):
+    """Provider 429, shaped like the OpenAI client's RateLimitError."""
+
+    status_code = 429
+
+
+class FakeRateLimit:
+    """Provider-side limit of `requests_per_minute` calls in any 60 second window."""
+
+    def __init__(self, requests_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.rejected = 0
+        self._calls: deque = deque()
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            while self._calls and now - self._calls[0] >= 60:
+                self._calls.popleft()
+            if len(self._calls) >= self.requests_per_minute:
+                self.rejected += 1
+                raise FakeRateLimitError("Rate limit reached for requests")
+            self._calls.append(now)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering every turn with `reply` after `latency` seconds,
+    without tool calls. Streaming spreads the same latency over the reply's
+    words and reports each one to the callbacks like a real model would.
+    With a `rate_limit`, calls over it fail with a 429 like the provider's.
+    """
+
+    reply: str = FAKE_REPLY
+    latency: float = 0.05
+    rate_limit: Optional[Any] = None
+    # Like ChatOpenAI(streaming=True), generate through _stream so token callbacks fire
+    streaming: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+        if self.rate_limit is not None:
+            self.rate_limit.check()
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.rate_limit is not None:
+            self.rate_limit.check()
+        words = self.reply.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            token = word if i == 0 else f" {word}"
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeWalletBackend:
+    """WalletPool backend returning random wallets after `latency` seconds instead of calling CDP."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.created = 0
+
+    def create(self) -> dict:
+        time.sleep(self.latency)
+        self.created += 1
+        return {
+            "wallet_address": Web3.to_checksum_address("0x" + os.urandom(20).hex()),
+            "wallet_id": os.urandom(16).hex(),
+        }
+
+
+def fake_register_npc_domain(latency: float = 0.05):
+    """Stand-in for main.register_npc_domain when no local chain is available."""
+    async def register_npc_domain(domain_name: str, owner_address: str, on_mined=None) -> dict:
+        await asyncio.sleep(latency)
+        tx_hash = os.urandom(32)
+        if on_mined is not None:
+            # Mined a little later, like the receipt poller would report it
+            asyncio.get_running_loop().call_later(latency, on_mined, {"transactionHash": tx_hash, "status": 1})
+        return {"status": "success", "transaction_hash": Web3.to_hex(tx_hash)}
+    return register_npc_domain
+
+
+class OfflineNameService(NameService):
+    """NameService that treats names as available unless this process registered them, for runs without a chain."""
+
+    def is_available_on_chain(self, label: str) -> bool:
+        return not self.is_known_registered(label)
@@ -0,0 +1,193 @@
+import asyncio
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from chain_client import ChainClient
+from metrics import logger
+
+
+def call_signature(contract_function) -> tuple:
+    """
+    Key for gas memoization: contract, function and the size of each argument
+    (32-byte words for strings and bytes, items for arrays), so a batch of 50
+    labels isn't priced like a batch of 2.
+    """
+    sizes = []
+    for arg in contract_function.args:
+        if isinstance(arg, (str, bytes)):
+            sizes.append((len(arg) + 31) // 32)
+        elif isinstance(arg, (list, tuple)):
+            sizes.append(len(arg))
+        else:
+            sizes.append(None)
+    return (contract_function.address, contract_function.fn_name, tuple(sizes))
+
+
+class FeeOracle:
+    """
+    EIP-1559 fees for transaction senders, fetched once per block.
+
+    A single background loop (`run`) follows new heads and reads `eth_feeHistory`
+    for the last `history_blocks` blocks on each one, caching the next block's
+    base fee and the median `percentile` priority fee. Senders get type-2 fee
+    fields from memory instead of an `eth_gasPrice` round trip per transaction,
+    and never pay more than `base_fee_multiplier` times the base fee plus the
+    tip. Without the loop, fees are fetched on demand once `max_age` seconds
+    old. Chains without a base fee fall back to a legacy `gasPrice`.
+
+    Gas estimates are memoized per call signature (see `call_signature`),
+    keeping the highest estimate seen.
+
+    Args:
+        client: Shared chain client
+        history_blocks: Blocks of fee history to take the priority fee from
+        percentile: Priority fee percentile paid within each block
+        min_priority_fee: Floor for the priority fee in wei
+        base_fee_multiplier: Headroom for base fee increases while a transaction is pending
+        poll_interval: Seconds between checks for a new block
+        max_age: Seconds cached fees stay valid when `run` isn't following blocks
+        gas_cache_size: Number of memoized gas estimates
+    """
+
+    def __init__(
+        self,
+        client: ChainClient,
+        history_blocks: int = 10,
+        percentile: float = 50,
+        min_priority_fee: int = 1_000_000,
+        base_fee_multiplier: float = 2,
+        poll_interval: float = 2,
+        max_age: float = 6,
+        gas_cache_size: int = 256,
+    ):
+        self.client = client
+        self.history_blocks = history_blocks
+        self.percentile = percentile
+        self.min_priority_fee = min_priority_fee
+        self.base_fee_multiplier = base_fee_multiplier
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.gas_cache_size = gas_cache_size
+        self._fees: Optional[dict] = None
+        self._fetched_at = 0.0
+        self._gas: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self.gas_hits = 0
+        self.gas_misses = 0
+
+    # Fees
+
+    def refresh(self, block_number: Optional[int] = None) -> dict:
+        """Read fee history now and cache the fees for the next block."""
+        w3 = self.client.w3
+        history = w3.eth.fee_history(self.history_blocks, "latest", [self.percentile])
+        base_fees = history.get("baseFeePerGas") or []
+        if not base_fees or not any(base_fees):
+            fees = {"block": block_number, "gas_price": w3.eth.gas_price}
+        else:
+            # The last entry is the base fee of the block after the newest one
+            base_fee = base_fees[-1]
+            tips = [reward[0] for reward in history.get("reward") or [] if reward]
+            priority_fee = max(int(statistics.median(tips)) if tips else 0, self.min_priority_fee)
+            fees = {
+                "block": block_number,
+                "base_fee": base_fee,
+                "max_priority_fee_per_gas": priority_fee,
+                "max_fee_per_gas": int(base_fee * self.base_fee_multiplier) + priority_fee,
+            }
+        with self._lock:
+            self._fees = fees
+            self._fetched_at = time.monotonic()
+        return fees
+
+    def fees(self) -> dict:
+        """Cached fees, refreshed when `run` isn't keeping them current."""
+        with self._lock:
+            if self._fees is not None and time.monotonic() - self._fetched_at < self.max_age:
+                return self._fees
+        # One caller fetches, the others use its result
+        with self._fetch_lock:
+            with self._lock:
+                if self._fees is not None and time.monotonic() - self._fetched_at < self.max_age:
+                    return self._fees
+            return self.refresh()
+
+    def tx_params(self) -> dict:
+        """Fee fields for `build_transaction`, type-2 where the chain supports it."""
+        fees = self.fees()
+        if "gas_price" in fees:
+            return {"gasPrice": fees["gas_price"]}
+        return {
+            "type": 2,
+            "maxFeePerGas": fees["max_fee_per_gas"],
+            "maxPriorityFeePerGas": fees["max_priority_fee_per_gas"],
+        }
+
+    # Gas
+
+    def estimate_gas(self, contract_function, sender: str) -> int:
+        """Gas used by a call from `sender`, estimated once per call signature."""
+        key = call_signature(contract_function)
+        with self._lock:
+            gas = self._gas.get(key)
+            if gas is not None:
+                self._gas.move_to_end(key)
+                self.gas_hits += 1
+                return gas
+            self.gas_misses += 1
+        return self.remember_gas(contract_function, contract_function.estimate_gas({"from": sender}))
+
+    def remember_gas(self, contract_function, gas: int) -> int:
+        """Record an estimate made elsewhere. Returns the highest estimate for the signature."""
+        key = call_signature(contract_function)
+        with self._lock:
+            gas = max(gas, self._gas.get(key, 0))
+            self._gas[key] = gas
+            self._gas.move_to_end(key)
+            while len(self._gas) > self.gas_cache_size:
+                self._gas.popitem(last=False)
+        return gas
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "fees": self._fees,
+                "gas_estimates": len(self._gas),
+                "gas_hits": self.gas_hits,
+                "gas_misses": self.gas_misses,
+            }
+
+    async def run(self) -> None:
+        """Follow new heads and refresh fees once per block, off the event loop."""
+        last_block = None
+        while True:
+            try:
+                block_number = await asyncio.to_thread(lambda: self.client.w3.eth.block_number)
+                if block_number != last_block:
+                    await asyncio.to_thread(self.refresh, block_number)
+                    last_block = block_number
+                else:
+                    # Same block, cached fees are still current
+                    with self._lock:
+                        self._fetched_at = time.monotonic()
+            except Exception as e:
+                logger.error(f"Fee oracle: error refreshing fees: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+_oracles: Dict[str, FeeOracle] = {}
+_oracles_lock = threading.Lock()
+
+
+def get_fee_oracle(client: ChainClient) -> FeeOracle:
+    """Return the process-wide fee oracle for `client`'s endpoint, creating it on first use."""
+    with _oracles_lock:
+        oracle = _oracles.get(client.rpc_url)
+        if oracle is None:
+            oracle = FeeOracle(client)
+            _oracles[client.rpc_url] = oracle
+        return oracle
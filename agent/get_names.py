@@ -1,28 +1,32 @@
+import argparse
+import json
+from typing import Iterable, List, Sequence
 
+from eth_abi import decode, encode
 from web3 import Web3
-from web3.exceptions import ContractLogicError
 
-RPC_URL = "https://base-sepolia.blockpi.network/v1/rpc/public"  # e.g., "https://mainnet.infura.io/v3/YOUR-PROJECT-ID"
-CONTRACT_ADDRESS = "0xab8CF91658009e0Eb123c60bCe2120A7E13C9ff2"
+from chain_client import CONTRACT_ADDRESS, RPC_URL, get_chain_client
+
 LABEL = "test"  # or "boomboom"
 
-def get_address_for_label(label):
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
+ADDR_SELECTOR = Web3.keccak(text="addr(bytes32)")[:4]
+OWNER_OF_SELECTOR = Web3.keccak(text="ownerOf(uint256)")[:4]
+TEXT_SELECTOR = Web3.keccak(text="text(bytes32,string)")[:4]
+ZERO_ADDRESS = "0x" + "00" * 20
+
+def get_address_for_label(label, index=None):
+    # A synced local index answers without touching the RPC
+    if index is not None:
+        print(f"\nLabel: {label}")
+        print(f"Address: {index.resolve(label)}")
+        return
+
+    client = get_chain_client(RPC_URL)
     
     # Calculate labelhash as done in the contract
-    labelhash = w3.keccak(text=label)
+    labelhash = client.labelhash(label)
     
-    # Minimal ABI for addr function
-    abi = [
-        {
-            "inputs": [{"name": "labelhash", "type": "bytes32"}],
-            "name": "addr",
-            "outputs": [{"name": "", "type": "address"}],
-            "type": "function"
-        }
-    ]
-    
-    contract = w3.eth.contract(address=w3.to_checksum_address(CONTRACT_ADDRESS), abi=abi)
+    contract = client.registry(CONTRACT_ADDRESS)
     
     try:
         address = contract.functions.addr(labelhash).call()
@@ -31,5 +35,94 @@ def get_address_for_label(label):
     except Exception as e:
         print(f"Error looking up address: {str(e)}")
 
+def resolve_labels(
+    labels: Sequence[str],
+    text_keys: Iterable[str] = (),
+    rpc_url: str = RPC_URL,
+    contract_address: str = CONTRACT_ADDRESS,
+    batch_size: int = 500,
+) -> List[dict]:
+    """
+    Resolve many labels with a handful of RPC calls.
+
+    The addr, ownerOf and text reads for every label are packed into Multicall3
+    batches of `batch_size` calls each.
+
+    Args:
+        labels: Labels to resolve, without the .npc.eth suffix
+        text_keys: Text record keys to fetch for every label
+        rpc_url: URL of the RPC endpoint
+        contract_address: Address of the L2Registry contract
+        batch_size: Calls per eth_call
+
+    Returns:
+        One dict per label with labelhash, addr, owner, registered and texts
+    """
+    client = get_chain_client(rpc_url)
+    text_keys = list(text_keys)
+    calls = []
+    labelhashes = [client.labelhash(label) for label in labels]
+    for labelhash in labelhashes:
+        calls.append((contract_address, ADDR_SELECTOR + encode(["bytes32"], [labelhash])))
+        calls.append((contract_address, OWNER_OF_SELECTOR + encode(["uint256"], [int.from_bytes(labelhash, "big")])))
+        for key in text_keys:
+            calls.append((contract_address, TEXT_SELECTOR + encode(["bytes32", "string"], [labelhash, key])))
+
+    results = iter(client.aggregate(calls, batch_size=batch_size))
+    resolved = []
+    for label, labelhash in zip(labels, labelhashes):
+        addr_ok, addr_data = next(results)
+        owner_ok, owner_data = next(results)
+        addr = decode(["address"], addr_data)[0] if addr_ok else None
+        # ownerOf reverts for names that were never registered
+        owner = decode(["address"], owner_data)[0] if owner_ok else None
+        texts = {}
+        for key in text_keys:
+            text_ok, text_data = next(results)
+            value = decode(["string"], text_data)[0] if text_ok else ""
+            if value:
+                texts[key] = value
+        resolved.append({
+            "label": label,
+            "labelhash": Web3.to_hex(labelhash),
+            "addr": Web3.to_checksum_address(addr) if addr and addr != ZERO_ADDRESS else None,
+            "owner": Web3.to_checksum_address(owner) if owner else None,
+            "registered": owner is not None,
+            "texts": texts,
+        })
+    return resolved
+
+def read_labels(args) -> List[str]:
+    labels = []
+    if args.labels:
+        labels.extend(label.strip() for label in args.labels.split(","))
+    if args.file:
+        with open(args.file) as f:
+            labels.extend(line.strip() for line in f)
+    # Drop blanks and duplicates, keeping order
+    return list(dict.fromkeys(label for label in labels if label))
+
 if __name__ == "__main__":
-    get_address_for_label(LABEL)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Resolve .npc.eth names")
+    parser.add_argument("label", nargs="?", default=LABEL)
+    parser.add_argument("--labels", help="Comma separated labels to resolve in bulk")
+    parser.add_argument("--file", help="File with one label per line to resolve in bulk")
+    parser.add_argument("--text", action="append", default=[], help="Text record key to fetch (repeatable)")
+    parser.add_argument("--index", help="Path to a registry index database built by registry_indexer.py")
+    parser.add_argument("--list", action="store_true", help="List every name in the index")
+    args = parser.parse_args()
+
+    index = None
+    if args.index:
+        from registry_indexer import RegistryIndexer
+        index = RegistryIndexer(get_chain_client(RPC_URL), CONTRACT_ADDRESS, db_path=args.index)
+
+    if args.list:
+        if index is None:
+            parser.error("--list requires --index")
+        for record in index.list_names():
+            print(f"{record['label']}.npc.eth -> {record['addr']}")
+    elif args.labels or args.file:
+        print(json.dumps(resolve_labels(read_labels(args), text_keys=args.text), indent=2))
+    else:
+        get_address_for_label(args.label, index)
@@ -0,0 +1,385 @@
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from conversation import estimate_tokens
+from metrics import logger
+
+# Lower runs first. Callers pick a class with config metadata {"llm_priority": ...}
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND}
+PRIORITY_NAMES = {priority: name for name, priority in PRIORITIES.items()}
+
+# Longest pause after consecutive 429s without retry-after
+MAX_BACKOFF = 60
+
+
+class TokenBucket:
+    """
+    Refills `rate` units per second up to `capacity`. A rate of 0 disables
+    limiting. A request larger than the bucket is let through once the bucket
+    is full, leaving it in debt.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, 0 when it can be taken now."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return max(needed - self.level, 0) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        """Return over-reserved units, or take more with a negative amount."""
+        if self.rate > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+    def empty(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.level = min(self.level, 0)
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """429s from the OpenAI client (and anything else exposing the status code)."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_key(model: Any, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: dict) -> str:
+    """
+    Identity of a model call: the (tool-bound) model, message roles and contents,
+    and call options. Message ids are left out, so the same prompt from two
+    conversation threads has the same key.
+    """
+    payload = [
+        repr(model),
+        [(m.type, m.content, getattr(m, "tool_calls", None), getattr(m, "tool_call_id", None)) for m in messages],
+        stop,
+        kwargs,
+    ]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMScheduler:
+    """
+    Admission control for every chat model call of the process.
+
+    A call waits for a request permit and for its estimated tokens from two
+    token buckets (`requests_per_minute`, `tokens_per_minute`), and for one of
+    `limit` concurrency slots. Waiting calls are admitted by priority class,
+    then in arrival order, so interactive chats overtake background work.
+    Token reservations are corrected with the usage reported by the model.
+
+    The concurrency limit adapts: it shrinks by half on a 429, pausing all
+    admissions for the provider's `retry-after` (or an exponential backoff),
+    and by 10% while time to first token is over `latency_tolerance` times the
+    lowest one seen; otherwise it grows by one slot per `limit` calls. 429s
+    before the first token are retried here, after re-queueing, instead of by
+    the model client. Identical calls in flight at the same time are sent once
+    and every caller gets the same reply.
+
+    Args:
+        requests_per_minute: Request budget, 0 for no limit
+        tokens_per_minute: Prompt plus completion token budget, 0 for no limit
+        max_concurrency: Upper bound of the adaptive concurrency limit
+        min_concurrency: Lower bound of the adaptive concurrency limit
+        latency_tolerance: Time to first token, relative to the lowest seen, above which concurrency shrinks
+        max_retries: Retries of a rate limited call
+        backoff: Seconds to pause after a 429 without `retry-after`, doubled per consecutive 429 up to MAX_BACKOFF
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        latency_tolerance: float = 2.0,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute or None)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute or None)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limit = float(max_concurrency)
+        self._active = 0
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._consecutive_limited = 0
+        self._best_latency: Optional[float] = None
+        self._latency: Optional[float] = None
+        self._inflight: Dict[str, Future] = {}
+        self._cond = threading.Condition()
+        self.admitted = {name: 0 for name in PRIORITIES}
+        self.deduplicated = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    # Admission
+
+    def acquire(self, priority: int, tokens: int) -> None:
+        """Block until the call may start."""
+        entry = (priority, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._waiting[0] == entry and self._active < max(int(self.limit), self.min_concurrency):
+                        wait = max(
+                            self._paused_until - now,
+                            self.requests.wait_time(1, now),
+                            self.tokens.wait_time(tokens, now),
+                        )
+                        if wait <= 0:
+                            heapq.heappop(self._waiting)
+                            self.requests.take(1, now)
+                            self.tokens.take(tokens, now)
+                            self._active += 1
+                            # The next in line may fit too
+                            self._cond.notify_all()
+                            return
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def release(
+        self,
+        reserved: int,
+        used: Optional[int] = None,
+        latency: Optional[float] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Free the call's slot and feed its outcome to the limits."""
+        with self._cond:
+            self._active -= 1
+            if used is not None:
+                self.tokens.give_back(reserved - used)
+            if error is not None and is_rate_limit_error(error):
+                self.rate_limited += 1
+                self._consecutive_limited += 1
+                self.limit = max(self.limit / 2, self.min_concurrency)
+                pause = retry_after(error) or min(self.backoff * 2 ** (self._consecutive_limited - 1), MAX_BACKOFF)
+                now = time.monotonic()
+                self._paused_until = max(self._paused_until, now + pause)
+                self.requests.empty(now)
+            elif latency is not None:
+                self._consecutive_limited = 0
+                self._adapt(latency)
+            self._cond.notify_all()
+
+    def _adapt(self, latency: float) -> None:
+        # The lowest time to first token drifts up slowly, so one lucky call doesn't pin it
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        else:
+            self._best_latency *= 1.001
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        if self._latency > self.latency_tolerance * self._best_latency:
+            self.limit = max(self.limit * 0.9, self.min_concurrency)
+        else:
+            self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+
+    # Calls
+
+    def stream(
+        self,
+        call: Callable[[], Iterable[Any]],
+        priority: int = BACKGROUND,
+        tokens: int = 0,
+        key: Optional[str] = None,
+        count_tokens: Optional[Callable[[List[Any]], Optional[int]]] = None,
+    ) -> Iterator[Any]:
+        """
+        Run the streaming `call` once admitted and yield its chunks. With a
+        `key`, a caller arriving while the same key is in flight waits for it
+        and gets all of its chunks at once instead of calling the model.
+        `count_tokens` returns the tokens a finished call really used.
+        """
+        if key is None:
+            yield from self._run(call, priority, tokens, count_tokens)
+            return
+        with self._cond:
+            shared = self._inflight.get(key)
+            if shared is None:
+                shared = self._inflight[key] = Future()
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+        if not leader:
+            yield from shared.result()
+            return
+        chunks: List[Any] = []
+        try:
+            for chunk in self._run(call, priority, tokens, count_tokens):
+                chunks.append(chunk)
+                yield chunk
+            shared.set_result(chunks)
+        except BaseException as e:
+            # Followers of a cancelled call fail rather than hang
+            shared.set_exception(e if isinstance(e, Exception) else RuntimeError("Model call was cancelled"))
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def _run(self, call, priority: int, tokens: int, count_tokens) -> Iterator[Any]:
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority, tokens)
+            with self._cond:
+                self.admitted[PRIORITY_NAMES[priority]] += 1
+            started = time.perf_counter()
+            chunks: List[Any] = []
+            first_token = None
+            released = False
+            try:
+                for chunk in call():
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    chunks.append(chunk)
+                    yield chunk
+                used = count_tokens(chunks) if count_tokens is not None else None
+                released = True
+                self.release(tokens, used=used, latency=first_token)
+                return
+            except Exception as e:
+                released = True
+                self.release(tokens, error=e)
+                if chunks or not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"LLM call rate limited, retrying ({attempt + 1}/{self.max_retries})")
+            finally:
+                if not released:
+                    # The consumer stopped reading
+                    self.release(tokens)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "limit": round(self.limit, 2),
+                "active": self._active,
+                "waiting": {
+                    name: sum(1 for p, _ in self._waiting if p == priority)
+                    for name, priority in PRIORITIES.items()
+                },
+                "admitted": dict(self.admitted),
+                "deduplicated": self.deduplicated,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "paused_for": round(max(self._paused_until - now, 0), 3),
+                "time_to_first_token": round(self._latency, 4) if self._latency is not None else None,
+            }
+
+
+class ScheduledChatModel(BaseChatModel):
+    """
+    Chat model sending every call of the wrapped `model` through an
+    LLMScheduler. Calls are streamed so the scheduler can time the first token
+    and token callbacks still fire, whatever the wrapped model's `streaming`.
+    The priority class comes from the run's `llm_priority` metadata and
+    defaults to background.
+    """
+
+    model: Any
+    scheduler: Any
+    # Completion tokens reserved per call until the real usage is known
+    completion_tokens: int = 256
+
+    @property
+    def _llm_type(self) -> str:
+        return f"scheduled-{getattr(self.model, '_llm_type', 'model')}"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScheduledChatModel":
+        return ScheduledChatModel(
+            model=self.model.bind_tools(tools, **kwargs),
+            scheduler=self.scheduler,
+            completion_tokens=self.completion_tokens,
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        metadata = getattr(run_manager, "metadata", None) or {}
+        priority = PRIORITIES.get(metadata.get("llm_priority"), BACKGROUND)
+        prompt_tokens = sum(estimate_tokens(m) for m in messages)
+
+        def count_tokens(chunks: List[Any]) -> int:
+            for chunk in reversed(chunks):
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage:
+                    return usage["total_tokens"]
+            text = "".join(c.content for c in chunks if isinstance(c.content, str))
+            return prompt_tokens + len(text) // 4
+
+        chunks = self.scheduler.stream(
+            lambda: self.model.stream(messages, stop=stop, **kwargs),
+            priority=priority,
+            tokens=prompt_tokens + self.completion_tokens,
+            key=request_key(self.model, messages, stop, kwargs),
+            count_tokens=count_tokens,
+        )
+        for message in chunks:
+            if run_manager and isinstance(message.content, str) and message.content:
+                run_manager.on_llm_new_token(message.content, chunk=ChatGenerationChunk(message=message))
+            yield ChatGenerationChunk(message=message)
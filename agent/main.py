@@ -1,38 +1,100 @@
-from fastapi import FastAPI, WebSocket, HTTPException, WebSocketDisconnect
+from fastapi import FastAPI, Header, WebSocket, HTTPException, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 import os
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import create_react_agent
-from cdp_langchain.agent_toolkits import CdpToolkit
-from cdp_langchain.utils import CdpAgentkitWrapper
+import asyncio
 import json
-import traceback
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Optional, Literal
+from typing import TYPE_CHECKING, Optional, Literal
 from datetime import datetime
-from supabase import create_client, Client
-from cdp import Cdp, Wallet
-from web3 import Web3
-from eth_account import Account
+from agent_pool import AgentPool
+from prompts import compile_prompt, prompt_cache
+from provisioning import ProvisioningJob, ProvisioningJobs
+from tool_cache import cache_tools, tool_cache
+from npc_store import NPCStore
+from wallet_pool import CdpWalletBackend, WalletPool
+from agent_stream import TOKEN, AgentStreamer, coalesce_tokens
+from metrics import SAMPLED, LazyTruncate, logger, metrics_callback, registry, setup_logging, span
+from conversation import (
+    HistoryMetrics,
+    build_checkpointer,
+    make_state_modifier,
+    new_session_id,
+    prune_checkpoints,
+    thread_id_for,
+)
+from startup import Readiness, warm_up
+from shared_state import SecretBox, node_id, open_shared_state
+
+# LangChain model/agent, CDP and web3 modules are imported where they are first
+# used, so importing this module (worker start, reload) stays fast
+if TYPE_CHECKING:
+    from action_log import ActionLog
+    from llm_scheduler import LLMScheduler
+    from registration_queue import RegistrationQueue
+    from name_service import NameService
+    from portfolio import PortfolioTracker
+    from registry_indexer import RegistryIndexer
+    from tx_manager import TransactionManager
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 # Load environment variables
 load_dotenv()
+setup_logging()
 
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_SERVICE_KEY")
-)
+# State shared by all workers: NPC configs, the wallet pool and agent wallet seed,
+# provisioning jobs, registrar nonces and websocket session leases
+shared_state = open_shared_state(os.getenv("SHARED_STATE_URL", "shared_state.sqlite"))
+secret_box = SecretBox(os.getenv("STATE_ENCRYPTION_KEY"))
+NODE_ID = node_id()
+
+
+_npc_store: Optional[NPCStore] = None
+_npc_store_lock = threading.Lock()
+
+
+def get_npc_store() -> NPCStore:
+   """Supabase access for NPC records, created on first use so a missing URL doesn't stop the boot."""
+   global _npc_store
+   with _npc_store_lock:
+       if _npc_store is None:
+           url = os.getenv("SUPABASE_URL")
+           if not url:
+               raise ValueError("SUPABASE_URL not found in environment variables")
+           _npc_store = NPCStore(url, os.getenv("SUPABASE_SERVICE_KEY"))
+   return _npc_store
+
+
+readiness = Readiness()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+   start_background_tasks()
+   if WARMUP_ON_STARTUP:
+       # Serving starts right away, /ready reports when the agent is warm
+       spawn(warm_up(readiness, "shared_resources", get_shared_resources, WARMUP_RETRY_INTERVAL))
+       spawn(warm_up(readiness, "default_agent", lambda: agent_pool.get(default_npc_id()), WARMUP_RETRY_INTERVAL))
+   try:
+       yield
+   finally:
+       if _npc_store is not None:
+           await _npc_store.close()
 
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # Configure CORS
@@ -67,8 +129,47 @@ class NPCConfig(BaseModel):
 wallet_data_file = "wallet_data.txt"
 npc_config_file = "npc_config.json"
 
-RPC_URL = "https://base-sepolia.blockpi.network/v1/rpc/public"
-CONTRACT_ADDRESS = "0xab8CF91658009e0Eb123c60bCe2120A7E13C9ff2"
+# Key for the agent used when a websocket doesn't name an NPC
+DEFAULT_NPC_ID = "default"
+
+# Conversation history
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "checkpoints.sqlite")
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "3000"))
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "5"))
+CHECKPOINT_PRUNE_INTERVAL = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL", "600"))
+
+# Token streaming over /ws
+WS_COALESCE_MS = float(os.getenv("WS_COALESCE_MS", "50"))
+WS_COALESCE_CHARS = int(os.getenv("WS_COALESCE_CHARS", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+# Build the LLM client, CDP toolkit and default agent in the background after startup
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() != "false"
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "30"))
+
+# A websocket session is served by one worker at a time, its lease is renewed while connected
+SESSION_LEASE_SECONDS = float(os.getenv("SESSION_LEASE_SECONDS", "30"))
+
+# Block-driven balance tracking of every NPC wallet
+PORTFOLIO_ENABLED = os.getenv("PORTFOLIO_ENABLED", "true").lower() != "false"
+PORTFOLIO_TOKENS = [t.strip() for t in os.getenv("PORTFOLIO_TOKENS", "").split(",") if t.strip()]
+PORTFOLIO_RELOAD_INTERVAL = float(os.getenv("PORTFOLIO_RELOAD_INTERVAL", "300"))
+
+# Log of every NPC tool call, rolled into Merkle batches whose roots are attested
+ACTION_LOG_ENABLED = os.getenv("ACTION_LOG_ENABLED", "true").lower() != "false"
+ACTION_BATCH_INTERVAL = float(os.getenv("ACTION_BATCH_INTERVAL", "300"))
+
+# Following new blocks into the store behind the token analytics tools
+TOKEN_ANALYTICS_SYNC_ENABLED = os.getenv("TOKEN_ANALYTICS_SYNC", "true").lower() != "false"
+TOKEN_ANALYTICS_SAVE_INTERVAL = float(os.getenv("TOKEN_ANALYTICS_SAVE_INTERVAL", "300"))
+
+# Admission of LLM calls, per worker process (0 disables a budget)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+history_metrics = HistoryMetrics()
 
 
 def save_npc_config(config: dict) -> bool:
@@ -88,107 +189,167 @@ def save_npc_config(config: dict) -> bool:
            json.dump(config, f, indent=2, ensure_ascii=False)
        return True
    except Exception as e:
-       print(f"Error saving NPC config: {str(e)}")
-       print(f"Traceback: {traceback.format_exc()}")
+       logger.exception(f"Error saving NPC config: {str(e)}")
        return False
 
 
+wallet_pool = WalletPool(
+   CdpWalletBackend(),
+   path=os.getenv("WALLET_POOL_FILE", "wallet_pool.json"),
+   target_size=int(os.getenv("WALLET_POOL_SIZE", "5")),
+   low_water=int(os.getenv("WALLET_POOL_LOW_WATER", "2")),
+   state=shared_state,
+)
+WALLET_POOL_CHECK_INTERVAL = float(os.getenv("WALLET_POOL_CHECK_INTERVAL", "30"))
+
+
+def should_refill_wallet_pool() -> bool:
+   # Every worker takes from the shared pool, one of them creates the wallets
+   return shared_state.acquire_lease("wallet_pool_refill", NODE_ID, WALLET_POOL_CHECK_INTERVAL * 2)
+
+
 async def create_wallet() -> dict:
    try:
-       print("Initializing CDP SDK...")
-       load_dotenv()
-      
-       # Get credentials from environment
-       api_key_name = os.environ.get('CDP_API_KEY_NAME')
-       api_key_private_key = os.environ.get('CDP_API_KEY_PRIVATE_KEY')
-      
-       if not api_key_name or not api_key_private_key:
-           raise ValueError("CDP API Key Name or CDP API Key Private Key is missing")
-      
-       # Configure the SDK with proper key formatting
-       private_key = api_key_private_key.replace('\\n', '\n')
-       Cdp.configure(api_key_name, private_key)
-      
-       # Create a wallet - simple and straightforward
-       wallet = Wallet.create()
-       default_address = wallet.default_address
+       # Pre-created by the pool's background refill, created inline only if the pool ran dry
+       async with span("create_wallet"):
+           wallet = await wallet_pool.acquire()
       
        return {
            "status": "success",
-           "wallet_address": default_address.address_id,
-           "wallet_id": wallet.id
+           "wallet_address": wallet["wallet_address"],
+           "wallet_id": wallet["wallet_id"]
        }
    except Exception as e:
-       print(f"Error creating wallet: {str(e)}")
+       logger.error(f"Error creating wallet: {str(e)}")
        return {
            "status": "error",
            "message": str(e)
        }
 
 
-async def register_npc_domain(domain_name: str, owner_address: str) -> dict:
-    try:
+# Keeps references to background tasks so they aren't garbage collected
+background_tasks = set()
+
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+_tx_manager: Optional["TransactionManager"] = None
+
+
+def get_tx_manager() -> "TransactionManager":
+    """Transaction sender for the registrar key, created on first use."""
+    global _tx_manager
+    if _tx_manager is None:
+        from chain_client import get_chain_client
+        from tx_manager import TransactionManager
+
         private_key = os.getenv("ETH_PRIVATE_KEY")
         if not private_key:
             raise ValueError("ETH_PRIVATE_KEY not found in environment variables")
+        _tx_manager = TransactionManager(
+            get_chain_client(),
+            private_key,
+            stuck_after=float(os.getenv("TX_STUCK_AFTER_SECONDS", "60")),
+            state=shared_state,
+            owner=NODE_ID,
+        )
+    return _tx_manager
 
-        # Connect to network
-        w3 = Web3(Web3.HTTPProvider(RPC_URL))
-        
-        # Create account object from private key
-        account = Account.from_key(private_key)
-        
-        # Contract ABI - only including the register function
-        abi = [
-            {
-                "inputs": [
-                    {"internalType": "string", "name": "label", "type": "string"},
-                    {"internalType": "address", "name": "owner", "type": "address"}
-                ],
-                "name": "register",
-                "outputs": [],
-                "stateMutability": "nonpayable",
-                "type": "function"
-            }
-        ]
-        
-        # Create contract instance
-        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=abi)
-        
-        # Build transaction
-        nonce = w3.eth.get_transaction_count(account.address)
-        
-        transaction = contract.functions.register(
-            domain_name,
-            owner_address
-        ).build_transaction({
-            'from': account.address,
-            'nonce': nonce,
-            'gas': 300000,
-            'gasPrice': w3.eth.gas_price
-        })
-        
-        # Sign transaction
-        signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
-        
-        # Send transaction
-        tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        
-        # Wait for transaction receipt
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+
+_registration_queue: Optional["RegistrationQueue"] = None
+
+
+def get_registration_queue() -> "RegistrationQueue":
+    """Batching registration queue, started on first use from inside the event loop."""
+    global _registration_queue
+    if _registration_queue is None:
+        from chain_client import CONTRACT_ADDRESS, REGISTRAR_ADDRESS
+        from registration_queue import RegistrationQueue
+
+        _registration_queue = RegistrationQueue(
+            get_tx_manager(),
+            CONTRACT_ADDRESS,
+            REGISTRAR_ADDRESS,
+            window=float(os.getenv("REGISTRATION_BATCH_WINDOW", "0.25")),
+            max_batch=int(os.getenv("REGISTRATION_MAX_BATCH", "50")),
+        )
+        spawn(_registration_queue.run())
+    return _registration_queue
+
+
+async def register_npc_domain(domain_name: str, owner_address: str, on_mined=None) -> dict:
+    """
+    Submit the registration without waiting for it to be mined. `on_mined` is
+    called with the receipt from the background receipt poller.
+    """
+    try:
+        # Coalesced with other registrations arriving in the same window
+        async with span("register_npc_domain"):
+            tx_hash = await get_registration_queue().register(domain_name, owner_address, on_mined)
         
         return {
             "status": "success",
-            "transaction_hash": receipt['transactionHash'].hex()
+            "transaction_hash": tx_hash
         }
     except Exception as e:
-        print(f"Error registering domain: {str(e)}")
+        logger.error(f"Error registering domain: {str(e)}")
         return {
             "status": "error",
             "message": str(e)
         }
 
 
+_name_service: Optional["NameService"] = None
+
+
+def get_name_service() -> "NameService":
+    """Pre-flight name checks, backed by the registry index once it is open."""
+    global _name_service
+    if _name_service is None:
+        from chain_client import CONTRACT_ADDRESS, REGISTRAR_ADDRESS, get_chain_client
+        from name_service import NameService
+
+        _name_service = NameService(
+            get_chain_client(),
+            CONTRACT_ADDRESS,
+            REGISTRAR_ADDRESS,
+            indexer=registry_indexer,
+            state=shared_state,
+        )
+    elif _name_service.indexer is None:
+        # Built before the registry index opened
+        _name_service.indexer = registry_indexer
+    return _name_service
+
+
+def update_registration_status(wallet_address: str, label: Optional[str] = None, holder: Optional[str] = None):
+    """
+    Build an on_mined callback that records the mined registration on the NPC
+    row and releases the label reserved by `holder` once the chain decides it.
+    """
+    def on_mined(receipt):
+        from web3 import Web3
+
+        tx_hash = Web3.to_hex(receipt['transactionHash'])
+        if receipt['status'] != 1:
+            logger.warning(f"Domain registration {tx_hash} reverted")
+            if label is not None:
+                get_name_service().forget(label)
+        if label is not None and holder is not None:
+            # Mined, other workers see the name taken on chain from here on
+            get_name_service().release(label, holder)
+        # Buffered, and folded into the insert if the row hasn't been written yet
+        get_npc_store().queue_update(wallet_address, {
+            "wallet": {"transaction_hash": tx_hash, "status": "active"},
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+    return on_mined
+
+
 @app.get("/")
 async def root():
    return {"message": "API is running"}
@@ -199,13 +360,344 @@ async def test():
    return {"message": "Test endpoint working"}
 
 
+@app.get("/health")
+async def health():
+   """Liveness, answered as soon as the process serves requests."""
+   return readiness.to_dict()
+
+
+@app.get("/ready")
+async def ready():
+   """503 until every warm-up has finished, for load balancer and autoscaler probes."""
+   if not readiness.is_ready:
+       return JSONResponse(readiness.to_dict(), status_code=503)
+   return readiness.to_dict()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+   return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/history")
+async def history_stats(thread_id: Optional[str] = None):
+   if thread_id:
+       stats = history_metrics.get(thread_id)
+       if stats is None:
+           raise HTTPException(status_code=404, detail="Unknown thread")
+       return stats
+   return history_metrics.snapshot()
+
+
+@app.get("/metrics/tools")
+async def tool_cache_stats():
+   return tool_cache.stats()
+
+
+@app.get("/metrics/llm")
+async def llm_scheduler_stats():
+   if _llm_scheduler is None:
+       return {}
+   return _llm_scheduler.stats()
+
+
+@app.get("/metrics/fees")
+async def fee_stats():
+   if _tx_manager is None:
+       return {}
+   return _tx_manager.fee_oracle.stats()
+
+
+@app.get("/metrics/prompts")
+async def prompt_stats():
+   return prompt_cache.stats()
+
+
+async def prune_checkpoints_periodically():
+   while True:
+       await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL)
+       if _shared_resources is None:
+           continue
+       # Every worker shares the checkpoint database, one of them prunes it
+       if not await asyncio.to_thread(
+           shared_state.acquire_lease, "prune_checkpoints", NODE_ID, CHECKPOINT_PRUNE_INTERVAL * 2
+       ):
+           continue
+       try:
+           removed = await asyncio.to_thread(
+               prune_checkpoints, _shared_resources["memory"], CHECKPOINT_KEEP_PER_THREAD
+           )
+           if removed:
+               logger.info(f"Pruned {removed} old checkpoints")
+       except Exception as e:
+           logger.error(f"Error pruning checkpoints: {e}")
+
+
+# Local name index, only enabled when the registry deployment block is known.
+# Opened at startup rather than import, it loads every indexed name.
+registry_indexer: Optional["RegistryIndexer"] = None
+
+
+def open_registry_indexer() -> Optional["RegistryIndexer"]:
+   if not os.getenv("INDEXER_START_BLOCK"):
+       return None
+   from chain_client import CONTRACT_ADDRESS, get_chain_client
+   from registry_indexer import RegistryIndexer
+
+   return RegistryIndexer(
+       get_chain_client(),
+       CONTRACT_ADDRESS,
+       db_path=os.getenv("INDEXER_DB", "registry_index.sqlite"),
+       start_block=int(os.getenv("INDEXER_START_BLOCK")),
+   )
+
+
+def require_indexer() -> "RegistryIndexer":
+   if registry_indexer is None:
+       raise HTTPException(status_code=503, detail="Name index is not enabled")
+   return registry_indexer
+
+
+@app.get("/names")
+async def list_names():
+   return await asyncio.to_thread(require_indexer().list_names)
+
+
+class ResolveRequest(BaseModel):
+    labels: list
+    text_keys: list = []
+
+
+@app.post("/names/resolve")
+async def resolve_names(request: ResolveRequest):
+   from get_names import resolve_labels
+
+   return await asyncio.to_thread(resolve_labels, request.labels, request.text_keys)
+
+
+def lookup_name(indexer: "RegistryIndexer", label: str) -> dict:
+   record = indexer.get(label)
+   if record is None:
+       return {"label": label, "available": indexer.is_available(label)}
+   return {**record, "available": False, "texts": indexer.texts(label)}
+
+
+@app.get("/names/{label}")
+async def get_name(label: str):
+   # The index lock may be held by the sync thread, so never wait on it from the loop
+   return await asyncio.to_thread(lookup_name, require_indexer(), label)
+
+
+# In-memory balances of every NPC wallet, opened at startup
+portfolio: Optional["PortfolioTracker"] = None
+
+
+def open_portfolio() -> Optional["PortfolioTracker"]:
+   if not PORTFOLIO_ENABLED:
+       return None
+   from chain_client import get_chain_client
+   from portfolio import PortfolioTracker
+
+   return PortfolioTracker(
+       get_chain_client(),
+       tokens=PORTFOLIO_TOKENS,
+       poll_interval=float(os.getenv("PORTFOLIO_POLL_INTERVAL", "2")),
+       reconcile_blocks=int(os.getenv("PORTFOLIO_RECONCILE_BLOCKS", "100")),
+       on_change=record_balances,
+       state=shared_state,
+   )
+
+
+def should_refresh_portfolio() -> bool:
+   # One worker reads balances from the chain, the others load what it publishes
+   return shared_state.acquire_lease("portfolio_writeback", NODE_ID, 60)
+
+
+def record_balances(changes: dict):
+   """Write changed balances back to the NPC rows, from one worker only."""
+   if not should_refresh_portfolio():
+       return
+   for address, balances in changes.items():
+       get_npc_store().queue_update(address, {
+           "wallet": {"balance": balances["native_eth"], "token_balances": balances["tokens"]},
+           "updated_at": datetime.utcnow().isoformat(),
+       })
+
+
+async def track_npc_wallets():
+   # Picks up NPCs created before a restart or by other workers
+   while True:
+       try:
+           portfolio.track_many(await get_npc_store().wallet_addresses())
+       except Exception as e:
+           logger.error(f"Error loading NPC wallets for the portfolio: {e}")
+       await asyncio.sleep(PORTFOLIO_RELOAD_INTERVAL)
+
+
+def require_portfolio() -> "PortfolioTracker":
+   if portfolio is None:
+       raise HTTPException(status_code=503, detail="Portfolio tracking is not enabled")
+   return portfolio
+
+
+@app.get("/portfolio")
+async def list_portfolios():
+   return require_portfolio().snapshot()
+
+
+@app.get("/portfolio/{wallet_address}")
+async def get_portfolio(wallet_address: str):
+   tracker = require_portfolio()
+   try:
+       tracked = wallet_address in tracker
+   except ValueError:
+       raise HTTPException(status_code=400, detail="Invalid address")
+   if not tracked:
+       raise HTTPException(status_code=404, detail="Unknown wallet")
+   balances = tracker.get(wallet_address)
+   if balances is None:
+       # Tracked, read on the next block
+       return {"address": wallet_address, "synced": False}
+   return {**balances, "synced": True}
+
+
+async def sync_token_analytics():
+   store = os.getenv("TOKEN_ANALYTICS_STORE", "token_analytics.npz")
+   if store.endswith(".json"):
+       # A log fixture is a fixed recording, it isn't extended from the chain
+       return
+   from chain_client import get_chain_client
+   from token_analytics import TokenAnalyticsSync, get_default_engine
+
+   start_block = os.getenv("TOKEN_ANALYTICS_START_BLOCK")
+   sync = TokenAnalyticsSync(
+       await asyncio.to_thread(get_default_engine),
+       get_chain_client(),
+       store,
+       start_block=int(start_block) if start_block else None,
+       poll_interval=float(os.getenv("TOKEN_ANALYTICS_POLL_INTERVAL", "12")),
+       save_interval=TOKEN_ANALYTICS_SAVE_INTERVAL,
+       should_save=should_save_token_analytics,
+   )
+   await sync.run()
+
+
+def should_save_token_analytics() -> bool:
+   # Every worker follows the chain for its own tools, one of them writes the shared file
+   return shared_state.acquire_lease("token_analytics_save", NODE_ID, TOKEN_ANALYTICS_SAVE_INTERVAL * 2)
+
+
+# Action log of NPC tool calls, opened at startup
+action_log: Optional["ActionLog"] = None
+action_log_handler = None
+
+
+def open_action_log() -> Optional["ActionLog"]:
+   if not ACTION_LOG_ENABLED:
+       return None
+   from action_log import ActionLog, SignProtocolAttester
+   from chain_client import SIGN_PROTOCOL_ADDRESS
+
+   attester = None
+   if SIGN_PROTOCOL_ADDRESS and os.getenv("SIGN_SCHEMA_ID"):
+       try:
+           attester = SignProtocolAttester(get_tx_manager(), SIGN_PROTOCOL_ADDRESS, int(os.getenv("SIGN_SCHEMA_ID")))
+       except Exception as e:
+           logger.error(f"Action batches won't be attested: {e}")
+   return ActionLog(
+       path=os.getenv("ACTION_LOG_DB", "action_log.sqlite"),
+       max_batch=int(os.getenv("ACTION_BATCH_MAX", "10000")),
+       attester=attester,
+       submit_timeout=float(os.getenv("ACTION_ATTEST_TIMEOUT", "900")),
+   )
+
+
+def should_roll_actions() -> bool:
+   # Every worker appends to the same log, one of them rolls and attests it
+   return shared_state.acquire_lease("action_log_roll", NODE_ID, ACTION_BATCH_INTERVAL * 2)
+
+
+def require_action_log() -> "ActionLog":
+   if action_log is None:
+       raise HTTPException(status_code=503, detail="Action log is not enabled")
+   return action_log
+
+
+@app.get("/actions/batches")
+async def list_action_batches(limit: int = 50):
+   log = require_action_log()
+   return {
+       "stats": await asyncio.to_thread(log.stats),
+       "batches": await asyncio.to_thread(log.batches, min(limit, 500)),
+   }
+
+
+@app.get("/actions/{action_id}/proof")
+async def action_proof(action_id: int):
+   proof = await asyncio.to_thread(require_action_log().proof, action_id)
+   if proof is None:
+       raise HTTPException(status_code=404, detail="Unknown action")
+   return proof
+
+
+@app.get("/transactions/pending")
+async def pending_transactions():
+   if _tx_manager is None:
+       return []
+   return _tx_manager.pending()
+
+
+async def track_transactions():
+   if os.getenv("ETH_PRIVATE_KEY"):
+       # Created up front so transactions left pending by a previous process are followed
+       try:
+           await asyncio.to_thread(get_tx_manager)
+       except Exception as e:
+           logger.error(f"Error creating the transaction manager: {e}")
+   # Otherwise it is created by the first registration, wait for it
+   while _tx_manager is None:
+       await asyncio.sleep(1)
+   # One loop per process follows new heads for the fees every send uses
+   spawn(_tx_manager.fee_oracle.run())
+   await _tx_manager.run()
+
+
+async def run_npc_store():
+   # A missing or unreachable store shows up in /ready instead of stopping the boot
+   await warm_up(readiness, "npc_store", get_npc_store, WARMUP_RETRY_INTERVAL)
+   await get_npc_store().run()
+
+
+def start_background_tasks():
+   global registry_indexer, portfolio, action_log, action_log_handler
+   spawn(prune_checkpoints_periodically())
+   spawn(track_transactions())
+   spawn(wallet_pool.run(WALLET_POOL_CHECK_INTERVAL, should_refill_wallet_pool))
+   spawn(run_npc_store())
+   registry_indexer = open_registry_indexer()
+   if registry_indexer is not None:
+       spawn(registry_indexer.run())
+   portfolio = open_portfolio()
+   if portfolio is not None:
+       spawn(portfolio.run(should_refresh_portfolio))
+       spawn(track_npc_wallets())
+   if TOKEN_ANALYTICS_SYNC_ENABLED:
+       spawn(sync_token_analytics())
+   action_log = open_action_log()
+   if action_log is not None:
+       from action_log import ActionLogHandler
+
+       action_log_handler = ActionLogHandler(action_log)
+       spawn(action_log.run(ACTION_BATCH_INTERVAL, should_roll_actions))
+
+
 @app.get("/create-wallet")
 @app.post("/create-wallet")
 async def create_new_wallet():
    try:
-       print("Received wallet creation request")
+       logger.info("Received wallet creation request", extra=SAMPLED)
        wallet_data = await create_wallet()
-       print(f"Wallet creation result: {wallet_data['status']}")
+       logger.info("Wallet creation result: %s", wallet_data['status'], extra=SAMPLED)
       
        if wallet_data["status"] == "success":
            return {
@@ -220,109 +712,210 @@ async def create_new_wallet():
            )
    except Exception as e:
        error_message = str(e)
-       print(f"Error in create_new_wallet endpoint: {error_message}")
+       logger.error(f"Error in create_new_wallet endpoint: {error_message}")
        raise HTTPException(
            status_code=500,
            detail=f"Failed to create wallet: {error_message}"
        )
 
 
-def initialize_agent():
-   llm = ChatOpenAI(model="gpt-4")
-   wallet_data = None
+_shared_resources = None
+_shared_resources_lock = threading.Lock()
 
 
-   if os.path.exists(wallet_data_file):
-       with open(wallet_data_file) as f:
-           wallet_data = f.read()
+def get_shared_resources() -> dict:
+   """Build the LLM client, CDP toolkit and checkpointer once and share them across NPC agents."""
+   global _shared_resources
+   with _shared_resources_lock:
+       if _shared_resources is None:
+           _shared_resources = _build_shared_resources()
+   return _shared_resources
+
+
+_llm_scheduler: Optional["LLMScheduler"] = None
+_llm_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> "LLMScheduler":
+   """The scheduler every agent's model calls go through, one per process."""
+   global _llm_scheduler
+   with _llm_scheduler_lock:
+       if _llm_scheduler is None:
+           from llm_scheduler import LLMScheduler
+
+           _llm_scheduler = LLMScheduler(
+               requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+               tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+               max_concurrency=LLM_MAX_CONCURRENCY,
+               max_retries=LLM_MAX_RETRIES,
+           )
+   return _llm_scheduler
+
+
+def _build_shared_resources() -> dict:
+   from cdp_langchain.agent_toolkits import CdpToolkit
+   from cdp_langchain.utils import CdpAgentkitWrapper
+   from langchain_openai import ChatOpenAI
+   from llm_scheduler import ScheduledChatModel
+
+   # Streaming lets /ws?stream=tokens forward tokens as they are generated, and
+   # stream usage reports token counts at the end of each stream. The scheduler
+   # owns retries of rate limited calls, so the client doesn't retry too
+   llm = ScheduledChatModel(
+       model=ChatOpenAI(model="gpt-4", streaming=True, stream_usage=True, max_retries=0),
+       scheduler=get_llm_scheduler(),
+   )
+   wallet_data = load_wallet_data()
 
 
    values = {"cdp_wallet_data": wallet_data} if wallet_data else {}
    agentkit = CdpAgentkitWrapper(**values)
 
 
-   wallet_data = agentkit.export_wallet()
+   exported = agentkit.export_wallet()
+   wallet_data = save_wallet_data(exported)
+   if wallet_data != exported:
+       # Another worker created the agent wallet first, use theirs
+       agentkit = CdpAgentkitWrapper(cdp_wallet_data=wallet_data)
+
+
+   cdp_toolkit = CdpToolkit.from_cdp_agentkit_wrapper(agentkit)
+   # Read-only tools answer repeated identical calls from a shared cache
+   tools = cache_tools(cdp_toolkit.get_tools())
+   if portfolio is not None:
+       from portfolio import portfolio_tool
+
+       # Balances of NPC wallets straight from the block-driven tracker
+       tools.append(portfolio_tool(portfolio))
+   return {
+       "llm": llm,
+       "tools": tools,
+       "memory": build_checkpointer(CHECKPOINT_DB),
+   }
+
+
+def load_wallet_data() -> Optional[str]:
+   """The agent wallet seed, from shared state when encryption is set up, else the local file."""
+   if secret_box.enabled:
+       encrypted = shared_state.get("secret", "agent_wallet")
+       if encrypted:
+           return secret_box.decrypt(encrypted)
+   if os.path.exists(wallet_data_file):
+       with open(wallet_data_file) as f:
+           return f.read()
+   return None
+
+
+def save_wallet_data(wallet_data: str) -> str:
+   """
+   Store the agent wallet seed, encrypted, for every worker. Returns the seed
+   actually stored, which is another worker's when it saved one first.
+   """
+   if secret_box.enabled:
+       if not shared_state.set_if_absent("secret", "agent_wallet", secret_box.encrypt(wallet_data)):
+           return secret_box.decrypt(shared_state.get("secret", "agent_wallet"))
+       return wallet_data
    with open(wallet_data_file, "w") as f:
        f.write(wallet_data)
+   return wallet_data
 
 
-   cdp_toolkit = CdpToolkit.from_cdp_agentkit_wrapper(agentkit)
-   tools = cdp_toolkit.get_tools()
-   memory = MemorySaver()
-   config = {"configurable": {"thread_id": "CDP Agentkit Agent"}}
+def npc_id_for(npc_config: Optional[dict]) -> str:
+   """NPCs are keyed by their wallet address, falling back to the default agent."""
+   if npc_config and npc_config.get("wallet", {}).get("wallet_address"):
+       return npc_config["wallet"]["wallet_address"]
+   return DEFAULT_NPC_ID
 
 
-   # Load NPC config if it exists
-   npc_config = None
+def load_npc_config() -> Optional[dict]:
    if os.path.exists(npc_config_file):
        try:
            with open(npc_config_file, 'r') as f:
-               npc_config = json.load(f)
+               return json.load(f)
        except Exception as e:
-           print(f"Error loading NPC config: {e}")
-
-
-   # Modify the state modifier to include NPC personality if available
-   npc_personality = ""
-   if npc_config:
-       npc_personality = f"""
-       You are an NPC with the following traits:
-       - Name: {npc_config['name']}
-       - Background: {npc_config['background']}
-       - Risk Tolerance: {npc_config['personality']['riskTolerance']}
-       - Rationality: {npc_config['personality']['rationality']}
-       - Autonomy: {npc_config['personality']['autonomy']}
-       - Core Values: {', '.join(npc_config['core_values'])}
-       - Primary Aims: {', '.join(npc_config['primary_aims'])}
-      
-       Incorporate these traits into your responses and decision-making.
-       """
+           logger.error(f"Error loading NPC config: {e}")
+   return None
+
 
+def publish_npc_config(npc_id: str, npc_config: dict) -> None:
+   """Share an NPC's config with every worker and make it the default NPC, like npc_config.json."""
+   shared_state.set("npc_config", npc_id, npc_config)
+   shared_state.set("npc", "default", npc_id)
 
-   state_modifier = f"""You are a helpful agent that can interact onchain using the Coinbase Developer Platform Agentkit.
-   {npc_personality}
-   You are empowered to interact onchain using your tools. If you ever need funds, you can request them from the faucet if you are on network ID `base-sepolia`.
-   If not, you can provide your wallet details and request funds from the user. If someone asks you to do something you can't do with your currently available tools,
-   you must say so, and encourage them to implement it themselves using the CDP SDK + Agentkit, recommend they go to docs.cdp.coinbase.com for more informaton.
-   Be concise and helpful with your responses. Refrain from restating your tools' descriptions unless it is explicitly requested."""
 
+def load_shared_npc_config(npc_id: str) -> Optional[dict]:
+   return shared_state.get("npc_config", npc_id)
 
-   return create_react_agent(
-       llm,
-       tools=tools,
-       checkpointer=memory,
-       state_modifier=state_modifier,
-   ), config
 
+def default_npc_id() -> str:
+   """The NPC serving websockets that don't name one, the newest NPC created by any worker."""
+   return shared_state.get("npc", "default") or DEFAULT_NPC_ID
 
-@app.post("/npc-config")
-async def save_config(config: NPCConfig):
+
+async def find_npc(npc_id: str) -> bool:
+   """Make sure the agent pool knows `npc_id`, loading NPCs created by an earlier process."""
+   # Checks NPCs published by other workers too
+   if await asyncio.to_thread(agent_pool.__contains__, npc_id):
+       return True
    try:
-       # Create wallet for the NPC
-       wallet_data = await create_wallet()
+       npc_config = await get_npc_store().get_by_wallet(npc_id)
+   except Exception as e:
+       logger.error(f"Error fetching NPC config: {e}")
+       return False
+   if npc_config is None:
+       return False
+   agent_pool.register(npc_id, npc_config)
+   return True
+
+
+def initialize_agent(npc_config: Optional[dict] = None):
+   from langgraph.prebuilt import create_react_agent
+
+   with span("initialize_agent"):
+       shared = get_shared_resources()
+
+
+       # Compiled once per distinct personality, identical bytes on every turn
+       system_prompt = compile_prompt(npc_config)
+
+
+       return create_react_agent(
+           shared["llm"],
+           tools=shared["tools"],
+           checkpointer=shared["memory"],
+           state_modifier=make_state_modifier(system_prompt.text, HISTORY_MAX_TOKENS, history_metrics),
+       )
+
+
+provisioning_jobs = ProvisioningJobs(state=shared_state)
+
+
+async def provision_npc(job: ProvisioningJob, config: NPCConfig, domain_name: str):
+   """
+   Staged NPC creation for a name already reserved by the job. The request is
+   answered as soon as the wallet is ready; domain registration, the database
+   insert and agent setup then run concurrently. Once the registration is
+   submitted the name stays reserved until its receipt arrives.
+   """
+   domain_submitted = False
+   try:
+       async with job.stage("wallet"):
+           wallet_data = await create_wallet()
+           if wallet_data["status"] != "success":
+               raise RuntimeError(f"Failed to create wallet: {wallet_data['message']}")
        
-       if wallet_data["status"] != "success":
-           raise HTTPException(
-               status_code=500,
-               detail=f"Failed to create wallet: {wallet_data['message']}"
-           )
-           
-       # Register domain name
-       domain_name = config.name.lower().replace(" ", "-")  # Convert name to domain-friendly format
-       domain_result = await register_npc_domain(domain_name, wallet_data["wallet_address"])
+       if portfolio is not None:
+           portfolio.track(wallet_data["wallet_address"])
        
-       if domain_result["status"] != "success":
-           print(f"Warning: Failed to register domain: {domain_result['message']}")
-           
-       # Create wallet info
+       # Create wallet info, it stays pending until the domain registration is mined
        wallet_info = WalletInfo(
            wallet_address=wallet_data["wallet_address"],
            wallet_id=wallet_data["wallet_id"],
-           transaction_hash=domain_result.get("transaction_hash"),
            network="base-sepolia",
-           status="active",
+           status="pending",
            balance="0"
        )
+       domain = f"{domain_name}.npc.eth"
        
        # Prepare complete NPC data (without domain field)
        npc_data = {
@@ -333,109 +926,312 @@ async def save_config(config: NPCConfig):
            "updated_at": datetime.utcnow().isoformat(),
        }
        
-       # Save to Supabase
-       result = supabase.table('npcs').insert(npc_data).execute()
-       
-       if len(result.data) == 0:
-           raise HTTPException(status_code=500, detail="Failed to save NPC to database")
-           
-       # Add domain to response but not to database
-       response_data = {
-           "status": "success",
-           "message": "NPC created successfully",
-           "npc": {**result.data[0], "domain": f"{domain_name}.npc.eth"},
+       job.status = "running"
+       job.respond({
+           "status": "accepted",
+           "message": "NPC creation started",
+           "job_id": job.job_id,
+           "npc": {**npc_data, "domain": domain},
            "wallet": wallet_info.dict(),
-           "domain": f"{domain_name}.npc.eth"
-       }
+           "domain": domain
+       })
        
-       # Save local config for agent
-       if not save_npc_config(npc_data):
-           print("Warning: Failed to save NPC configuration file")
+       async def register_domain_stage():
+           nonlocal domain_submitted
+           async with job.stage("domain"):
+               result = await register_npc_domain(
+                   domain_name,
+                   wallet_info.wallet_address,
+                   on_mined=update_registration_status(wallet_info.wallet_address, domain_name, job.job_id),
+               )
+               if result["status"] != "success":
+                   raise RuntimeError(result["message"])
+               domain_submitted = True
+               get_name_service().mark_registered(domain_name)
+               job.response["wallet"]["transaction_hash"] = result["transaction_hash"]
        
-       # Reinitialize agent
-       global agent_executor
-       agent_executor, agent_config = initialize_agent()
+       async def save_database_stage():
+           async with job.stage("database"):
+               row = await get_npc_store().insert(npc_data)
+               job.response["npc"] = {**row, "domain": domain}
        
-       return response_data
+       async def prepare_agent_stage():
+           async with job.stage("agent"):
+               # Save local config for agent
+               if not await asyncio.to_thread(save_npc_config, npc_data):
+                   logger.warning("Failed to save NPC configuration file")
+               # Register the NPC with the agent pool, its executor is built on first use
+               agent_pool.register(npc_id_for(npc_data), npc_data)
+               await asyncio.to_thread(publish_npc_config, npc_id_for(npc_data), npc_data)
        
-   except HTTPException as he:
-       raise he
+       domain_error, database_error, agent_error = await asyncio.gather(
+           register_domain_stage(),
+           save_database_stage(),
+           prepare_agent_stage(),
+           return_exceptions=True,
+       )
+       
+       if database_error:
+           raise database_error
+       if agent_error:
+           raise agent_error
+       if domain_error:
+           # Nothing will be mined, so the wallet doesn't stay pending
+           logger.warning(f"Failed to register domain: {domain_error}")
+           wallet = {**wallet_info.dict(), "status": "active"}
+           job.response["wallet"] = wallet
+           get_npc_store().queue_update(wallet_info.wallet_address, {"wallet": {"status": "active"}})
+       
+       job.succeed()
    except Exception as e:
-       print(f"Error in save_config: {str(e)}")
-       print(f"Traceback: {traceback.format_exc()}")
+       logger.exception(f"Error in provision_npc: {str(e)}")
+       if job.response is None:
+           # Nothing was handed out yet, let a retry with the same key start over
+           await asyncio.to_thread(provisioning_jobs.release_key, job)
+       job.fail(str(e))
+   finally:
+       if not domain_submitted:
+           await asyncio.to_thread(get_name_service().release, domain_name, job.job_id)
+
+
+@app.post("/npc-config", status_code=202)
+async def save_config(
+   config: NPCConfig,
+   idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+   from name_service import InvalidName, normalize_label
+
+   try:
+       domain_name = normalize_label(config.name)
+   except InvalidName as e:
+       raise HTTPException(status_code=422, detail=f"Invalid NPC name: {e}")
+   
+   job, created = await asyncio.to_thread(provisioning_jobs.get_or_create, idempotency_key)
+   if created:
+       # Taken or in-flight names are turned away before a wallet or gas is spent
+       reason = await get_name_service().claim(domain_name, job.job_id)
+       if reason is not None:
+           await asyncio.to_thread(provisioning_jobs.release_key, job)
+           job.fail(reason)
+           raise HTTPException(status_code=409, detail=reason)
+       spawn(provision_npc(job, config, domain_name))
+   
+   # Polls shared state when another worker runs the job for this key
+   job = await provisioning_jobs.wait_for_response(job)
+   if not job.ready.is_set():
+       # Still creating the wallet, the client follows the job instead
+       return {
+           "status": "pending",
+           "message": "NPC creation is taking longer than usual",
+           "job_id": job.job_id,
+       }
+   if job.response is None:
        raise HTTPException(
            status_code=500,
-           detail=f"Failed to process NPC configuration: {str(e)}"
+           detail=f"Failed to process NPC configuration: {job.error}"
        )
+   return job.response
 
 
-agent_executor, config = initialize_agent()
+@app.get("/npc-config/jobs/{job_id}")
+async def provisioning_status(job_id: str):
+   job = await asyncio.to_thread(provisioning_jobs.get, job_id)
+   if job is None:
+       raise HTTPException(status_code=404, detail="Unknown job")
+   return job.to_dict()
 
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    print("WebSocket connected")
-    
+agent_pool = AgentPool(
+   initialize_agent,
+   load_config=load_shared_npc_config,
+   max_size=int(os.getenv("AGENT_POOL_MAX_SIZE", "256")),
+   ttl=float(os.getenv("AGENT_POOL_TTL_SECONDS", "1800")),
+)
+agent_pool.register(DEFAULT_NPC_ID, None)
+
+agent_streamer = AgentStreamer(
+   max_concurrent=int(os.getenv("WS_MAX_CONCURRENT_RUNS", "8")),
+)
+
+_default_npc_config = load_npc_config()
+if _default_npc_config:
+   DEFAULT_NPC_ID = npc_id_for(_default_npc_config)
+   agent_pool.register(DEFAULT_NPC_ID, _default_npc_config)
+
+
+class FrameSender:
+    """
+    Sends frames to one websocket as JSON text, or as msgpack binary frames
+    when the client asked for it and msgpack is installed. A send that takes
+    longer than WS_SEND_TIMEOUT raises, so a stalled client can't hold a run.
+    """
+
+    def __init__(self, websocket: WebSocket, encoding: str = "json"):
+        self.websocket = websocket
+        self.encoding = "msgpack" if encoding == "msgpack" and msgpack is not None else "json"
+
+    async def send(self, frame: dict) -> None:
+        if self.encoding == "msgpack":
+            sending = self.websocket.send_bytes(msgpack.packb(frame))
+        else:
+            sending = self.websocket.send_json(frame)
+        await asyncio.wait_for(sending, timeout=WS_SEND_TIMEOUT)
+
+
+async def process_messages(sender: FrameSender, npc_id: str, config: dict, inbox: asyncio.Queue, stream_tokens: bool = False):
+    """Run queued chat messages for one connection through the agent, one at a time."""
     while True:
+        message = await inbox.get()
         try:
-            # Receive message
-            data = await websocket.receive_json()
-            message = data.get('message', '')
-            
-            if not message:
-                continue
-                
-            if message == "ping":
-                await websocket.send_json({"type": "pong", "content": "pong"})
-                continue
-            
-            print(f"Received message: {message}")
-            
-            # Process message synchronously since agent_executor doesn't support async
-            try:
-                for chunk in agent_executor.stream(
-                    {"messages": [HumanMessage(content=message)]},
-                    config
-                ):
+            agent_executor = await asyncio.to_thread(agent_pool.get, npc_id)
+            items = agent_streamer.stream(
+                agent_executor,
+                {"messages": [HumanMessage(content=message)]},
+                config,
+                tokens=stream_tokens,
+            )
+            if stream_tokens:
+                items = coalesce_tokens(items, max_delay=WS_COALESCE_MS / 1000, max_chars=WS_COALESCE_CHARS)
+            async with span("agent_turn"):
+                async for kind, chunk in items:
+                    if kind == TOKEN:
+                        await sender.send({"type": "delta", "content": chunk})
+                        continue
+
                     if chunk is None:
                         continue
-                        
-                    if "agent" in chunk and chunk["agent"]["messages"]:
-                        await websocket.send_json({
-                            "type": "agent",
-                            "content": chunk["agent"]["messages"][0].content
-                        })
-                        print(f"Sent agent response: {chunk['agent']['messages'][0].content}")
                     
+                    if "agent" in chunk and chunk["agent"]["messages"]:
+                        content = chunk["agent"]["messages"][0].content
+                        # Token clients already have the text, only mark the end of the turn
+                        if stream_tokens:
+                            if content:
+                                await sender.send({"type": "agent_end"})
+                        else:
+                            await sender.send({
+                                "type": "agent",
+                                "content": content
+                            })
+                        logger.debug("Sent agent response: %s", LazyTruncate(content), extra=SAMPLED)
+                
                     elif "tools" in chunk and chunk["tools"]["messages"]:
-                        await websocket.send_json({
+                        await sender.send({
                             "type": "tools",
                             "content": chunk["tools"]["messages"][0].content
                         })
-                        print(f"Sent tools response: {chunk['tools']['messages'][0].content}")
-                        
-            except Exception as e:
-                print(f"Error processing message: {str(e)}")
-                await websocket.send_json({
+                        logger.debug("Sent tools response: %s", LazyTruncate(chunk['tools']['messages'][0].content), extra=SAMPLED)
+                    
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.warning("Closing websocket to NPC %s, client stopped reading", npc_id)
+            try:
+                await sender.websocket.close(code=1011)
+            except Exception:
+                pass
+            return
+        except Exception as e:
+            logger.error(f"Error processing message: {str(e)}")
+            try:
+                await sender.send({
                     "type": "agent",
                     "content": f"Error processing message: {str(e)}"
                 })
-                
-        except WebSocketDisconnect:
-            print("WebSocket disconnected")
-            break
+            except Exception:
+                return
+
+
+async def renew_session_lease(lease: str):
+    while True:
+        await asyncio.sleep(SESSION_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(shared_state.acquire_lease, lease, NODE_ID, SESSION_LEASE_SECONDS)
         except Exception as e:
-            print(f"WebSocket error: {str(e)}")
+            logger.error(f"Error renewing session lease: {e}")
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    npc_id = websocket.query_params.get("npc") or await asyncio.to_thread(default_npc_id)
+    if not await find_npc(npc_id):
+        await websocket.send_json({
+            "type": "error",
+            "content": f"Unknown NPC: {npc_id}"
+        })
+        await websocket.close()
+        return
+    session_id = websocket.query_params.get("session") or new_session_id()
+    thread_id = thread_id_for(npc_id, session_id)
+    # One worker serves a conversation at a time, the load balancer should hash on ?session=
+    lease = f"session:{thread_id}"
+    if not await asyncio.to_thread(shared_state.acquire_lease, lease, NODE_ID, SESSION_LEASE_SECONDS):
+        owner = await asyncio.to_thread(shared_state.lease_holder, lease)
+        await websocket.send_json({
+            "type": "redirect",
+            "node": owner,
+            "session_id": session_id,
+            "content": "Session is served by another worker"
+        })
+        await websocket.close(code=1013)
+        return
+    renewing = asyncio.create_task(renew_session_lease(lease))
+    # The callbacks time every LLM and tool call made during the agent's runs and
+    # record each tool call in the action log under the NPC. Chats are admitted
+    # to the model ahead of background work
+    config = {
+        "configurable": {"thread_id": thread_id},
+        "callbacks": [metrics_callback, *([action_log_handler] if action_log_handler else [])],
+        "metadata": {"llm_priority": "interactive", "npc": npc_id},
+    }
+    # ?stream=tokens sends "delta" frames while the reply is generated, ?encoding=msgpack binary frames
+    stream_tokens = websocket.query_params.get("stream") == "tokens"
+    sender = FrameSender(websocket, websocket.query_params.get("encoding", "json"))
+    await sender.send({"type": "session", "session_id": session_id, "encoding": sender.encoding, "node": NODE_ID})
+    logger.info("WebSocket connected to NPC %s (thread %s)", npc_id, thread_id, extra=SAMPLED)
+
+    # Agent runs happen in a separate task so this loop keeps reading the socket
+    # and notices a disconnect while a response is still streaming
+    inbox: asyncio.Queue = asyncio.Queue()
+    worker = asyncio.create_task(process_messages(sender, npc_id, config, inbox, stream_tokens))
+    
+    try:
+        while True:
             try:
-                await websocket.send_json({
-                    "type": "error",
-                    "content": f"An error occurred: {str(e)}"
-                })
-            except:
+                # Receive message
+                data = await websocket.receive_json()
+                message = data.get('message', '')
+                
+                if not message:
+                    continue
+                    
+                if message == "ping":
+                    await sender.send({"type": "pong", "content": "pong"})
+                    continue
+                
+                logger.debug("Received message: %s", LazyTruncate(message), extra=SAMPLED)
+                await inbox.put(message)
+                    
+            except WebSocketDisconnect:
+                logger.info("WebSocket disconnected", extra=SAMPLED)
                 break
+            except Exception as e:
+                logger.error(f"WebSocket error: {str(e)}")
+                try:
+                    await sender.send({
+                        "type": "error",
+                        "content": f"An error occurred: {str(e)}"
+                    })
+                except:
+                    break
+    finally:
+        # Cancels the in-flight agent run for this connection
+        worker.cancel()
+        renewing.cancel()
+        await asyncio.to_thread(shared_state.release_lease, lease, NODE_ID)
 
 
 if __name__ == "__main__":
    import uvicorn
-   uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+   # An import string, reload needs to re-import the app in a fresh process
+   uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
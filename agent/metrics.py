@@ -0,0 +1,305 @@
+import asyncio
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of hot-path log records (chat messages, per-request notices) that are written
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Longest message content written to a log record
+LOG_MAX_CONTENT = 200
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (non-cumulative, last one is +Inf), sum, count
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labels, key, 'le="%s"' % le)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "npc_stage_duration_seconds", "Duration of backend stages", ["stage"],
+))
+stage_errors = registry.register(Counter(
+    "npc_stage_errors_total", "Stages that raised", ["stage"],
+))
+llm_tokens = registry.register(Counter(
+    "npc_llm_tokens_total", "Tokens used by LLM calls", ["kind"],
+))
+tool_seconds = registry.register(Histogram(
+    "npc_tool_duration_seconds", "Duration of agent tool calls", ["tool"],
+))
+tool_invocations = registry.register(Counter(
+    "npc_tool_invocations_total", "Agent tool calls", ["tool", "status"],
+))
+rpc_seconds = registry.register(Histogram(
+    "npc_rpc_duration_seconds", "Duration of chain RPC requests", ["method"],
+))
+rpc_calls = registry.register(Counter(
+    "npc_rpc_calls_total", "Chain RPC requests", ["method", "status"],
+))
+
+
+class span:
+    """
+    Times a stage into `npc_stage_duration_seconds{stage=...}` and counts it in
+    `npc_stage_errors_total` when it raises. Works with `with` and `async with`.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self) -> "span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        stage_seconds.observe(time.perf_counter() - self.started, stage=self.stage)
+        # A cancelled stage (e.g. the client went away) didn't fail
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            stage_errors.inc(stage=self.stage)
+
+    async def __aenter__(self) -> "span":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.__exit__(exc_type, exc, tb)
+
+
+def token_usage(response) -> Tuple[int, int]:
+    """
+    Prompt and completion tokens of an LLMResult. Streamed calls carry them in
+    the message's `usage_metadata` (with stream usage turned on), non-streaming
+    ones in `llm_output["token_usage"]`.
+    """
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if prompt_tokens or completion_tokens:
+        return prompt_tokens, completion_tokens
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback recording every LLM call as the `llm` stage with its
+    token usage, and every tool call into the tool histogram and counter.
+    """
+
+    def __init__(self):
+        self._started: Dict[UUID, Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, tool: Optional[str] = None) -> None:
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), tool)
+
+    def _finish(self, run_id: UUID) -> Tuple[Optional[float], Optional[str]]:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return None, None
+        return time.perf_counter() - started[0], started[1]
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        elapsed, _ = self._finish(run_id)
+        if elapsed is not None:
+            stage_seconds.observe(elapsed, stage="llm")
+        prompt_tokens, completion_tokens = token_usage(response)
+        if prompt_tokens:
+            llm_tokens.inc(prompt_tokens, kind="prompt")
+        if completion_tokens:
+            llm_tokens.inc(completion_tokens, kind="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        elapsed, _ = self._finish(run_id)
+        if elapsed is not None:
+            stage_seconds.observe(elapsed, stage="llm")
+        stage_errors.inc(stage="llm")
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, (serialized or {}).get("name", "unknown"))
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        elapsed, tool = self._finish(run_id)
+        if elapsed is not None:
+            tool_seconds.observe(elapsed, tool=tool)
+            tool_invocations.inc(tool=tool, status="success")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        elapsed, tool = self._finish(run_id)
+        if elapsed is not None:
+            tool_seconds.observe(elapsed, tool=tool)
+            tool_invocations.inc(tool=tool, status="error")
+
+
+metrics_callback = MetricsCallbackHandler()
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records instead of blocking or erroring when the listener falls behind."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps `rate` of the records logged with `extra={"sampled": True}`, and every other record."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+SAMPLED = {"sampled": True}
+
+logger = logging.getLogger("npc")
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> logging.Logger:
+    """
+    Send the `npc` logger through a queue so callers never wait on stdout. A
+    background listener thread formats and writes the records. Hot-path records
+    are sampled before they are queued.
+    """
+    global _listener
+    if _listener is not None:
+        return logger
+    records: queue.Queue = queue.Queue(maxsize=10000)
+    handler = DroppingQueueHandler(records)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+class LazyTruncate:
+    """Log argument shortening long message content, only when the record is actually written."""
+
+    def __init__(self, content: Any, limit: int = LOG_MAX_CONTENT):
+        self.content = content
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.content)
+        return text if len(text) <= self.limit else f"{text[:self.limit]}... ({len(text)} chars)"
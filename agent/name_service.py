@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import unicodedata
+from typing import Optional, Set
+
+from web3 import Web3
+
+from chain_client import ChainClient
+from metrics import logger
+
+try:
+    from ens_normalize import DisallowedSequence, ens_normalize
+except ImportError:
+    ens_normalize = None
+
+# Shared state namespace of labels held by in-flight provisioning jobs
+SHARED_RESERVATIONS = "label_reservation"
+
+
+class InvalidName(ValueError):
+    pass
+
+
+def normalize_label(name: str) -> str:
+    """
+    ENS-style label for an NPC name. Runs of whitespace become hyphens, then the
+    label is normalized with ENSIP-15 (`ens-normalize`) when installed, or else
+    NFKC case folded and limited to letters, digits and hyphens.
+    """
+    label = "-".join(name.split())
+    if ens_normalize is not None:
+        try:
+            label = ens_normalize(label)
+        except DisallowedSequence as e:
+            raise InvalidName(str(e)) from e
+    else:
+        label = unicodedata.normalize("NFKC", label).casefold()
+        for char in label:
+            if not (char.isalnum() or char == "-"):
+                raise InvalidName(f"Disallowed character {char!r}")
+    if not label:
+        raise InvalidName("Name is empty")
+    if "." in label:
+        raise InvalidName("Name can't contain dots")
+    # ENSIP-15 reserves "xx--" for label extensions such as punycode
+    if len(label) >= 4 and label[2:4] == "--" and label.isascii():
+        raise InvalidName("Hyphens can't be the 3rd and 4th characters")
+    return label
+
+
+class NameService:
+    """
+    Pre-flight checks for NPC names, run before any wallet or gas is spent.
+
+    Labelhashes known to be registered are kept in an in-memory set, filled
+    from the registry index when one is running, from every on-chain lookup
+    that finds a name taken and from our own registrations. A taken name is
+    rejected from the set without an RPC; an unknown one is checked once with
+    `L2Registrar.available` (or the registry's `ownerOf` without a registrar).
+    A label is reserved for the job provisioning it until its registration is
+    mined, in shared state so two workers can't hand out the same name.
+
+    Args:
+        client: Shared chain client
+        registry_address: L2Registry contract
+        registrar_address: Optional L2Registrar exposing `available`
+        indexer: Optional RegistryIndexer serving registered labelhashes
+        state: Shared state holding reservations
+        reservation_ttl: Seconds a reservation lasts if it is never released
+    """
+
+    def __init__(
+        self,
+        client: ChainClient,
+        registry_address: str,
+        registrar_address: Optional[str] = None,
+        indexer=None,
+        state=None,
+        reservation_ttl: float = 600,
+    ):
+        self.client = client
+        self.registry_address = registry_address
+        self.registrar_address = registrar_address
+        self.indexer = indexer
+        self.state = state
+        self.reservation_ttl = reservation_ttl
+        self._registered: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def is_known_registered(self, label: str) -> bool:
+        """Answered from memory, False means unknown rather than available."""
+        labelhash = Web3.to_hex(self.client.labelhash(label))
+        with self._lock:
+            if labelhash in self._registered:
+                return True
+        return self.indexer is not None and self.indexer.is_registered_labelhash(labelhash)
+
+    def mark_registered(self, label: str) -> None:
+        with self._lock:
+            self._registered.add(Web3.to_hex(self.client.labelhash(label)))
+
+    def forget(self, label: str) -> None:
+        """Drop a label whose registration reverted."""
+        with self._lock:
+            self._registered.discard(Web3.to_hex(self.client.labelhash(label)))
+
+    def is_available_on_chain(self, label: str) -> bool:
+        token_id = int.from_bytes(self.client.labelhash(label), "big")
+        if self.registrar_address:
+            available = self.client.registrar(self.registrar_address).functions.available(token_id).call()
+        else:
+            try:
+                owner = self.client.registry(self.registry_address).functions.ownerOf(token_id).call()
+            except Exception:
+                # ownerOf reverts for names that were never registered
+                return True
+            available = int(owner, 16) == 0
+        if not available:
+            self.mark_registered(label)
+        return available
+
+    def reserve(self, label: str, holder: str) -> bool:
+        if self.state is None:
+            return True
+        if self.state.set_if_absent(SHARED_RESERVATIONS, label, holder, ttl=self.reservation_ttl):
+            return True
+        # A retry of the same job already holds it
+        return self.state.get(SHARED_RESERVATIONS, label) == holder
+
+    def release(self, label: str, holder: str) -> None:
+        if self.state is not None and self.state.get(SHARED_RESERVATIONS, label) == holder:
+            self.state.delete(SHARED_RESERVATIONS, label)
+
+    async def claim(self, label: str, holder: str) -> Optional[str]:
+        """
+        Reserve `label` for `holder` if it can be registered. Returns None on
+        success, otherwise why the name can't be used.
+        """
+        domain = f"{label}.npc.eth"
+        if await asyncio.to_thread(self.is_known_registered, label):
+            return f"{domain} is already registered"
+        if not await asyncio.to_thread(self.reserve, label, holder):
+            return f"{domain} is being created by another request"
+        try:
+            available = await asyncio.to_thread(self.is_available_on_chain, label)
+        except Exception as e:
+            # The registration itself will fail if it's taken, don't block on the RPC
+            logger.warning(f"Couldn't check availability of {domain}: {e}")
+            return None
+        if not available:
+            await asyncio.to_thread(self.release, label, holder)
+            return f"{domain} is already registered"
+        return None
@@ -0,0 +1,313 @@
+import asyncio
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import httpx
+
+from metrics import logger, span
+
+
+def _merge(row: dict, changes: dict) -> dict:
+    """Apply `changes` to `row`, merging nested dicts (e.g. the wallet column) one level deep."""
+    merged = dict(row)
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = {**merged[key], **value}
+        else:
+            merged[key] = value
+    return merged
+
+
+class NPCStore:
+    """
+    Async access to the `npcs` table through Supabase's PostgREST API.
+
+    One pooled keep-alive HTTP client is shared by all requests. Writes go
+    through a write-behind buffer flushed every `flush_interval` seconds:
+
+    - inserts queued in the same interval are sent as one bulk insert
+    - updates are keyed by wallet address and merged, so several status,
+      balance or transaction hash changes to one NPC become a single write;
+      rows whose ids are known are re-read in one request, so changes made by
+      other workers are kept, and written back as one bulk upsert, others
+      fall back to one PATCH each
+    - an update for a row whose insert is still buffered is folded into it
+
+    Rows are tracked by `wallet.wallet_address`. `url` can point at a local
+    PostgREST for tests, or use InMemoryNPCStore instead.
+
+    Args:
+        url: Supabase project URL
+        key: Service key
+        table: Table holding NPC rows
+        flush_interval: Seconds between buffer flushes
+        max_batch: Maximum rows per bulk request
+        cache_size: Number of rows kept to serve reads and find ids for bulk upserts
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        table: str = "npcs",
+        flush_interval: float = 0.1,
+        max_batch: int = 500,
+        cache_size: int = 10000,
+    ):
+        self.table = table
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self._client = httpx.AsyncClient(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+            timeout=10,
+        )
+        self._lock = threading.Lock()
+        self._pending_inserts: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending_updates: Dict[str, dict] = {}
+        self._rows: "OrderedDict[str, dict]" = OrderedDict()
+
+    @staticmethod
+    def wallet_address(row: dict) -> str:
+        return row["wallet"]["wallet_address"]
+
+    # Reads
+
+    async def get_by_wallet(self, wallet_address: str) -> Optional[dict]:
+        with self._lock:
+            row = self._rows.get(wallet_address)
+        if row is not None:
+            return copy.deepcopy(row)
+        response = await self._client.get(
+            f"/{self.table}",
+            params={"select": "*", "wallet->>wallet_address": f"eq.{wallet_address}", "limit": "1"},
+        )
+        response.raise_for_status()
+        rows = response.json()
+        if not rows:
+            return None
+        self._remember(rows[0])
+        return rows[0]
+
+    async def wallet_addresses(self, page_size: int = 1000) -> List[str]:
+        """Wallet addresses of every NPC, read `page_size` rows at a time."""
+        addresses = []
+        offset = 0
+        while True:
+            response = await self._client.get(
+                f"/{self.table}",
+                params={"select": "address:wallet->>wallet_address", "limit": str(page_size), "offset": str(offset)},
+            )
+            response.raise_for_status()
+            rows = response.json()
+            addresses.extend(row["address"] for row in rows if row.get("address"))
+            if len(rows) < page_size:
+                return addresses
+            offset += page_size
+
+    # Writes
+
+    async def insert(self, npc: dict) -> dict:
+        """Queue an insert and return the stored row once its batch has been written."""
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._pending_inserts[self.wallet_address(npc)] = (dict(npc), future)
+        return await future
+
+    async def insert_many(self, npcs: List[dict]) -> List[dict]:
+        """Insert rows right away, `max_batch` rows per request."""
+        stored = []
+        for start in range(0, len(npcs), self.max_batch):
+            stored.extend(await self._bulk_insert(npcs[start:start + self.max_batch]))
+        return stored
+
+    def queue_update(self, wallet_address: str, changes: dict) -> None:
+        """Buffer changes to an NPC row. Safe to call from any thread."""
+        with self._lock:
+            pending = self._pending_inserts.get(wallet_address)
+            if pending is not None:
+                self._pending_inserts[wallet_address] = (_merge(pending[0], changes), pending[1])
+                return
+            previous = self._pending_updates.get(wallet_address, {})
+            self._pending_updates[wallet_address] = _merge(previous, changes)
+
+    async def flush(self) -> None:
+        with self._lock:
+            inserts = list(self._pending_inserts.values())
+            self._pending_inserts.clear()
+            updates = self._pending_updates
+            self._pending_updates = {}
+
+        for start in range(0, len(inserts), self.max_batch):
+            batch = inserts[start:start + self.max_batch]
+            try:
+                rows = await self._bulk_insert([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            by_wallet = {self.wallet_address(row): row for row in rows}
+            for row, future in batch:
+                stored = by_wallet.get(self.wallet_address(row))
+                if future.done():
+                    continue
+                if stored is None:
+                    future.set_exception(RuntimeError("Failed to save NPC to database"))
+                else:
+                    future.set_result(stored)
+
+        if updates:
+            await self._write_updates(updates)
+
+    async def _bulk_insert(self, rows: List[dict]) -> List[dict]:
+        async with span("supabase_insert"):
+            response = await self._client.post(
+                f"/{self.table}",
+                json=rows,
+                headers={"Prefer": "return=representation"},
+            )
+            response.raise_for_status()
+        stored = response.json()
+        for row in stored:
+            self._remember(row)
+        return stored
+
+    async def _write_updates(self, updates: Dict[str, dict]) -> None:
+        known, partial = {}, {}
+        with self._lock:
+            for wallet_address, changes in updates.items():
+                row = self._rows.get(wallet_address)
+                if row is not None and "id" in row:
+                    known[row["id"]] = (wallet_address, changes)
+                else:
+                    partial[wallet_address] = changes
+
+        ids = list(known)
+        for start in range(0, len(ids), self.max_batch):
+            chunk = ids[start:start + self.max_batch]
+            try:
+                # Other workers write these rows too, so merge into what is stored now rather than the cache
+                stored = await self._fetch_by_id(chunk)
+                batch = [_merge(row, known[row["id"]][1]) for row in stored]
+                if batch:
+                    async with span("supabase_update"):
+                        response = await self._client.post(
+                            f"/{self.table}",
+                            params={"on_conflict": "id"},
+                            json=batch,
+                            headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+                        )
+                        response.raise_for_status()
+                for row in batch:
+                    self._remember(row)
+            except Exception as e:
+                logger.error(f"Error writing NPC updates: {e}")
+                self._requeue(dict(known[row_id] for row_id in chunk))
+
+        for wallet_address, changes in partial.items():
+            try:
+                # Without the full row a nested wallet change would overwrite the column, fetch it first
+                if any(isinstance(value, dict) for value in changes.values()):
+                    row = await self.get_by_wallet(wallet_address)
+                    if row is None:
+                        logger.warning(f"No NPC row for {wallet_address}, dropping update")
+                        continue
+                    changes = {key: _merge(row, changes)[key] for key in changes}
+                async with span("supabase_update"):
+                    response = await self._client.patch(
+                        f"/{self.table}",
+                        params={"wallet->>wallet_address": f"eq.{wallet_address}"},
+                        json=changes,
+                    )
+                    response.raise_for_status()
+            except Exception as e:
+                logger.error(f"Error updating NPC {wallet_address}: {e}")
+
+    async def _fetch_by_id(self, ids: List[int]) -> List[dict]:
+        async with span("supabase_select"):
+            response = await self._client.get(
+                f"/{self.table}",
+                params={"select": "*", "id": f"in.({','.join(str(row_id) for row_id in ids)})"},
+            )
+            response.raise_for_status()
+        return response.json()
+
+    def _requeue(self, updates: Dict[str, dict]) -> None:
+        with self._lock:
+            for wallet_address, changes in updates.items():
+                self._pending_updates[wallet_address] = _merge(changes, self._pending_updates.get(wallet_address, {}))
+
+    def _remember(self, row: dict) -> None:
+        with self._lock:
+            wallet_address = self.wallet_address(row)
+            self._rows[wallet_address] = row
+            self._rows.move_to_end(wallet_address)
+            while len(self._rows) > self.cache_size:
+                self._rows.popitem(last=False)
+
+    async def run(self) -> None:
+        """Flush the write-behind buffer forever."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing NPC writes: {e}")
+
+    async def close(self) -> None:
+        await self.flush()
+        await self._client.aclose()
+
+
+class InMemoryNPCStore:
+    """Drop-in NPCStore replacement keeping rows in memory, for tests and benchmarks."""
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    async def get_by_wallet(self, wallet_address: str) -> Optional[dict]:
+        with self._lock:
+            row = self.rows.get(wallet_address)
+            return copy.deepcopy(row) if row else None
+
+    async def wallet_addresses(self) -> List[str]:
+        with self._lock:
+            return list(self.rows)
+
+    async def insert(self, npc: dict) -> dict:
+        return (await self.insert_many([npc]))[0]
+
+    async def insert_many(self, npcs: List[dict]) -> List[dict]:
+        stored = []
+        with self._lock:
+            for npc in npcs:
+                row = {**copy.deepcopy(npc), "id": self._next_id}
+                self._next_id += 1
+                self.rows[NPCStore.wallet_address(row)] = row
+                stored.append(copy.deepcopy(row))
+        return stored
+
+    def queue_update(self, wallet_address: str, changes: dict) -> None:
+        with self._lock:
+            if wallet_address in self.rows:
+                self.rows[wallet_address] = _merge(self.rows[wallet_address], changes)
+
+    async def flush(self) -> None:
+        pass
+
+    async def run(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,295 @@
+import asyncio
+import threading
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+from chain_client import MULTICALL3_ADDRESS, ChainClient
+from metrics import logger
+
+# Multicall3 reads native balances too, so a whole refresh is a few eth_calls
+GET_ETH_BALANCE_SELECTOR = Web3.keccak(text="getEthBalance(address)")[:4]
+BALANCE_OF_SELECTOR = Web3.keccak(text="balanceOf(address)")[:4]
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+
+# Shared state keys of the published balances and of wallets to start tracking
+SHARED_SNAPSHOT = ("portfolio", "balances")
+SHARED_TRACK = "portfolio_track"
+
+
+def format_balances(balances: dict) -> dict:
+    """Amounts as strings (JSON can't hold uint256), with the native balance in ETH too."""
+    return {
+        "address": balances["address"],
+        "block": balances["block"],
+        "native": str(balances["native"]),
+        "native_eth": format(Decimal(Web3.from_wei(balances["native"], "ether")).normalize(), "f"),
+        "tokens": {token: str(amount) for token, amount in balances["tokens"].items()},
+    }
+
+
+class PortfolioTracker:
+    """
+    In-memory native and ERC-20 balances of every tracked wallet, refreshed per block.
+
+    Each new block, native balances of all wallets are read with Multicall3
+    `getEthBalance`, batched into a few eth_calls at that block. Token balances
+    are read with batched `balanceOf` when a wallet is first tracked, then kept
+    current by applying the amounts of the tokens' `Transfer` logs, and re-read
+    in full every `reconcile_blocks` blocks so a reorg can't leave them wrong.
+    Reads are served from memory, so RPC load follows blocks and wallets rather
+    than how often balances are read.
+
+    With `state` (see shared_state.py) only one worker reads the chain: pass
+    `run` a `should_refresh` lease check. The worker holding it publishes its
+    balances to shared state after each refresh and the others load them from
+    there, so RPC load doesn't grow with the number of workers. Wallets tracked
+    on any worker are queued for the refreshing one.
+
+    Args:
+        client: Shared chain client
+        tokens: ERC-20 contracts to track
+        poll_interval: Seconds between checks for a new block
+        reconcile_blocks: Blocks between full token balance reads
+        on_change: Called from the refresh thread with `{address: balances}`
+            for the wallets whose balances changed in a refresh
+        state: Optional shared state to share the balances across worker processes
+    """
+
+    def __init__(
+        self,
+        client: ChainClient,
+        tokens: Sequence[str] = (),
+        poll_interval: float = 2,
+        reconcile_blocks: int = 100,
+        on_change: Optional[Callable[[Dict[str, dict]], None]] = None,
+        state=None,
+    ):
+        self.client = client
+        self.tokens = [Web3.to_checksum_address(token) for token in tokens]
+        self.poll_interval = poll_interval
+        self.reconcile_blocks = reconcile_blocks
+        self.on_change = on_change
+        self.state = state
+        self.last_block: Optional[int] = None
+        self._reconciled_block: Optional[int] = None
+        self._balances: Dict[str, Optional[dict]] = {}
+        self._unsynced: set = set()
+        self._lock = threading.Lock()
+
+    # Tracked wallets
+
+    def track(self, address: str) -> None:
+        address = Web3.to_checksum_address(address)
+        with self._lock:
+            if address in self._balances:
+                return
+            self._balances[address] = None
+            self._unsynced.add(address)
+        if self.state is not None:
+            self.state.push(SHARED_TRACK, address)
+
+    def track_many(self, addresses: Iterable[str]) -> None:
+        for address in addresses:
+            self.track(address)
+
+    def untrack(self, address: str) -> None:
+        address = Web3.to_checksum_address(address)
+        with self._lock:
+            self._balances.pop(address, None)
+            self._unsynced.discard(address)
+
+    def __contains__(self, address: str) -> bool:
+        with self._lock:
+            return Web3.to_checksum_address(address) in self._balances
+
+    # Reads, served from memory
+
+    def get(self, address: str) -> Optional[dict]:
+        """Balances of a tracked wallet, None until its first refresh."""
+        with self._lock:
+            balances = self._balances.get(Web3.to_checksum_address(address))
+        return format_balances(balances) if balances else None
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            balances = [b for b in self._balances.values() if b]
+        return [format_balances(b) for b in balances]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "wallets": len(self._balances),
+                "unsynced": len(self._unsynced),
+                "tokens": len(self.tokens),
+                "last_block": self.last_block,
+            }
+
+    # Refresh
+
+    def _read_native(self, addresses: List[str], block: int) -> Dict[str, int]:
+        calls = [
+            (MULTICALL3_ADDRESS, GET_ETH_BALANCE_SELECTOR + encode(["address"], [address]))
+            for address in addresses
+        ]
+        results = self.client.aggregate(calls, block_identifier=block)
+        return {
+            address: decode(["uint256"], data)[0]
+            for address, (success, data) in zip(addresses, results)
+            if success
+        }
+
+    def _read_tokens(self, addresses: List[str], block: int) -> Dict[str, Dict[str, int]]:
+        pairs = [(address, token) for address in addresses for token in self.tokens]
+        calls = [(token, BALANCE_OF_SELECTOR + encode(["address"], [address])) for address, token in pairs]
+        results = self.client.aggregate(calls, block_identifier=block) if calls else []
+        balances: Dict[str, Dict[str, int]] = {address: {} for address in addresses}
+        for (address, token), (success, data) in zip(pairs, results):
+            # Tokens that revert or return nothing (not an ERC-20) are left out
+            if success and len(data) >= 32:
+                balances[address][token] = decode(["uint256"], data[:32])[0]
+        return balances
+
+    def _read_transfers(self, from_block: int, to_block: int) -> List[tuple]:
+        """`(token, sender, recipient, amount)` of every ERC-20 transfer of the tracked tokens."""
+        logs = self.client.w3.eth.get_logs({
+            "address": self.tokens,
+            "fromBlock": from_block,
+            "toBlock": to_block,
+            "topics": [TRANSFER_TOPIC],
+        })
+        transfers = []
+        for log in logs:
+            # ERC-721 transfers index the token id as a 4th topic
+            if len(log["topics"]) != 3:
+                continue
+            topics = [Web3.to_hex(t) for t in log["topics"]]
+            transfers.append((
+                Web3.to_checksum_address(log["address"]),
+                Web3.to_checksum_address("0x" + topics[1][-40:]),
+                Web3.to_checksum_address("0x" + topics[2][-40:]),
+                int.from_bytes(bytes(log["data"])[:32], "big"),
+            ))
+        return transfers
+
+    def refresh_once(self) -> int:
+        """Bring every wallet up to the latest block. Returns the number of wallets that changed."""
+        with self._lock:
+            addresses = list(self._balances)
+            unsynced = set(self._unsynced)
+            current = {address: self._balances[address] for address in addresses}
+        if not addresses:
+            return 0
+        head = self.client.w3.eth.block_number
+        if head == self.last_block and not unsynced:
+            return 0
+
+        reconcile = (
+            self.last_block is None
+            or self._reconciled_block is None
+            or head - self._reconciled_block >= self.reconcile_blocks
+        )
+        native = self._read_native(addresses, head)
+        if reconcile:
+            tokens = self._read_tokens(addresses, head)
+        else:
+            tokens = self._read_tokens(sorted(unsynced), head)
+            for address in addresses:
+                if address not in tokens:
+                    tokens[address] = dict(current[address]["tokens"]) if current[address] else {}
+            if self.tokens and head > self.last_block:
+                for token, sender, recipient, amount in self._read_transfers(self.last_block + 1, head):
+                    # Wallets read in full at this block already include the transfer
+                    if sender in tokens and sender not in unsynced:
+                        tokens[sender][token] = tokens[sender].get(token, 0) - amount
+                    if recipient in tokens and recipient not in unsynced:
+                        tokens[recipient][token] = tokens[recipient].get(token, 0) + amount
+
+        changed: Dict[str, dict] = {}
+        with self._lock:
+            for address in addresses:
+                if address not in self._balances or address not in native:
+                    # Untracked meanwhile, or the read failed and is retried next block
+                    continue
+                balances = {"address": address, "block": head, "native": native[address], "tokens": tokens[address]}
+                previous = self._balances[address]
+                self._balances[address] = balances
+                self._unsynced.discard(address)
+                if previous is None or previous["native"] != balances["native"] or previous["tokens"] != balances["tokens"]:
+                    changed[address] = format_balances(balances)
+            self.last_block = head
+            if reconcile:
+                self._reconciled_block = head
+
+        if changed and self.on_change is not None:
+            self.on_change(changed)
+        return len(changed)
+
+    # Sharing across workers
+
+    def _track_queued(self) -> None:
+        """Start tracking the wallets other workers queued."""
+        while (address := self.state.pop(SHARED_TRACK)) is not None:
+            with self._lock:
+                if address not in self._balances:
+                    self._balances[address] = None
+                    self._unsynced.add(address)
+
+    def publish(self) -> None:
+        with self._lock:
+            balances = {address: b for address, b in self._balances.items() if b}
+            block = self.last_block
+        self.state.set(*SHARED_SNAPSHOT, {"block": block, "balances": balances})
+
+    def load(self) -> None:
+        """Take the balances published by the refreshing worker."""
+        snapshot = self.state.get(*SHARED_SNAPSHOT)
+        if snapshot is None:
+            return
+        with self._lock:
+            for address, balances in snapshot["balances"].items():
+                self._balances[address] = balances
+                self._unsynced.discard(address)
+            self.last_block = snapshot["block"]
+
+    def sync_once(self, should_refresh: Callable[[], bool] = lambda: True) -> None:
+        if self.state is None:
+            self.refresh_once()
+            return
+        if not should_refresh():
+            self.load()
+            return
+        self._track_queued()
+        published = self.last_block
+        if self.refresh_once() or self.last_block != published:
+            self.publish()
+
+    async def run(self, should_refresh: Callable[[], bool] = lambda: True) -> None:
+        """Follow new blocks forever, off the event loop, whenever `should_refresh` allows it."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once, should_refresh)
+            except Exception as e:
+                logger.error(f"Portfolio: error refreshing balances: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+def portfolio_tool(tracker: PortfolioTracker):
+    """Agent tool answering balance questions for tracked wallets from the tracker."""
+    from langchain_core.tools import StructuredTool
+
+    def get_portfolio(wallet_address: str) -> str:
+        """Get the native ETH and ERC-20 token balances of an NPC wallet address."""
+        try:
+            balances = tracker.get(wallet_address)
+        except ValueError:
+            return f"Error: {wallet_address} is not a valid address"
+        if balances is None:
+            return f"No balances tracked for {wallet_address} yet, use get_balance instead."
+        lines = [f"Balances of {balances['address']} at block {balances['block']}:", f"- ETH: {balances['native_eth']}"]
+        lines.extend(f"- {token}: {amount}" for token, amount in balances["tokens"].items())
+        return "\n".join(lines)
+
+    return StructuredTool.from_function(get_portfolio)
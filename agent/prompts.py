@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+
+try:
+    import tiktoken
+    _encoding = tiktoken.encoding_for_model("gpt-4")
+except Exception:
+    _encoding = None
+
+# Shared instructions come first so every NPC's system prompt starts with the
+# same bytes, which is what provider-side prompt caching keys on.
+BASE_INSTRUCTIONS = """You are a helpful agent that can interact onchain using the Coinbase Developer Platform Agentkit.
+You are empowered to interact onchain using your tools. If you ever need funds, you can request them from the faucet if you are on network ID `base-sepolia`.
+If not, you can provide your wallet details and request funds from the user. If someone asks you to do something you can't do with your currently available tools,
+you must say so, and encourage them to implement it themselves using the CDP SDK + Agentkit, recommend they go to docs.cdp.coinbase.com for more informaton.
+Be concise and helpful with your responses. Refrain from restating your tools' descriptions unless it is explicitly requested."""
+
+DEFI_INSTRUCTIONS = """You are an advanced AI agent specialized in DeFi operations and market analysis.
+You can:
+1. Place bets on prediction markets with careful risk assessment
+2. Analyze tokens using multiple metrics (liquidity, volume, holders, price)
+3. Discover new tokens matching specific criteria
+
+Always explain your reasoning and provide risk warnings when appropriate.
+Consider the NPC's personality traits when making decisions:
+- Risk Tolerance affects bet sizes and token recommendations
+- Rationality influences analysis depth and decision-making
+- Autonomy determines how much confirmation you seek before actions
+
+Remember to:
+- Start with analysis before making recommendations
+- Provide clear risk warnings
+- Explain your reasoning
+- Consider the user's goals and risk tolerance"""
+
+TEMPLATES = {
+    "agent": [BASE_INSTRUCTIONS],
+    "defi": [BASE_INSTRUCTIONS, DEFI_INSTRUCTIONS],
+}
+
+PERSONALITY_TEMPLATE = """You are an NPC with the following traits:
+- Name: {name}
+- Background: {background}
+- Risk Tolerance: {risk_tolerance}
+- Rationality: {rationality}
+- Autonomy: {autonomy}
+- Core Values: {core_values}
+- Primary Aims: {primary_aims}
+- Voice: {voice}
+
+Incorporate these traits into your responses and decision-making."""
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the GPT-4 tokenizer when tiktoken is installed, estimated otherwise."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    template: str
+    digest: str
+    text: str
+    tokens: int
+    prefix_tokens: int
+
+
+def personality_fields(npc_config: Optional[dict]) -> Optional[dict]:
+    """The parts of an NPC config that end up in its prompt."""
+    if not npc_config:
+        return None
+    personality = npc_config.get("personality", {})
+    voice = npc_config.get("voice") or {}
+    return {
+        "name": npc_config["name"],
+        "background": npc_config["background"],
+        "risk_tolerance": personality.get("riskTolerance"),
+        "rationality": personality.get("rationality"),
+        "autonomy": personality.get("autonomy"),
+        "core_values": list(npc_config.get("core_values", [])),
+        "primary_aims": list(npc_config.get("primary_aims", [])),
+        "voice": voice.get("type"),
+    }
+
+
+def config_digest(template: str, fields: Optional[dict]) -> str:
+    canonical = json.dumps({"template": template, "npc": fields}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PromptCache:
+    """
+    Compiles NPC personalities into system prompts, cached by a hash of the
+    fields that feed the prompt.
+
+    NPCs with identical personalities share one compiled prompt, and a given
+    personality always compiles to byte-identical text, so the prompt stays
+    stable across agent rebuilds and turns. The least recently used prompts
+    are dropped beyond `maxsize`.
+
+    Args:
+        maxsize: Maximum number of compiled prompts kept
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._prompts: "OrderedDict[str, CompiledPrompt]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, npc_config: Optional[dict], template: str = "agent") -> CompiledPrompt:
+        fields = personality_fields(npc_config)
+        digest = config_digest(template, fields)
+        with self._lock:
+            compiled = self._prompts.get(digest)
+            if compiled is not None:
+                self._prompts.move_to_end(digest)
+                return compiled
+
+        prefix = "\n\n".join(TEMPLATES[template])
+        sections = [prefix]
+        if fields:
+            sections.append(PERSONALITY_TEMPLATE.format(**{
+                **fields,
+                "core_values": ", ".join(fields["core_values"]),
+                "primary_aims": ", ".join(fields["primary_aims"]),
+                "voice": fields["voice"] or "neutral",
+            }))
+        text = "\n\n".join(sections)
+        compiled = CompiledPrompt(
+            template=template,
+            digest=digest,
+            text=text,
+            tokens=count_tokens(text),
+            prefix_tokens=count_tokens(prefix),
+        )
+        with self._lock:
+            compiled = self._prompts.setdefault(digest, compiled)
+            self._prompts.move_to_end(digest)
+            while len(self._prompts) > self.maxsize:
+                self._prompts.popitem(last=False)
+        return compiled
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "template": p.template,
+                    "digest": p.digest,
+                    "tokens": p.tokens,
+                    "shared_prefix_tokens": p.prefix_tokens,
+                }
+                for p in self._prompts.values()
+            ]
+
+
+prompt_cache = PromptCache(maxsize=int(os.getenv("PROMPT_CACHE_SIZE", "1024")))
+
+
+def compile_prompt(npc_config: Optional[dict], template: str = "agent") -> CompiledPrompt:
+    return prompt_cache.compile(npc_config, template)
@@ -0,0 +1,234 @@
+import asyncio
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from metrics import logger
+
+# Shared state namespaces of published jobs and claimed idempotency keys
+SHARED_JOBS = "provisioning_job"
+SHARED_KEYS = "idempotency_key"
+
+
+class ProvisioningJob:
+    """
+    State of one NPC creation.
+
+    Each stage records its own status and duration so the status endpoint shows
+    where a job is and where its time went. `ready` is set once the response
+    data (wallet and domain) is known, which is when the HTTP request returns;
+    the remaining stages keep running in the background.
+
+    `on_change` is called with the job whenever its state changes, e.g. to
+    publish it to other workers.
+    """
+
+    def __init__(self, idempotency_key: Optional[str] = None, on_change: Optional[Callable] = None):
+        self.on_change = on_change
+        self.job_id = uuid.uuid4().hex
+        self.idempotency_key = idempotency_key
+        self.status = "pending"
+        self.stages: dict = {}
+        self.response: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.ready = asyncio.Event()
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        stage = {"status": "running", "started_at": time.time()}
+        self.stages[name] = stage
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            stage["status"] = "failed"
+            stage["error"] = str(e)
+            raise
+        else:
+            stage["status"] = "succeeded"
+        finally:
+            stage["duration"] = round(time.perf_counter() - started, 4)
+            self._changed()
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def respond(self, response: dict) -> None:
+        self.response = response
+        self._changed()
+        self.ready.set()
+
+    def succeed(self) -> None:
+        self.status = "succeeded"
+        self.finished_at = time.time()
+        self._changed()
+
+    def fail(self, error: str) -> None:
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+        self._changed()
+        # Wake any request still waiting for a response
+        self.ready.set()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ProvisioningJob":
+        """Read-only view of a job published by another worker."""
+        job = cls(data.get("idempotency_key"))
+        job.job_id = data["job_id"]
+        job.status = data["status"]
+        job.stages = data["stages"]
+        job.response = data["response"]
+        job.error = data["error"]
+        job.created_at = data["created_at"]
+        job.finished_at = data["finished_at"]
+        if job.response is not None or job.status == "failed":
+            job.ready.set()
+        return job
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "idempotency_key": self.idempotency_key,
+            "status": self.status,
+            "stages": self.stages,
+            "response": self.response,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ProvisioningJobs:
+    """
+    Registry of provisioning jobs with idempotency keys.
+
+    A retried request carrying the same idempotency key gets the original job
+    back instead of starting a new one, so client retries never create a second
+    wallet or domain. Jobs that failed before producing a response release
+    their key so the client can try again. Only the newest `max_jobs` jobs are
+    kept.
+
+    With `state` (see shared_state.py) idempotency keys are claimed atomically
+    in shared state and jobs are published there for `ttl` seconds, so a retry
+    or status request reaching another worker finds the job started here.
+    Changes made on the event loop are written from a thread, latest first.
+    Call `get_or_create` and `release_key` from a thread as well.
+    """
+
+    def __init__(self, max_jobs: int = 10000, state=None, ttl: float = 86400):
+        self.max_jobs = max_jobs
+        self.state = state
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, ProvisioningJob]" = OrderedDict()
+        self._keys: dict = {}
+        self._lock = threading.Lock()
+        # Latest unwritten state per job, and the tasks writing them
+        self._unpublished: dict = {}
+        self._publishers: set = set()
+
+    def _publish(self, job: ProvisioningJob) -> None:
+        # Stages keep changing on the loop while a thread serializes the snapshot
+        data = copy.deepcopy(job.to_dict())
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.state.set(SHARED_JOBS, job.job_id, data, ttl=self.ttl)
+            return
+        with self._lock:
+            writing = job.job_id in self._unpublished
+            self._unpublished[job.job_id] = data
+        if not writing:
+            task = loop.create_task(self._write_published(job.job_id))
+            self._publishers.add(task)
+            task.add_done_callback(self._publishers.discard)
+
+    async def _write_published(self, job_id: str) -> None:
+        # One writer per job, so an older state never overwrites a newer one
+        while True:
+            with self._lock:
+                data = self._unpublished[job_id]
+            try:
+                await asyncio.to_thread(self.state.set, SHARED_JOBS, job_id, data, ttl=self.ttl)
+            except Exception as e:
+                logger.error(f"Provisioning: error publishing job {job_id}: {e}")
+            with self._lock:
+                if self._unpublished[job_id] is data:
+                    del self._unpublished[job_id]
+                    return
+
+    def _get_shared(self, job_id: Optional[str]) -> Optional[ProvisioningJob]:
+        if self.state is None or job_id is None:
+            return None
+        data = self.state.get(SHARED_JOBS, job_id)
+        return ProvisioningJob.from_dict(data) if data else None
+
+    def is_local(self, job: ProvisioningJob) -> bool:
+        with self._lock:
+            return self._jobs.get(job.job_id) is job
+
+    def get(self, job_id: str) -> Optional[ProvisioningJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._get_shared(job_id)
+
+    def get_or_create(self, idempotency_key: Optional[str]) -> tuple:
+        """Return `(job, created)`, reusing the job already started for `idempotency_key`."""
+        with self._lock:
+            if idempotency_key:
+                job_id = self._keys.get(idempotency_key)
+                if job_id in self._jobs:
+                    return self._jobs[job_id], False
+            job = ProvisioningJob(idempotency_key, self._publish if self.state is not None else None)
+            if idempotency_key and self.state is not None:
+                if not self.state.set_if_absent(SHARED_KEYS, idempotency_key, job.job_id, ttl=self.ttl):
+                    existing = self._get_shared(self.state.get(SHARED_KEYS, idempotency_key))
+                    if existing is not None:
+                        return existing, False
+                    self.state.set(SHARED_KEYS, idempotency_key, job.job_id, ttl=self.ttl)
+                self._publish(job)
+            self._jobs[job.job_id] = job
+            if idempotency_key:
+                self._keys[idempotency_key] = job.job_id
+            while len(self._jobs) > self.max_jobs:
+                _, old = self._jobs.popitem(last=False)
+                if old.idempotency_key:
+                    self._keys.pop(old.idempotency_key, None)
+            return job, True
+
+    def release_key(self, job: ProvisioningJob) -> None:
+        with self._lock:
+            if job.idempotency_key and self._keys.get(job.idempotency_key) == job.job_id:
+                del self._keys[job.idempotency_key]
+        if job.idempotency_key and self.state is not None:
+            if self.state.get(SHARED_KEYS, job.idempotency_key) == job.job_id:
+                self.state.delete(SHARED_KEYS, job.idempotency_key)
+
+    async def wait_for_response(self, job: ProvisioningJob, poll_interval: float = 0.1, timeout: float = 60) -> ProvisioningJob:
+        """
+        Wait up to `timeout` seconds until `job` has a response or failed. Jobs
+        run by another worker are polled from shared state; returns the latest
+        view of the job, whose `ready` is still unset on timeout.
+        """
+        if self.is_local(job) or job.ready.is_set():
+            try:
+                await asyncio.wait_for(job.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return job
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(poll_interval)
+            latest = await asyncio.to_thread(self._get_shared, job.job_id)
+            if latest is not None:
+                job = latest
+                if job.ready.is_set():
+                    break
+        return job
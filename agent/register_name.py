@@ -1,5 +1,6 @@
-from web3 import Web3
-from eth_account import Account
+from chain_client import get_chain_client
+from fee_oracle import get_fee_oracle
+from tx_manager import GAS_ESTIMATE_MARGIN
 import os
 
 def register_domain(domain_name: str, owner_address: str, private_key: str, rpc_url: str, contract_address: str):
@@ -13,44 +14,32 @@ def register_domain(domain_name: str, owner_address: str, private_key: str, rpc_
         rpc_url: URL of the RPC endpoint
         contract_address: Address of the L2Registry contract
     """
-    # Connect to network
-    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    # Shared connection, contract and signer for this endpoint
+    client = get_chain_client(rpc_url)
+    w3 = client.w3
+    account = client.account(private_key)
+    contract = client.registry(contract_address)
     
-    # Create account object from private key
-    account = Account.from_key(private_key)
-    
-    # Contract ABI - only including the functions we need
-    abi = [
-        {
-            "inputs": [
-                {"internalType": "string", "name": "label", "type": "string"},
-                {"internalType": "address", "name": "owner", "type": "address"}
-            ],
-            "name": "register",
-            "outputs": [],
-            "stateMutability": "nonpayable",
-            "type": "function"
-        }
-    ]
-    
-    # Create contract instance
-    contract = w3.eth.contract(address=contract_address, abi=abi)
+    # Fees and gas from the shared per-block fee oracle
+    fee_oracle = get_fee_oracle(client)
     
     # Build transaction
     nonce = w3.eth.get_transaction_count(account.address)
     
-    transaction = contract.functions.register(
+    register_call = contract.functions.register(
         domain_name,
         owner_address
-    ).build_transaction({
+    )
+    transaction = register_call.build_transaction({
         'from': account.address,
         'nonce': nonce,
-        'gas': 300000,  # Adjust gas limit as needed
-        'gasPrice': w3.eth.gas_price
+        'chainId': client.chain_id,
+        'gas': int(fee_oracle.estimate_gas(register_call, account.address) * GAS_ESTIMATE_MARGIN),
+        **fee_oracle.tx_params(),
     })
     
     # Sign transaction
-    signed_txn = w3.eth.account.sign_transaction(transaction, private_key)
+    signed_txn = account.sign_transaction(transaction)
     
     # Send transaction
     tx_hash = w3.eth.send_raw_transaction(signed_txn.raw_transaction)  # Changed from rawTransaction to raw_transaction
@@ -71,7 +60,7 @@ if __name__ == "__main__":
     
     try:
         # Check if Web3 is connected
-        w3 = Web3(Web3.HTTPProvider(RPC_URL))
+        w3 = get_chain_client(RPC_URL).w3
         if not w3.is_connected():
             raise Exception("Failed to connect to the network")
             
@@ -0,0 +1,127 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from metrics import logger
+from tx_manager import TransactionManager
+
+
+@dataclass
+class _Registration:
+    label: str
+    owner: str
+    on_mined: Optional[Callable[[dict], None]]
+    future: asyncio.Future
+
+
+class RegistrationQueue:
+    """
+    Coalesces `.npc.eth` registrations into batched transactions.
+
+    Registrations arriving within `window` seconds of each other (up to
+    `max_batch` of them) are sent as a single `registerBatch` call on the
+    L2Registrar. If the batch is a single label, or the batch would revert (for
+    example because one label is taken), each label is sent as its own
+    `register` transaction instead, through the registrar when one is
+    configured. Gas is freshly estimated for every transaction, and a label
+    whose estimate fails is failed without being sent.
+
+    Args:
+        tx_manager: Sender for the registrar key
+        registry_address: L2Registry, registered on directly without a registrar
+        registrar_address: L2Registrar exposing `register` and `registerBatch`
+        window: Seconds to wait for more registrations after the first arrives
+        max_batch: Maximum number of labels per transaction
+    """
+
+    def __init__(
+        self,
+        tx_manager: TransactionManager,
+        registry_address: str,
+        registrar_address: Optional[str] = None,
+        window: float = 0.25,
+        max_batch: int = 50,
+    ):
+        self.tx_manager = tx_manager
+        self.registry = tx_manager.client.registry(registry_address)
+        self.registrar = tx_manager.client.registrar(registrar_address) if registrar_address else None
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def register(self, label: str, owner: str, on_mined: Optional[Callable[[dict], None]] = None) -> str:
+        """Queue a registration and return its transaction hash once it has been broadcast."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_Registration(label, owner, on_mined, future))
+        return await future
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._submit(batch)
+            except Exception as e:
+                # Keep consuming, or every later registration would wait forever
+                logger.error(f"Error submitting {len(batch)} registrations: {e}")
+                self._fail(batch, e)
+
+    async def _submit(self, batch: List[_Registration]) -> None:
+        if self.registrar is not None and len(batch) > 1:
+            try:
+                call = self.registrar.functions.registerBatch(
+                    [r.label for r in batch],
+                    [r.owner for r in batch],
+                )
+                # A fresh estimate, it also tells whether the batch would revert
+                gas = await asyncio.to_thread(self.tx_manager.estimate_gas, call)
+            except Exception as e:
+                logger.info(f"Batch of {len(batch)} registrations would fail, sending individually: {e}")
+            else:
+                await self._send(batch, call, gas)
+                return
+
+        # The registry only accepts registrations from its registrar when one is set
+        contract = self.registrar if self.registrar is not None else self.registry
+        for registration in batch:
+            try:
+                call = contract.functions.register(registration.label, registration.owner)
+                gas = await asyncio.to_thread(self.tx_manager.estimate_gas, call)
+            except Exception as e:
+                # A bad owner or a call that would revert, don't spend gas finding out
+                self._fail([registration], e)
+                continue
+            await self._send([registration], call, gas)
+
+    @staticmethod
+    def _fail(batch: List[_Registration], error: Exception) -> None:
+        for registration in batch:
+            if not registration.future.done():
+                registration.future.set_exception(error)
+
+    async def _send(self, batch: List[_Registration], call, gas: int) -> None:
+        callbacks = [r.on_mined for r in batch if r.on_mined]
+
+        def on_mined(receipt):
+            for callback in callbacks:
+                try:
+                    callback(receipt)
+                except Exception as e:
+                    logger.error(f"Error handling registration receipt: {e}")
+
+        try:
+            tx_hash = await asyncio.to_thread(self.tx_manager.send, call, gas, on_mined)
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        for registration in batch:
+            if not registration.future.done():
+                registration.future.set_result(tx_hash)
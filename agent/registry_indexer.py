@@ -0,0 +1,335 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from eth_abi import decode
+from web3 import Web3
+
+from chain_client import ChainClient
+from metrics import logger
+
+ZERO_ADDRESS = "0x" + "00" * 20
+COIN_TYPE_ETH = 60
+
+REGISTERED_TOPIC = Web3.to_hex(Web3.keccak(text="Registered(string,address)"))
+TEXT_CHANGED_TOPIC = Web3.to_hex(Web3.keccak(text="TextChanged(bytes32,string,string)"))
+ADDR_CHANGED_TOPIC = Web3.to_hex(Web3.keccak(text="AddrChanged(bytes32,uint256,bytes)"))
+CONTENTHASH_CHANGED_TOPIC = Web3.to_hex(Web3.keccak(text="ContenthashChanged(bytes32,bytes)"))
+# ERC721 transfers keep the owner current after registration
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+
+EVENT_KINDS = {
+    REGISTERED_TOPIC: "registered",
+    TEXT_CHANGED_TOPIC: "text",
+    ADDR_CHANGED_TOPIC: "addr",
+    CONTENTHASH_CHANGED_TOPIC: "contenthash",
+    TRANSFER_TOPIC: "transfer",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS events (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    labelhash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_labelhash ON events (labelhash);
+CREATE TABLE IF NOT EXISTS names (
+    labelhash TEXT PRIMARY KEY,
+    label TEXT,
+    owner TEXT,
+    addr TEXT,
+    contenthash TEXT,
+    registered_block INTEGER
+);
+CREATE INDEX IF NOT EXISTS names_label ON names (label);
+CREATE TABLE IF NOT EXISTS texts (
+    labelhash TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (labelhash, key)
+);
+"""
+
+
+def labelhash_for(label: str) -> str:
+    return Web3.to_hex(Web3.keccak(text=label))
+
+
+def decode_log(log) -> Optional[dict]:
+    """Turn a raw registry log into an index event, or None for unrelated logs."""
+    topics = [Web3.to_hex(t) for t in log["topics"]]
+    kind = EVENT_KINDS.get(topics[0]) if topics else None
+    if kind is None:
+        return None
+    data = bytes(log["data"])
+
+    if kind == "registered":
+        label, owner = decode(["string", "address"], data)
+        payload = {"label": label, "owner": Web3.to_checksum_address(owner)}
+        labelhash = labelhash_for(label)
+    elif kind == "transfer":
+        if len(topics) != 4:
+            # ERC20 style Transfer with a non-indexed amount, not ours
+            return None
+        payload = {"owner": Web3.to_checksum_address("0x" + topics[2][-40:])}
+        labelhash = topics[3]
+    else:
+        labelhash = topics[1]
+        if kind == "text":
+            key, value = decode(["string", "string"], data)
+            payload = {"key": key, "value": value}
+        elif kind == "addr":
+            coin_type, value = decode(["uint256", "bytes"], data)
+            payload = {"coin_type": coin_type, "value": Web3.to_hex(value)}
+        else:
+            (value,) = decode(["bytes"], data)
+            payload = {"value": Web3.to_hex(value)}
+
+    return {
+        "block_number": log["blockNumber"],
+        "block_hash": Web3.to_hex(log["blockHash"]),
+        "log_index": log["logIndex"],
+        "kind": kind,
+        "labelhash": labelhash,
+        "data": payload,
+    }
+
+
+class RegistryIndexer:
+    """
+    Local SQLite index of L2Registry names built from contract events.
+
+    Backfills `Registered`, `AddrChanged`, `TextChanged`, `ContenthashChanged`
+    and ERC721 `Transfer` logs with `eth_getLogs` in `chunk_size` block ranges,
+    then tails new blocks. Raw events are kept alongside the materialized name
+    records, so when a reorg replaces an indexed block the events from the
+    orphaned blocks are dropped and the affected names are replayed from what
+    remains. Name records are mirrored in memory, lookups never touch the RPC.
+
+    Args:
+        client: Shared chain client
+        registry_address: L2Registry contract to index
+        db_path: SQLite file for the index
+        start_block: Block to start backfilling from, usually the deployment block
+        chunk_size: Blocks per eth_getLogs request
+        confirmations: Blocks to stay behind the chain head
+        poll_interval: Seconds between polls for new blocks
+    """
+
+    def __init__(
+        self,
+        client: ChainClient,
+        registry_address: str,
+        db_path: str = "registry_index.sqlite",
+        start_block: int = 0,
+        chunk_size: int = 2000,
+        confirmations: int = 2,
+        poll_interval: float = 2,
+    ):
+        self.client = client
+        self.registry_address = Web3.to_checksum_address(registry_address)
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._names: Dict[str, dict] = {}
+        self._by_label: Dict[str, str] = {}
+        self._load()
+
+    # Reads, served from memory under the same lock the sync thread writes with
+
+    def resolve(self, label: str) -> Optional[str]:
+        record = self.get(label)
+        return record["addr"] if record else None
+
+    def get(self, label: str) -> Optional[dict]:
+        with self._lock:
+            labelhash = self._by_label.get(label)
+            if labelhash is None:
+                return None
+            record = self._names.get(labelhash)
+            return dict(record) if record is not None else None
+
+    def is_available(self, label: str) -> bool:
+        with self._lock:
+            return labelhash_for(label) not in self._names
+
+    def is_registered_labelhash(self, labelhash: str) -> bool:
+        with self._lock:
+            return labelhash in self._names
+
+    def labelhashes(self) -> Set[str]:
+        with self._lock:
+            return set(self._names)
+
+    def list_names(self) -> List[dict]:
+        with self._lock:
+            return [dict(record) for record in self._names.values() if record["label"] is not None]
+
+    def texts(self, label: str) -> Dict[str, str]:
+        with self._lock:
+            labelhash = self._by_label.get(label)
+            if labelhash is None:
+                return {}
+            rows = self.conn.execute("SELECT key, value FROM texts WHERE labelhash = ?", (labelhash,))
+            return {row["key"]: row["value"] for row in rows}
+
+    @property
+    def last_block(self) -> Optional[int]:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_block'").fetchone()
+        return int(row["value"]) if row else None
+
+    # Sync
+
+    def sync_once(self) -> int:
+        """Catch up to `confirmations` blocks behind head. Returns the number of events applied."""
+        w3 = self.client.w3
+        self._handle_reorg()
+        head = w3.eth.block_number - self.confirmations
+        last = self.last_block
+        start = self.start_block if last is None else last + 1
+        applied = 0
+        while start <= head:
+            end = min(start + self.chunk_size - 1, head)
+            logs = w3.eth.get_logs({
+                "address": self.registry_address,
+                "fromBlock": start,
+                "toBlock": end,
+                "topics": [list(EVENT_KINDS)],
+            })
+            events = [e for e in (decode_log(log) for log in logs) if e is not None]
+            end_hash = Web3.to_hex(w3.eth.get_block(end)["hash"])
+            self._apply(events, end, end_hash)
+            applied += len(events)
+            start = end + 1
+        return applied
+
+    def _apply(self, events: List[dict], end_block: int, end_hash: str) -> None:
+        touched = set()
+        with self._lock, self.conn:
+            for event in events:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?)",
+                    (event["block_number"], event["log_index"], event["kind"],
+                     event["labelhash"], json.dumps(event["data"])),
+                )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO blocks VALUES (?, ?)",
+                    (event["block_number"], event["block_hash"]),
+                )
+                self._apply_event(event["kind"], event["labelhash"], event["data"], event["block_number"])
+                touched.add(event["labelhash"])
+            self.conn.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (end_block, end_hash))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_block', ?)", (str(end_block),))
+        self._refresh(touched)
+
+    def _apply_event(self, kind: str, labelhash: str, data: dict, block_number: int) -> None:
+        self.conn.execute("INSERT OR IGNORE INTO names (labelhash) VALUES (?)", (labelhash,))
+        if kind == "registered":
+            self.conn.execute(
+                "UPDATE names SET label = ?, owner = ?, registered_block = ? WHERE labelhash = ?",
+                (data["label"], data["owner"], block_number, labelhash),
+            )
+        elif kind == "transfer":
+            owner = None if data["owner"] == ZERO_ADDRESS else data["owner"]
+            self.conn.execute("UPDATE names SET owner = ? WHERE labelhash = ?", (owner, labelhash))
+        elif kind == "addr" and data["coin_type"] == COIN_TYPE_ETH:
+            value = data["value"]
+            addr = Web3.to_checksum_address(value) if len(value) == 42 else None
+            self.conn.execute("UPDATE names SET addr = ? WHERE labelhash = ?", (addr, labelhash))
+        elif kind == "contenthash":
+            self.conn.execute("UPDATE names SET contenthash = ? WHERE labelhash = ?", (data["value"], labelhash))
+        elif kind == "text":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO texts VALUES (?, ?, ?)",
+                (labelhash, data["key"], data["value"]),
+            )
+
+    def _handle_reorg(self) -> None:
+        """Roll back indexed blocks whose hash no longer matches the canonical chain."""
+        w3 = self.client.w3
+        last = self.last_block
+        if last is None:
+            return
+        with self._lock:
+            stored = self.conn.execute("SELECT number, hash FROM blocks ORDER BY number DESC").fetchall()
+        # Every block holding an indexed event has its hash stored, so the newest
+        # stored block that is still canonical is a safe point to roll back to
+        safe_block = self.start_block - 1
+        for row in stored:
+            block = w3.eth.get_block(row["number"])
+            if Web3.to_hex(block["hash"]) == row["hash"]:
+                safe_block = row["number"]
+                break
+        if safe_block >= last:
+            return
+
+        logger.info(f"Registry index: reorg detected, rolling back to block {safe_block}")
+        with self._lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT DISTINCT labelhash FROM events WHERE block_number > ?", (safe_block,)
+            ).fetchall()
+            touched = {row["labelhash"] for row in rows}
+            self.conn.execute("DELETE FROM events WHERE block_number > ?", (safe_block,))
+            self.conn.execute("DELETE FROM blocks WHERE number > ?", (safe_block,))
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_block', ?)", (str(safe_block),))
+            self._replay(touched)
+        self._refresh(touched)
+
+    def _replay(self, labelhashes: Iterable[str]) -> None:
+        for labelhash in labelhashes:
+            self.conn.execute("DELETE FROM names WHERE labelhash = ?", (labelhash,))
+            self.conn.execute("DELETE FROM texts WHERE labelhash = ?", (labelhash,))
+            rows = self.conn.execute(
+                "SELECT * FROM events WHERE labelhash = ? ORDER BY block_number, log_index", (labelhash,)
+            ).fetchall()
+            for row in rows:
+                self._apply_event(row["kind"], labelhash, json.loads(row["data"]), row["block_number"])
+
+    def prune_blocks(self, keep: int = 256) -> None:
+        """Only recent block hashes are needed for reorg detection."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM blocks WHERE number < (SELECT MAX(number) FROM blocks) - ?", (keep,)
+            )
+
+    def _load(self) -> None:
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM names").fetchall()
+            self._names = {row["labelhash"]: dict(row) for row in rows}
+            self._by_label = {r["label"]: h for h, r in self._names.items() if r["label"] is not None}
+
+    def _refresh(self, labelhashes: Iterable[str]) -> None:
+        with self._lock:
+            for labelhash in labelhashes:
+                previous = self._names.pop(labelhash, None)
+                if previous and previous["label"] is not None:
+                    self._by_label.pop(previous["label"], None)
+                row = self.conn.execute("SELECT * FROM names WHERE labelhash = ?", (labelhash,)).fetchone()
+                if row is not None:
+                    record = dict(row)
+                    self._names[labelhash] = record
+                    if record["label"] is not None:
+                        self._by_label[record["label"]] = labelhash
+
+    async def run(self) -> None:
+        """Backfill, then follow the chain forever, off the event loop."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+                await asyncio.to_thread(self.prune_blocks)
+            except Exception as e:
+                logger.info(f"Registry index: error syncing: {e}")
+            await asyncio.sleep(self.poll_interval)
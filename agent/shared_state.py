@@ -0,0 +1,293 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:
+    Fernet = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_namespace ON queue (namespace, id);
+"""
+
+
+class SharedState:
+    """
+    State shared by every worker process on a host, kept in one SQLite file.
+
+    Values are JSON encoded and grouped by namespace. Keys can expire after a
+    TTL, which also backs the leases used for sticky sessions and for running
+    a background loop on one worker only. Every read-modify-write runs in an
+    immediate transaction, so workers never interleave inside one. Use
+    RedisState (same methods) to share state between machines.
+
+    Args:
+        path: SQLite file, on a disk every worker can reach
+    """
+
+    def __init__(self, path: str = "shared_state.sqlite"):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, across processes
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def _get(self, namespace: str, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, namespace: str, key: str, value: str, ttl: Optional[float]) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, expires_at),
+        )
+
+    def get(self, namespace: str, key: str) -> Any:
+        with self._lock:
+            value = self._get(namespace, key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._set(namespace, key, json.dumps(value), ttl)
+
+    def set_if_absent(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Store `value` unless the key holds a live value. Returns whether it was stored."""
+        with self._lock:
+            conn = self._transaction()
+            try:
+                if self._get(namespace, key) is not None:
+                    return False
+                self._set(namespace, key, json.dumps(value), ttl)
+                return True
+            finally:
+                conn.execute("COMMIT")
+
+    def compare_and_set(self, namespace: str, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        """Store `value` only if the key still holds `expected`. Returns whether it was stored."""
+        with self._lock:
+            conn = self._transaction()
+            try:
+                current = self._get(namespace, key)
+                if current is None or json.loads(current) != expected:
+                    return False
+                self._set(namespace, key, json.dumps(value), ttl)
+                return True
+            finally:
+                conn.execute("COMMIT")
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Add `amount` to an integer key, starting from 0, and return the new value."""
+        with self._lock:
+            conn = self._transaction()
+            try:
+                current = self._get(namespace, key)
+                value = (json.loads(current) if current is not None else 0) + amount
+                self._set(namespace, key, json.dumps(value), None)
+                return value
+            finally:
+                conn.execute("COMMIT")
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or extend the lease `name` for `owner` unless another owner holds a live one."""
+        with self._lock:
+            conn = self._transaction()
+            try:
+                holder = self._get("lease", name)
+                if holder is not None and json.loads(holder) != owner:
+                    return False
+                self._set("lease", name, json.dumps(owner), ttl)
+                return True
+            finally:
+                conn.execute("COMMIT")
+
+    def lease_holder(self, name: str) -> Optional[str]:
+        return self.get("lease", name)
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM kv WHERE namespace = 'lease' AND key = ? AND value = ?",
+                (name, json.dumps(owner)),
+            )
+
+    def push(self, namespace: str, value: Any) -> None:
+        """Append `value` to the FIFO queue `namespace`."""
+        with self._lock:
+            self.conn.execute("INSERT INTO queue (namespace, value) VALUES (?, ?)", (namespace, json.dumps(value)))
+
+    def pop(self, namespace: str) -> Any:
+        """Remove and return the oldest value of the queue, or None when it is empty."""
+        with self._lock:
+            conn = self._transaction()
+            try:
+                row = conn.execute(
+                    "SELECT id, value FROM queue WHERE namespace = ? ORDER BY id LIMIT 1", (namespace,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("DELETE FROM queue WHERE id = ?", (row[0],))
+                return json.loads(row[1])
+            finally:
+                conn.execute("COMMIT")
+
+    def length(self, namespace: str) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM queue WHERE namespace = ?", (namespace,)).fetchone()[0]
+
+
+# Sets the lease when it is free or already ours, atomically
+_ACQUIRE_LEASE = """
+local holder = redis.call('get', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# Sets the key only while it holds the expected value, atomically
+_COMPARE_AND_SET = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('set', KEYS[1], ARGV[2], 'PX', ARGV[3])
+else
+    redis.call('set', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class RedisState:
+    """SharedState backed by Redis, for workers spread over several machines."""
+
+    def __init__(self, url: str, prefix: str = "npc:"):
+        if redis is None:
+            raise RuntimeError("redis is not installed, pip install redis to use a redis:// SHARED_STATE_URL")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._acquire_lease = self.client.register_script(_ACQUIRE_LEASE)
+        self._compare_and_set = self.client.register_script(_COMPARE_AND_SET)
+
+    def _key(self, namespace: str, key: str = "") -> str:
+        return f"{self.prefix}{namespace}:{key}" if key else f"{self.prefix}{namespace}"
+
+    def get(self, namespace: str, key: str) -> Any:
+        value = self.client.get(self._key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.client.set(self._key(namespace, key), json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def set_if_absent(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return bool(self.client.set(
+            self._key(namespace, key), json.dumps(value), nx=True, px=int(ttl * 1000) if ttl else None
+        ))
+
+    def compare_and_set(self, namespace: str, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        return bool(self._compare_and_set(
+            keys=[self._key(namespace, key)],
+            args=[json.dumps(expected), json.dumps(value), int(ttl * 1000) if ttl else 0],
+        ))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.client.delete(self._key(namespace, key))
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        return self.client.incrby(self._key(namespace, key), amount)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self._acquire_lease(keys=[self._key("lease", name)], args=[json.dumps(owner), int(ttl * 1000)]))
+
+    def lease_holder(self, name: str) -> Optional[str]:
+        return self.get("lease", name)
+
+    def release_lease(self, name: str, owner: str) -> None:
+        key = self._key("lease", name)
+        if self.client.get(key) == json.dumps(owner).encode():
+            self.client.delete(key)
+
+    def push(self, namespace: str, value: Any) -> None:
+        self.client.rpush(self._key(namespace), json.dumps(value))
+
+    def pop(self, namespace: str) -> Any:
+        value = self.client.lpop(self._key(namespace))
+        return json.loads(value) if value is not None else None
+
+    def length(self, namespace: str) -> int:
+        return self.client.llen(self._key(namespace))
+
+
+def open_shared_state(url: str):
+    """`redis://...` opens a RedisState, anything else is a SQLite path (optionally `sqlite:///path`)."""
+    if url.startswith(("redis://", "rediss://")):
+        return RedisState(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SharedState(url)
+
+
+class SecretBox:
+    """
+    Encrypts secrets such as wallet seeds before they go into shared state.
+
+    Without a key (or without `cryptography` installed) the box is disabled
+    and secrets are not shared at all.
+
+    Args:
+        key: Fernet key, e.g. from `Fernet.generate_key()`
+    """
+
+    def __init__(self, key: Optional[str]):
+        self._fernet = Fernet(key.encode()) if key and Fernet is not None else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._fernet is not None
+
+    def encrypt(self, secret: str) -> str:
+        return self._fernet.encrypt(secret.encode()).decode()
+
+    def decrypt(self, token: str) -> str:
+        return self._fernet.decrypt(token.encode()).decode()
+
+
+def node_id() -> str:
+    """Identifies this worker process in leases as `<node>:<pid>`, `node` is NODE_ID or the hostname."""
+    return f"{os.getenv('NODE_ID') or socket.gethostname()}:{os.getpid()}"
@@ -0,0 +1,299 @@
+"""
+Headless NPC simulation.
+
+Loads NPC configs, runs their decision ticks across a process pool with LLM
+and RPC calls rate limited across all processes, checkpoints progress and
+reports throughput and tick latency percentiles:
+
+    python simulate.py --npcs 1000 --ticks 20 --workers 8 --llm-rpm 60000
+    python simulate.py --configs npcs/ --llm openai --rpc-url http://127.0.0.1:8545
+"""
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from prompts import compile_prompt
+
+ACTIONS = ["hold", "check_balance", "analyze_token", "discover_tokens", "place_prediction_bet"]
+
+TICK_PROMPT = """It is your turn to act in the simulation (tick {tick}).
+Your recent actions: {recent}.
+Reply with exactly one of: {actions}."""
+
+MEMORY_SIZE = 5
+
+
+class SharedRateLimiter:
+    """
+    Token bucket shared by every process of a pool.
+
+    The bucket lives in shared memory, so `rate` is a global limit no matter how
+    many workers call `acquire`. A rate of 0 disables limiting.
+
+    Args:
+        rate: Permits per second
+        burst: Bucket size (Defaults to one second of permits)
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._lock = mp.Lock()
+        self._tokens = mp.RawValue("d", self.burst)
+        self._updated = mp.RawValue("d", time.time())
+
+    def acquire(self) -> float:
+        """Block until a permit is available. Returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        started = time.perf_counter()
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens.value = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rate)
+                self._updated.value = now
+                if self._tokens.value >= 1:
+                    self._tokens.value -= 1
+                    return time.perf_counter() - started
+                wait = (1 - self._tokens.value) / self.rate
+            time.sleep(wait)
+
+
+class MockLLM:
+    """
+    Stands in for the chat model: sleeps for a log-normal latency around
+    `latency` seconds and answers with an action picked from the NPC's risk
+    tolerance. Seeded per call, so runs are reproducible.
+    """
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+
+    def decide(self, npc_config: dict, tick_seed: int) -> str:
+        rng = random.Random(tick_seed)
+        if self.latency > 0:
+            time.sleep(rng.lognormvariate(np.log(self.latency), 0.5))
+        risk = npc_config.get("personality", {}).get("riskTolerance", 50) / 100
+        weights = [1.5 - risk, 1.0, 1.0, 0.5 + risk, 2 * risk]
+        return rng.choices(ACTIONS, weights=weights)[0]
+
+
+class OpenAIDecider:
+    """Asks the real chat model for the NPC's next action."""
+
+    def __init__(self):
+        from langchain_core.messages import HumanMessage, SystemMessage
+        from langchain_openai import ChatOpenAI
+
+        self._messages = (SystemMessage, HumanMessage)
+        self.llm = ChatOpenAI(model="gpt-4o-mini")
+
+    def decide(self, npc_config: dict, tick: int, recent: List[str]) -> str:
+        system, human = self._messages
+        reply = self.llm.invoke([
+            system(content=compile_prompt(npc_config).text),
+            human(content=TICK_PROMPT.format(tick=tick, recent=", ".join(recent) or "none", actions=", ".join(ACTIONS))),
+        ]).content.lower()
+        return next((action for action in ACTIONS if action in reply), "hold")
+
+
+# Worker process state, set up once per process by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(llm_limiter, rpc_limiter, llm: str, llm_latency: float, rpc_url: Optional[str]) -> None:
+    _worker["llm_limiter"] = llm_limiter
+    _worker["rpc_limiter"] = rpc_limiter
+    _worker["rpc_url"] = rpc_url
+    _worker["decider"] = OpenAIDecider() if llm == "openai" else MockLLM(llm_latency)
+    if rpc_url:
+        from chain_client import get_chain_client
+        _worker["client"] = get_chain_client(rpc_url)
+
+
+def _tick_npc(npc_id: str, config: dict, state: dict, tick: int) -> dict:
+    started = time.perf_counter()
+    result = {"npc_id": npc_id, "action": None, "error": None, "llm_wait": 0.0, "rpc_wait": 0.0}
+    try:
+        result["llm_wait"] = _worker["llm_limiter"].acquire()
+        decider = _worker["decider"]
+        if isinstance(decider, MockLLM):
+            action = decider.decide(config, zlib.crc32(f"{npc_id}:{tick}".encode()))
+        else:
+            action = decider.decide(config, tick, state.get("recent", []))
+
+        if action == "check_balance" and "client" in _worker:
+            result["rpc_wait"] = _worker["rpc_limiter"].acquire()
+            address = config.get("wallet", {}).get("wallet_address")
+            if address:
+                state["balance"] = str(_worker["client"].w3.eth.get_balance(address))
+
+        state["recent"] = (state.get("recent", []) + [action])[-MEMORY_SIZE:]
+        state["ticks"] = state.get("ticks", 0) + 1
+        result["action"] = action
+    except Exception as e:
+        result["error"] = str(e)
+    result["state"] = state
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+def run_batch(batch: List[tuple], tick: int) -> List[dict]:
+    """Run one tick for a batch of `(npc_id, config, state)` in a worker process."""
+    return [_tick_npc(npc_id, config, state, tick) for npc_id, config, state in batch]
+
+
+def load_npcs(paths: List[str], count: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Load NPC configs from JSON files or directories of them. A file may hold one
+    config or a list. With `count`, the loaded configs are repeated until there
+    are that many NPCs.
+    """
+    configs = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file) as f:
+                loaded = json.load(f)
+            configs.extend(loaded if isinstance(loaded, list) else [loaded])
+    if not configs:
+        raise ValueError("No NPC configs found")
+
+    npcs = {}
+    for i in range(count or len(configs)):
+        config = dict(configs[i % len(configs)])
+        address = config.get("wallet", {}).get("wallet_address")
+        npc_id = address if address and i < len(configs) else f"{config['name']}-{i}"
+        npcs[npc_id] = config
+    return npcs
+
+
+def load_checkpoint(path: str) -> Optional[dict]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, tick: int, states: Dict[str, dict]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"tick": tick, "states": states, "saved_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+
+def simulate(
+    npcs: Dict[str, dict],
+    ticks: int,
+    workers: int = os.cpu_count() or 4,
+    batch_size: int = 50,
+    llm: str = "mock",
+    llm_latency: float = 0.05,
+    llm_rpm: float = 0,
+    rpc_rps: float = 0,
+    rpc_url: Optional[str] = None,
+    checkpoint: Optional[str] = None,
+    checkpoint_every: int = 1,
+) -> dict:
+    """
+    Run `ticks` rounds in which every NPC decides once, resuming from
+    `checkpoint` when it exists. Returns the run report.
+    """
+    saved = load_checkpoint(checkpoint)
+    start_tick = saved["tick"] if saved else 0
+    states = {npc_id: {} for npc_id in npcs}
+    if saved:
+        states.update({npc_id: state for npc_id, state in saved["states"].items() if npc_id in npcs})
+
+    llm_limiter = SharedRateLimiter(llm_rpm / 60)
+    rpc_limiter = SharedRateLimiter(rpc_rps)
+    latencies, llm_waits, actions, errors = [], [], Counter(), Counter()
+    npc_ids = list(npcs)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(llm_limiter, rpc_limiter, llm, llm_latency, rpc_url),
+    ) as pool:
+        for tick in range(start_tick, ticks):
+            futures = [
+                pool.submit(run_batch, [(i, npcs[i], states[i]) for i in npc_ids[start:start + batch_size]], tick)
+                for start in range(0, len(npc_ids), batch_size)
+            ]
+            for future in as_completed(futures):
+                for result in future.result():
+                    states[result["npc_id"]] = result["state"]
+                    latencies.append(result["latency"])
+                    llm_waits.append(result["llm_wait"])
+                    if result["error"]:
+                        errors[result["error"]] += 1
+                    else:
+                        actions[result["action"]] += 1
+            if checkpoint and ((tick + 1) % checkpoint_every == 0 or tick + 1 == ticks):
+                save_checkpoint(checkpoint, tick + 1, states)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "npcs": len(npcs),
+        "workers": workers,
+        "ticks": max(ticks - start_tick, 0),
+        "resumed_from_tick": start_tick,
+        "agent_ticks": len(latencies),
+        "elapsed": round(elapsed, 3),
+        "agent_ticks_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": percentiles(latencies),
+        "llm_wait_ms": percentiles(llm_waits),
+        "actions": dict(actions),
+        "errors": dict(errors.most_common(10)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run NPCs headlessly and report throughput")
+    parser.add_argument("--configs", action="append", default=[], help="NPC config file or directory (repeatable, defaults to npc_config.json)")
+    parser.add_argument("--npcs", type=int, help="Number of NPCs, repeating the loaded configs")
+    parser.add_argument("--ticks", type=int, default=10, help="Decision rounds to run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Worker processes")
+    parser.add_argument("--batch-size", type=int, default=50, help="NPCs per task sent to a worker")
+    parser.add_argument("--llm", choices=["mock", "openai"], default="mock", help="Model answering the ticks")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Median mock LLM latency in seconds")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="Global LLM requests per minute (0 for unlimited)")
+    parser.add_argument("--rpc-rps", type=float, default=0, help="Global RPC requests per second (0 for unlimited)")
+    parser.add_argument("--rpc-url", help="Chain RPC, e.g. a local dev node, for balance checks")
+    parser.add_argument("--checkpoint", help="File to save progress to and resume from")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Ticks between checkpoints")
+    args = parser.parse_args()
+
+    npcs = load_npcs(args.configs or ["npc_config.json"], args.npcs)
+    report = simulate(
+        npcs,
+        ticks=args.ticks,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        llm=args.llm,
+        llm_latency=args.llm_latency,
+        llm_rpm=args.llm_rpm,
+        rpc_rps=args.rpc_rps,
+        rpc_url=args.rpc_url,
+        checkpoint=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+    )
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict
+
+from metrics import logger, span
+
+
+class Readiness:
+    """
+    Warm-up state of the app's components, reported by the health endpoints.
+
+    Components are expected up front and stay "pending" until their warm-up
+    succeeds. A failed warm-up is recorded and retried instead of stopping the
+    process, and anything still cold is built on first use as before.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self._components: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def expect(self, name: str) -> None:
+        with self._lock:
+            self._components.setdefault(name, {"status": "pending"})
+
+    def mark_ready(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._components[name] = {"status": "ready", "seconds": round(seconds, 3)}
+
+    def mark_failed(self, name: str, error: Exception) -> None:
+        with self._lock:
+            attempts = self._components.get(name, {}).get("attempts", 0) + 1
+            self._components[name] = {"status": "failed", "error": str(error), "attempts": attempts}
+
+    @property
+    def is_ready(self) -> bool:
+        with self._lock:
+            return all(c["status"] == "ready" for c in self._components.values())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            components = {name: dict(state) for name, state in self._components.items()}
+        return {
+            "status": "ready" if all(c["status"] == "ready" for c in components.values()) else "starting",
+            "uptime": round(time.monotonic() - self.started_at, 3),
+            "components": components,
+        }
+
+
+async def warm_up(readiness: Readiness, name: str, build: Callable[[], object], retry_interval: float = 30) -> None:
+    """
+    Run the blocking `build` on a worker thread until it succeeds, recording the
+    outcome as component `name`. Timed as the `warmup_<name>` stage.
+    """
+    readiness.expect(name)
+    while True:
+        started = time.perf_counter()
+        try:
+            async with span(f"warmup_{name}"):
+                await asyncio.to_thread(build)
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} failed, retrying in {retry_interval}s: {e}")
+            readiness.mark_failed(name, e)
+            await asyncio.sleep(retry_interval)
+            continue
+        readiness.mark_ready(name, time.perf_counter() - started)
+        logger.info(f"Warmed up {name} in {time.perf_counter() - started:.2f}s")
+        return
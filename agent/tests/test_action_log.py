@@ -0,0 +1,105 @@
+import pytest
+from web3 import Web3
+from web3.exceptions import TransactionNotFound
+
+from action_log import ActionLog, hash_pair, merkle_levels, merkle_proof, verify_proof
+
+
+def leaves(count):
+    return [Web3.keccak(text=str(i)) for i in range(count)]
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 8, 13])
+def test_every_leaf_proves_against_the_root(count):
+    levels = merkle_levels(leaves(count))
+    root = levels[-1][0]
+    for index, leaf in enumerate(levels[0]):
+        assert verify_proof(leaf, merkle_proof(levels, index), root)
+
+
+def test_proof_fails_for_another_leaf_or_root():
+    levels = merkle_levels(leaves(4))
+    proof = merkle_proof(levels, 1)
+    assert not verify_proof(Web3.keccak(text="forged"), proof, levels[-1][0])
+    assert not verify_proof(levels[0][1], proof, Web3.keccak(text="other root"))
+
+
+def test_odd_leaf_moves_up_unpaired():
+    a, b, c = leaves(3)
+    assert merkle_levels([a, b, c])[-1][0] == hash_pair(hash_pair(a, b), c)
+
+
+def test_pairs_are_sorted():
+    a, b = leaves(2)
+    assert hash_pair(a, b) == hash_pair(b, a)
+
+
+class FakeAttester:
+    def __init__(self):
+        self.sent = []
+        self.receipts = {}
+        self.known = set()
+
+    def attest(self, batch, on_mined=None):
+        tx_hash = f"0x{len(self.sent) + 1:064x}"
+        self.sent.append((batch["id"], on_mined))
+        self.known.add(tx_hash)
+        return tx_hash
+
+    def receipt(self, tx_hash):
+        if tx_hash in self.receipts:
+            return self.receipts[tx_hash]
+        if tx_hash not in self.known:
+            raise TransactionNotFound(tx_hash)
+        return None
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = ActionLog(str(tmp_path / "actions.sqlite"), max_batch=3, attester=FakeAttester())
+    for i in range(5):
+        log.append("npc", "get_balance", f'{{"i": {i}}}', f"result {i}")
+    return log
+
+
+def test_roll_and_prove_every_action(log):
+    assert log.roll()["size"] == 3
+    assert log.roll()["size"] == 2
+    assert log.roll() is None
+    for action_id in range(1, 6):
+        assert log.proof(action_id)["verified"]
+
+
+def test_unrolled_action_has_no_proof(log):
+    assert log.proof(1)["proof"] is None
+    assert log.proof(99) is None
+
+
+def test_reverted_attestation_goes_back_to_pending(log):
+    log.roll()
+    assert log.attest_pending() == 1
+    _, on_mined = log.attester.sent[0]
+    on_mined({"status": 0})
+    assert log.get_batch(1)["status"] == "pending"
+
+
+def test_recheck_settles_mined_and_resets_dropped_batches(log):
+    log.submit_timeout = 0
+    log.roll()
+    log.roll()
+    log.attest_pending()
+    mined, dropped = log.get_batch(1)["tx_hash"], log.get_batch(2)["tx_hash"]
+    log.attester.receipts[mined] = {"status": 1, "logs": []}
+    log.attester.known.discard(dropped)
+    assert log.recheck_submitted() == 2
+    assert log.get_batch(1)["status"] == "attested"
+    assert log.get_batch(2)["status"] == "pending"
+
+
+def test_recheck_leaves_recent_and_in_flight_batches(log):
+    log.roll()
+    log.attest_pending()
+    assert log.recheck_submitted() == 0
+    log.submit_timeout = 0
+    assert log.recheck_submitted() == 0
+    assert log.get_batch(1)["status"] == "submitted"
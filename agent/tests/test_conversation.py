@@ -0,0 +1,81 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from conversation import prune_checkpoints
+
+# Tables as created by langgraph's SqliteSaver
+SCHEMA = """
+CREATE TABLE checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+@pytest.fixture
+def checkpointer():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(SCHEMA)
+    return SimpleNamespace(conn=conn)
+
+
+def add_checkpoints(conn, thread_id, namespace, count):
+    for i in range(count):
+        checkpoint_id = f"{i:04d}"
+        conn.execute(
+            "INSERT INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id) VALUES (?, ?, ?)",
+            (thread_id, namespace, checkpoint_id),
+        )
+        conn.execute(
+            "INSERT INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel) VALUES (?, ?, ?, 't', 0, 'c')",
+            (thread_id, namespace, checkpoint_id),
+        )
+
+
+def remaining(conn, table, thread_id, namespace):
+    return [row[0] for row in conn.execute(
+        f"SELECT checkpoint_id FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id",
+        (thread_id, namespace),
+    )]
+
+
+def test_keeps_the_newest_per_thread(checkpointer):
+    add_checkpoints(checkpointer.conn, "a", "", 4)
+    add_checkpoints(checkpointer.conn, "b", "", 1)
+    assert prune_checkpoints(checkpointer, keep=2) == 2
+    assert remaining(checkpointer.conn, "checkpoints", "a", "") == ["0002", "0003"]
+    assert remaining(checkpointer.conn, "writes", "a", "") == ["0002", "0003"]
+    assert remaining(checkpointer.conn, "checkpoints", "b", "") == ["0000"]
+
+
+def test_subgraph_namespaces_are_pruned_separately(checkpointer):
+    # A subgraph's checkpoints with newer ids must not push out the parent's latest one
+    add_checkpoints(checkpointer.conn, "a", "", 2)
+    for i in range(5):
+        checkpointer.conn.execute(
+            "INSERT INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id) VALUES ('a', 'tools:1', ?)",
+            (f"{i + 10:04d}",),
+        )
+    prune_checkpoints(checkpointer, keep=1)
+    assert remaining(checkpointer.conn, "checkpoints", "a", "") == ["0001"]
+    assert remaining(checkpointer.conn, "writes", "a", "") == ["0001"]
+    assert remaining(checkpointer.conn, "checkpoints", "a", "tools:1") == ["0014"]
@@ -0,0 +1,37 @@
+import pytest
+
+from fakes import FakeChatModel, FakeRateLimit, FakeRateLimitError, FakeWalletBackend
+from llm_scheduler import is_rate_limit_error
+
+
+def test_rate_limit_rejects_calls_over_the_budget():
+    limit = FakeRateLimit(requests_per_minute=2)
+    limit.check()
+    limit.check()
+    with pytest.raises(FakeRateLimitError):
+        limit.check()
+    assert limit.rejected == 1
+
+
+def test_rate_limit_error_looks_like_a_provider_429():
+    assert is_rate_limit_error(FakeRateLimitError("Rate limit reached for requests"))
+
+
+def test_chat_model_streams_the_reply():
+    model = FakeChatModel(reply="hold the line", latency=0)
+    assert "".join(chunk.content for chunk in model.stream("hi")) == "hold the line"
+    assert model.invoke("hi").content == "hold the line"
+
+
+def test_chat_model_fails_over_its_rate_limit():
+    model = FakeChatModel(latency=0, rate_limit=FakeRateLimit(requests_per_minute=1))
+    model.invoke("hi")
+    with pytest.raises(FakeRateLimitError):
+        model.invoke("hi")
+
+
+def test_wallet_backend_creates_distinct_wallets():
+    backend = FakeWalletBackend(latency=0)
+    first, second = backend.create(), backend.create()
+    assert first["wallet_address"] != second["wallet_address"]
+    assert backend.created == 2
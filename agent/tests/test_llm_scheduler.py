@@ -0,0 +1,165 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from fakes import FakeChatModel, FakeRateLimitError
+from llm_scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    MAX_BACKOFF,
+    LLMScheduler,
+    ScheduledChatModel,
+    TokenBucket,
+    is_rate_limit_error,
+    retry_after,
+)
+
+
+def rate_limited_then(chunks, failures=1):
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) <= failures:
+            raise FakeRateLimitError("Rate limit reached for requests")
+        return iter(chunks)
+
+    return call, calls
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = time.monotonic()
+    bucket.take(10, now)
+    assert bucket.wait_time(5, now) == pytest.approx(0.5)
+    assert bucket.wait_time(5, now + 0.5) == 0
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(rate=0)
+    bucket.take(1000, time.monotonic())
+    assert bucket.wait_time(1000, time.monotonic()) == 0
+
+
+def test_retry_after_is_read_from_the_response():
+    error = FakeRateLimitError()
+    error.response = SimpleNamespace(headers={"retry-after": "2"}, status_code=429)
+    assert is_rate_limit_error(error)
+    assert retry_after(error) == 2
+    assert retry_after(FakeRateLimitError()) is None
+
+
+def test_429_is_retried_after_backing_off():
+    scheduler = LLMScheduler(max_concurrency=8, backoff=0.05)
+    call, calls = rate_limited_then(["a", "b"])
+    assert list(scheduler.stream(call)) == ["a", "b"]
+    assert calls[1] - calls[0] >= 0.05
+    stats = scheduler.stats()
+    assert stats["rate_limited"] == 1
+    assert stats["retries"] == 1
+    assert stats["limit"] < 8
+
+
+def test_backoff_doubles_per_consecutive_429_up_to_the_cap():
+    scheduler = LLMScheduler(backoff=10)
+    pauses = []
+    for _ in range(5):
+        scheduler.acquire(BACKGROUND, 0)
+        scheduler.release(0, error=FakeRateLimitError())
+        pauses.append(round(scheduler.stats()["paused_for"]))
+        # Skip the wait, the next 429 still counts as consecutive
+        scheduler._paused_until = 0
+    assert pauses == [10, 20, 40, MAX_BACKOFF, MAX_BACKOFF]
+
+
+def test_retry_after_overrides_the_backoff():
+    scheduler = LLMScheduler(backoff=30)
+    error = FakeRateLimitError()
+    error.response = SimpleNamespace(headers={"retry-after": "0.1"})
+    scheduler.acquire(BACKGROUND, 0)
+    scheduler.release(0, error=error)
+    assert scheduler.stats()["paused_for"] <= 0.1
+
+
+def test_gives_up_after_max_retries():
+    scheduler = LLMScheduler(max_retries=2, backoff=0.001)
+    call, calls = rate_limited_then(["a"], failures=10)
+    with pytest.raises(FakeRateLimitError):
+        list(scheduler.stream(call))
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried():
+    scheduler = LLMScheduler()
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        list(scheduler.stream(call))
+    assert len(calls) == 1
+    assert scheduler.stats()["active"] == 0
+
+
+def test_interactive_calls_overtake_waiting_background_calls():
+    scheduler = LLMScheduler(max_concurrency=1, min_concurrency=1)
+    scheduler.acquire(BACKGROUND, 0)
+    order = []
+
+    def waiter(priority, name):
+        scheduler.acquire(priority, 0)
+        order.append(name)
+        scheduler.release(0)
+
+    threads = [threading.Thread(target=waiter, args=(BACKGROUND, "background"))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=waiter, args=(INTERACTIVE, "interactive")))
+    threads[1].start()
+    time.sleep(0.05)
+    scheduler.release(0)
+    for thread in threads:
+        thread.join(1)
+    assert order == ["interactive", "background"]
+
+
+def test_identical_calls_in_flight_are_sent_once():
+    scheduler = LLMScheduler()
+    started = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return iter(["shared"])
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(list(scheduler.stream(call, key="k"))))
+    leader.start()
+    started.wait(1)
+    results.append(list(scheduler.stream(call, key="k")))
+    leader.join(1)
+    assert results == [["shared"], ["shared"]]
+    assert len(calls) == 1
+    assert scheduler.stats()["deduplicated"] == 1
+
+
+def test_scheduled_model_retries_the_fakes_429():
+    class FlakyChatModel(FakeChatModel):
+        failures: int = 1
+
+        def _stream(self, *args, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise FakeRateLimitError("Rate limit reached for requests")
+            yield from super()._stream(*args, **kwargs)
+
+    scheduler = LLMScheduler(backoff=0.01)
+    model = ScheduledChatModel(model=FlakyChatModel(reply="steady", latency=0), scheduler=scheduler)
+    assert model.invoke("hi").content == "steady"
+    assert scheduler.stats()["retries"] == 1
@@ -0,0 +1,45 @@
+import uuid
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, LLMResult
+
+from metrics import MetricsCallbackHandler, llm_tokens
+
+
+def tokens(kind):
+    return llm_tokens._values.get((kind,), 0)
+
+
+def finish(handler, response):
+    run_id = uuid.uuid4()
+    handler.on_chat_model_start({}, [], run_id=run_id)
+    handler.on_llm_end(response, run_id=run_id)
+
+
+def test_streamed_call_counts_usage_metadata():
+    # What generate_from_stream returns: the chunks summed, usage from the last one
+    chunks = [
+        ChatGenerationChunk(message=AIMessageChunk(content="Hel")),
+        ChatGenerationChunk(message=AIMessageChunk(content="lo")),
+        ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15},
+        )),
+    ]
+    merged = chunks[0] + chunks[1] + chunks[2]
+    response = LLMResult(generations=[[ChatGeneration(message=merged.message)]], llm_output=None)
+
+    prompt, completion = tokens("prompt"), tokens("completion")
+    finish(MetricsCallbackHandler(), response)
+    assert tokens("prompt") - prompt == 12
+    assert tokens("completion") - completion == 3
+
+
+def test_non_streaming_call_counts_llm_output():
+    response = LLMResult(
+        generations=[[ChatGeneration(message=AIMessage(content="Hello"))]],
+        llm_output={"token_usage": {"prompt_tokens": 7, "completion_tokens": 2}},
+    )
+    prompt, completion = tokens("prompt"), tokens("completion")
+    finish(MetricsCallbackHandler(), response)
+    assert tokens("prompt") - prompt == 7
+    assert tokens("completion") - completion == 2
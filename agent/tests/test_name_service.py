@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from web3 import Web3
+
+from fakes import OfflineNameService
+from name_service import InvalidName, normalize_label
+from shared_state import SharedState
+
+
+@pytest.mark.parametrize("name, label", [
+    ("Bob Smith", "bob-smith"),
+    ("  Ada   Lovelace ", "ada-lovelace"),
+    ("Zoë", "zoë"),
+    ("ＡＢＣ", "abc"),
+])
+def test_normalize_label(name, label):
+    assert normalize_label(name) == label
+
+
+@pytest.mark.parametrize("name", ["", "   ", "a.b", "ab--cd", "bad!"])
+def test_invalid_names_are_rejected(name):
+    with pytest.raises(InvalidName):
+        normalize_label(name)
+
+
+def test_invalid_name_is_a_value_error():
+    assert issubclass(InvalidName, ValueError)
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.sqlite"))
+
+
+def name_service(state):
+    client = SimpleNamespace(labelhash=lambda label: Web3.keccak(text=label))
+    return OfflineNameService(client, "0x0000000000000000000000000000000000000001", state=state)
+
+
+def test_reservation_is_held_by_one_job(state):
+    names = name_service(state)
+    assert names.reserve("ada", "job-1")
+    assert names.reserve("ada", "job-1")
+    assert not names.reserve("ada", "job-2")
+    names.release("ada", "job-2")
+    assert not names.reserve("ada", "job-2")
+    names.release("ada", "job-1")
+    assert names.reserve("ada", "job-2")
+
+
+def test_reservations_are_shared_between_workers(state):
+    assert name_service(state).reserve("ada", "job-1")
+    assert not name_service(state).reserve("ada", "job-2")
+
+
+def test_claim_turns_away_registered_and_reserved_names(state):
+    names = name_service(state)
+    assert asyncio.run(names.claim("ada", "job-1")) is None
+    assert "being created" in asyncio.run(names.claim("ada", "job-2"))
+    names.mark_registered("ada")
+    assert "already registered" in asyncio.run(names.claim("ada", "job-3"))
+    names.forget("ada")
+    assert not names.is_known_registered("ada")
@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from npc_store import NPCStore, _merge
+
+
+def npc(address, **fields):
+    return {"name": address, "wallet": {"wallet_address": address, "status": "pending"}, **fields}
+
+
+class FakePostgREST:
+    """Stores rows by id, answers inserts with ids (`Prefer: return=representation`) and `id=in.(...)` reads."""
+
+    def __init__(self):
+        self.requests = []
+        self.rows = {}
+        self.next_id = 1
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else None
+        self.requests.append((request.method, request.url.params.get("on_conflict"), body))
+        if request.method == "GET":
+            ids = [int(row_id) for row_id in request.url.params["id"][len("in.("):-1].split(",")]
+            return httpx.Response(200, json=[self.rows[row_id] for row_id in ids if row_id in self.rows])
+        if request.method == "POST" and "on_conflict" not in request.url.params:
+            rows = []
+            for row in body:
+                rows.append({**row, "id": self.next_id})
+                self.rows[self.next_id] = rows[-1]
+                self.next_id += 1
+            return httpx.Response(201, json=rows)
+        if request.method == "POST":
+            for row in body:
+                self.rows[row["id"]] = {**self.rows.get(row["id"], {}), **row}
+        return httpx.Response(204)
+
+
+@pytest.fixture
+def backend():
+    return FakePostgREST()
+
+
+@pytest.fixture
+def store(backend):
+    store = NPCStore("http://postgrest.test", "key")
+    store._client = httpx.AsyncClient(base_url="http://postgrest.test/rest/v1", transport=httpx.MockTransport(backend))
+    return store
+
+
+def test_merge_is_one_level_deep():
+    row = {"name": "ada", "wallet": {"wallet_address": "0x1", "status": "pending", "balance": "0"}}
+    merged = _merge(row, {"wallet": {"status": "active"}, "name": "ada2"})
+    assert merged == {"name": "ada2", "wallet": {"wallet_address": "0x1", "status": "active", "balance": "0"}}
+    assert row["wallet"]["status"] == "pending"
+
+
+def test_inserts_in_one_interval_are_one_request(store, backend):
+    async def scenario():
+        inserts = [asyncio.ensure_future(store.insert(npc(f"0x{i}"))) for i in range(3)]
+        await asyncio.sleep(0)
+        await store.flush()
+        return await asyncio.gather(*inserts)
+
+    rows = asyncio.run(scenario())
+    assert [row["id"] for row in rows] == [1, 2, 3]
+    assert len(backend.requests) == 1
+
+
+def test_update_to_a_buffered_insert_is_folded_into_it(store, backend):
+    async def scenario():
+        insert = asyncio.ensure_future(store.insert(npc("0x1")))
+        await asyncio.sleep(0)
+        store.queue_update("0x1", {"wallet": {"status": "active"}})
+        await store.flush()
+        return await insert
+
+    row = asyncio.run(scenario())
+    assert row["wallet"] == {"wallet_address": "0x1", "status": "active"}
+    assert len(backend.requests) == 1
+
+
+def test_updates_to_known_rows_are_merged_into_one_upsert(store, backend):
+    async def scenario():
+        await store.insert_many([npc("0x1"), npc("0x2")])
+        store.queue_update("0x1", {"wallet": {"status": "active"}})
+        store.queue_update("0x1", {"wallet": {"balance": "5"}})
+        store.queue_update("0x2", {"wallet": {"status": "active"}})
+        await store.flush()
+
+    asyncio.run(scenario())
+    method, on_conflict, rows = backend.requests[-1]
+    assert (method, on_conflict) == ("POST", "id")
+    # The insert, one read of the current rows and one upsert
+    assert len(backend.requests) == 3
+    assert rows[0]["wallet"] == {"wallet_address": "0x1", "status": "active", "balance": "5"}
+    assert rows[1]["wallet"]["status"] == "active"
+
+
+def test_update_keeps_changes_written_by_another_worker(store, backend):
+    async def scenario():
+        await store.insert_many([npc("0x1")])
+        # Another worker activates the wallet after this one cached the row
+        backend.rows[1]["wallet"] = {"wallet_address": "0x1", "status": "active", "transaction_hash": "0xabc"}
+        store.queue_update("0x1", {"wallet": {"balance": "5"}})
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert backend.rows[1]["wallet"] == {
+        "wallet_address": "0x1", "status": "active", "transaction_hash": "0xabc", "balance": "5",
+    }
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+from eth_abi import decode, encode
+
+from portfolio import PortfolioTracker
+from shared_state import SharedState
+
+ALICE = "0x" + "aA" * 20
+BOB = "0x" + "bB" * 20
+
+
+class FakeChain:
+    """Answers Multicall3 `getEthBalance` reads from a dict and counts them."""
+
+    def __init__(self, balances, block=100):
+        self.balances = balances
+        self.w3 = SimpleNamespace(eth=SimpleNamespace(block_number=block))
+        self.reads = 0
+
+    def aggregate(self, calls, block_identifier=None):
+        self.reads += 1
+        results = []
+        for _, data in calls:
+            (address,) = decode(["address"], data[4:])
+            results.append((True, encode(["uint256"], [self.balances.get(address.lower(), 0)])))
+        return results
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.sqlite"))
+
+
+@pytest.fixture
+def chain():
+    return FakeChain({ALICE.lower(): 10 ** 18, BOB.lower(): 2 * 10 ** 18})
+
+
+def test_refresh_reads_native_balances(chain):
+    tracker = PortfolioTracker(chain)
+    tracker.track(ALICE)
+    assert tracker.refresh_once() == 1
+    assert tracker.get(ALICE)["native_eth"] == "1"
+    # Same block, nothing to read
+    assert tracker.refresh_once() == 0
+    assert chain.reads == 1
+
+
+def test_only_the_lease_holder_reads_the_chain(chain, state):
+    leader = PortfolioTracker(chain, state=state)
+    follower = PortfolioTracker(chain, state=state)
+    leader.track(ALICE)
+    follower.track(BOB)
+
+    leader.sync_once(lambda: True)
+    follower.sync_once(lambda: False)
+    assert chain.reads == 1
+    # The wallet tracked on the follower is queued for the leader
+    assert leader.get(BOB)["native_eth"] == "2"
+    assert follower.get(ALICE)["native_eth"] == "1"
+    assert follower.last_block == 100
+
+    chain.balances[ALICE.lower()] = 3 * 10 ** 18
+    chain.w3.eth.block_number = 101
+    follower.sync_once(lambda: False)
+    assert chain.reads == 1
+    leader.sync_once(lambda: True)
+    follower.sync_once(lambda: False)
+    assert follower.get(ALICE)["native_eth"] == "3"
@@ -0,0 +1,35 @@
+from prompts import PromptCache
+
+
+def npc(name, risk="high"):
+    return {
+        "name": name,
+        "background": "A trader",
+        "personality": {"riskTolerance": risk, "rationality": "high", "autonomy": "low"},
+        "core_values": ["honesty"],
+        "primary_aims": ["profit"],
+    }
+
+
+def test_identical_personalities_share_one_prompt():
+    cache = PromptCache()
+    assert cache.compile(npc("ada")) is cache.compile(npc("ada"))
+    assert cache.compile(npc("ada")).text != cache.compile(npc("ada", risk="low")).text
+
+
+def test_shared_prefix_comes_first():
+    cache = PromptCache()
+    plain, personal = cache.compile(None), cache.compile(npc("ada"))
+    assert personal.text.startswith(plain.text)
+    assert personal.prefix_tokens == plain.tokens
+
+
+def test_least_recently_used_prompts_are_dropped():
+    cache = PromptCache(maxsize=2)
+    first = cache.compile(npc("ada"))
+    cache.compile(npc("bob"))
+    cache.compile(npc("ada"))
+    cache.compile(npc("cyd"))
+    assert [p["digest"] for p in cache.stats()][0] == first.digest
+    assert len(cache.stats()) == 2
+    assert cache.compile(npc("ada")) is first
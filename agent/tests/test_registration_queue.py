@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from registration_queue import RegistrationQueue
+
+TAKEN = "taken"
+BAD_OWNER = "not-an-address"
+
+
+class FakeContract:
+    """Builds `(function, args)` calls, rejecting malformed owners like web3 does."""
+
+    def __init__(self, name):
+        self.name = name
+        self.functions = SimpleNamespace(register=self._call("register"), registerBatch=self._call("registerBatch"))
+
+    def _call(self, function):
+        def build(labels, owners):
+            for owner in owners if isinstance(owners, list) else [owners]:
+                if owner == BAD_OWNER:
+                    raise ValueError(f"Invalid owner {owner}")
+            return (self.name, function, labels, owners)
+        return build
+
+
+class FakeTxManager:
+    def __init__(self, fail_send=False):
+        self.client = SimpleNamespace(
+            registry=lambda address: FakeContract("registry"),
+            registrar=lambda address: FakeContract("registrar"),
+        )
+        self.fail_send = fail_send
+        self.sent = []
+
+    def estimate_gas(self, call):
+        labels = call[2] if isinstance(call[2], list) else [call[2]]
+        if TAKEN in labels:
+            raise ValueError("execution reverted")
+        return 100000
+
+    def send(self, call, gas=None, on_mined=None, purpose=None):
+        if self.fail_send:
+            raise ConnectionError("RPC down")
+        self.sent.append(call)
+        return f"0x{len(self.sent):064x}"
+
+
+async def register_all(queue, registrations):
+    consumer = asyncio.create_task(queue.run())
+    try:
+        return await asyncio.gather(
+            *(queue.register(label, owner) for label, owner in registrations),
+            return_exceptions=True,
+        )
+    finally:
+        consumer.cancel()
+
+
+@pytest.fixture
+def tx_manager():
+    return FakeTxManager()
+
+
+def test_registrations_in_a_window_share_one_batch(tx_manager):
+    queue = RegistrationQueue(tx_manager, "0xregistry", registrar_address="0xregistrar", window=0.05)
+    results = asyncio.run(register_all(queue, [("ada", "0x1"), ("bob", "0x2"), ("cy", "0x3")]))
+    assert len(set(results)) == 1
+    assert tx_manager.sent == [("registrar", "registerBatch", ["ada", "bob", "cy"], ["0x1", "0x2", "0x3"])]
+
+
+def test_batch_that_would_revert_is_sent_individually(tx_manager):
+    queue = RegistrationQueue(tx_manager, "0xregistry", registrar_address="0xregistrar", window=0.05)
+    results = asyncio.run(register_all(queue, [("ada", "0x1"), (TAKEN, "0x2"), ("cy", "0x3")]))
+    assert isinstance(results[1], ValueError)
+    assert results[0] != results[2]
+    assert tx_manager.sent == [
+        ("registrar", "register", "ada", "0x1"),
+        ("registrar", "register", "cy", "0x3"),
+    ]
+
+
+def test_without_a_registrar_labels_go_to_the_registry(tx_manager):
+    queue = RegistrationQueue(tx_manager, "0xregistry", window=0.05)
+    asyncio.run(register_all(queue, [("ada", "0x1"), ("bob", "0x2")]))
+    assert [call[:2] for call in tx_manager.sent] == [("registry", "register")] * 2
+
+
+def test_send_failure_fails_the_whole_batch():
+    queue = RegistrationQueue(FakeTxManager(fail_send=True), "0xregistry", registrar_address="0xregistrar", window=0.05)
+    results = asyncio.run(register_all(queue, [("ada", "0x1"), ("bob", "0x2")]))
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_unexpected_error_fails_the_batch_and_keeps_consuming(tx_manager):
+    queue = RegistrationQueue(tx_manager, "0xregistry", registrar_address="0xregistrar", window=0.05)
+
+    async def scenario():
+        consumer = asyncio.create_task(queue.run())
+        original = queue._submit
+
+        async def broken(batch):
+            raise RuntimeError("boom")
+
+        queue._submit = broken
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(queue.register("ada", "0x1"), 1)
+        queue._submit = original
+        tx_hash = await asyncio.wait_for(queue.register("bob", "0x2"), 1)
+        consumer.cancel()
+        return tx_hash
+
+    assert asyncio.run(scenario())
+    assert tx_manager.sent == [("registrar", "register", "bob", "0x2")]
+
+
+def test_bad_owner_in_a_batch_only_fails_its_own_label(tx_manager):
+    queue = RegistrationQueue(tx_manager, "0xregistry", registrar_address="0xregistrar", window=0.05)
+    results = asyncio.run(register_all(queue, [("ada", "0x1"), ("bob", BAD_OWNER)]))
+    assert isinstance(results[1], ValueError)
+    assert tx_manager.sent == [("registrar", "register", "ada", "0x1")]
@@ -0,0 +1,166 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from token_analytics import (
+    SYNC_TOPIC,
+    TRANSFER_TOPIC,
+    ZERO_ADDRESS,
+    TokenAnalytics,
+    TokenAnalyticsSync,
+    gini,
+)
+
+TOKEN = "0x" + "11" * 20
+POOL = "0x" + "22" * 20
+ALICE = "0x" + "aa" * 20
+BOB = "0x" + "bb" * 20
+DAY = 86400
+
+
+def topic(address):
+    return bytes(12) + bytes.fromhex(address[2:])
+
+
+def transfer(src, dst, amount, block, index=0):
+    return {
+        "address": TOKEN,
+        "topics": [TRANSFER_TOPIC, topic(src), topic(dst)],
+        "data": int(amount * 10 ** 18).to_bytes(32, "big"),
+        "blockNumber": block,
+        "logIndex": index,
+    }
+
+
+def sync(reserve_eth, reserve_token, block, index=0):
+    # WETH is token0 of the test pool
+    data = int(reserve_eth * 10 ** 18).to_bytes(32, "big") + int(reserve_token * 10 ** 18).to_bytes(32, "big")
+    return {"address": POOL, "topics": [SYNC_TOPIC], "data": data, "blockNumber": block, "logIndex": index}
+
+
+@pytest.fixture
+def engine():
+    engine = TokenAnalytics()
+    engine.add_pool(POOL, TOKEN, eth_is_token0=True)
+    return engine
+
+
+def test_gini_of_equal_holdings_is_zero():
+    assert gini(np.full(10, 5.0)) == pytest.approx(0)
+
+
+def test_gini_of_one_holder_among_many():
+    values = np.zeros(10)
+    values[3] = 100
+    assert gini(values) == pytest.approx(0.9)
+
+
+def test_gini_of_nothing_is_zero():
+    assert gini(np.zeros(0)) == 0
+    assert gini(np.zeros(4)) == 0
+
+
+def test_ingest_tracks_balances_and_holders(engine):
+    used = engine.ingest(
+        [transfer(ZERO_ADDRESS, ALICE, 100, 1), transfer(ALICE, BOB, 40, 2)],
+        {1: 1000, 2: 1002},
+    )
+    assert used == 2
+    report = engine.analyze(TOKEN, now=1000 + DAY)
+    assert report["holders"] == 2
+    assert report["top_holders_share"] == pytest.approx(1)
+    assert report["gini"] == pytest.approx(gini(np.array([60.0, 40.0])))
+    assert report["age_days"] == pytest.approx(1)
+
+
+def test_holder_leaves_when_balance_reaches_zero(engine):
+    engine.ingest([transfer(ZERO_ADDRESS, ALICE, 10, 1)], {1: 1000})
+    engine.ingest([transfer(ALICE, BOB, 10, 2)], {2: 1002})
+    assert engine.holders[engine.tokens[TOKEN]] == 1
+
+
+def test_first_seen_is_the_earliest_transfer_across_batches(engine):
+    engine.ingest([transfer(ZERO_ADDRESS, ALICE, 1, 5)], {5: 5000})
+    engine.ingest([transfer(ZERO_ADDRESS, BOB, 1, 3)], {3: 3000})
+    assert engine.first_seen[engine.tokens[TOKEN]] == 3000
+
+
+def test_liquidity_follows_the_latest_sync(engine):
+    engine.ingest([sync(10, 1000, 1), sync(12, 900, 2, index=1)], {2: 1002})
+    assert engine.liquidity[engine.tokens[TOKEN]] == pytest.approx(24)
+    engine.ingest([sync(5, 2000, 3)], {3: 1004})
+    assert engine.liquidity[engine.tokens[TOKEN]] == pytest.approx(10)
+
+
+def test_logs_of_unknown_contracts_are_skipped(engine):
+    stray = dict(transfer(ZERO_ADDRESS, ALICE, 1, 1), address="0x" + "33" * 20)
+    assert engine.ingest([stray]) == 0
+
+
+def test_screen_filters_on_the_summary(engine):
+    engine.ingest([transfer(ZERO_ADDRESS, ALICE, 100, 1), sync(10, 1000, 1, index=1)], {1: 1000})
+    assert [t["token_address"] for t in engine.screen(min_liquidity=15, now=1000)] == [TOKEN]
+    assert engine.screen(min_liquidity=25, now=1000) == []
+    assert engine.screen(min_holders=2, now=1000) == []
+
+
+def test_save_and_load_keep_the_summary(engine, tmp_path):
+    engine.ingest(
+        [transfer(ZERO_ADDRESS, ALICE, 100, 1), transfer(ALICE, BOB, 40, 2), sync(10, 1000, 2, index=1)],
+        {2: 1002},
+    )
+    engine.synced_block = 2
+    path = str(tmp_path / "store.npz")
+    engine.save(path)
+    loaded = TokenAnalytics.load(path)
+    assert loaded.synced_block == 2
+    assert loaded.analyze(TOKEN) == engine.analyze(TOKEN)
+
+
+class FakeEth:
+    def __init__(self, head):
+        self.block_number = head
+        self.queries = []
+
+    def get_logs(self, query):
+        self.queries.append((query["fromBlock"], query["toBlock"]))
+        return []
+
+    def get_block(self, number):
+        return {"timestamp": 1000 + number}
+
+
+def test_sync_resumes_after_the_last_synced_block(engine, tmp_path):
+    eth = FakeEth(head=5000)
+    sync_loop = TokenAnalyticsSync(
+        engine, SimpleNamespace(w3=SimpleNamespace(eth=eth)), str(tmp_path / "store.npz"), start_block=100
+    )
+    sync_loop.sync_once()
+    assert eth.queries == [(100, 2099), (2100, 4099), (4100, 5000)]
+    assert engine.synced_block == 5000
+    eth.block_number = 5003
+    sync_loop.sync_once()
+    assert eth.queries[-1] == (5001, 5003)
+
+
+def test_sync_saves_only_when_due_and_allowed(engine, tmp_path):
+    path = tmp_path / "store.npz"
+    allowed = []
+    sync_loop = TokenAnalyticsSync(
+        engine, SimpleNamespace(w3=SimpleNamespace(eth=FakeEth(head=10))), str(path),
+        save_interval=0, should_save=lambda: bool(allowed),
+    )
+    assert not sync_loop.save_if_due()
+    sync_loop.sync_once()
+    assert not sync_loop.save_if_due() and not path.exists()
+    allowed.append(True)
+    engine.synced_block += 1
+    assert sync_loop.save_if_due() and path.exists()
+    assert not sync_loop.save_if_due()
+
+
+def test_sync_skips_an_empty_engine(tmp_path):
+    eth = FakeEth(head=10)
+    TokenAnalyticsSync(TokenAnalytics(), SimpleNamespace(w3=SimpleNamespace(eth=eth)), str(tmp_path / "s.npz")).sync_once()
+    assert eth.queries == []
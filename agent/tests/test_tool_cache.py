@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+from tool_cache import ToolResultCache, cache_tools
+
+
+def wallet(address):
+    return SimpleNamespace(default_address=SimpleNamespace(address_id=address))
+
+
+def test_identical_calls_are_served_from_the_cache():
+    cache = ToolResultCache()
+    calls = []
+    get_balance = cache.wrap(lambda w, asset_id: calls.append(asset_id) or "1 eth", "get_balance", 60)
+    assert get_balance(wallet("0xa"), asset_id="eth") == get_balance(wallet("0xa"), asset_id="eth")
+    get_balance(wallet("0xb"), asset_id="eth")
+    assert len(calls) == 2
+
+
+def test_errors_are_not_cached():
+    cache = ToolResultCache()
+    calls = []
+    tool = cache.wrap(lambda: calls.append(1) or "Error: node unavailable", "get_balance", 60)
+    tool()
+    tool()
+    assert len(calls) == 2
+
+
+def test_state_changing_tools_drop_the_callers_cached_balances():
+    cache = ToolResultCache()
+    balances = {"0xa": "1 eth", "0xb": "1 eth"}
+    tools = cache_tools(
+        [
+            SimpleNamespace(name="get_balance", func=lambda w, asset_id: balances[w.default_address.address_id]),
+            SimpleNamespace(name="transfer", func=lambda w, amount: balances.update({w.default_address.address_id: "0 eth"})),
+        ],
+        cache,
+    )
+    get_balance, transfer = (tool.func for tool in tools)
+    assert get_balance(wallet("0xa"), asset_id="eth") == "1 eth"
+    assert get_balance(wallet("0xb"), asset_id="eth") == "1 eth"
+    transfer(wallet("0xa"), amount=1)
+    balances["0xb"] = "2 eth"
+    assert get_balance(wallet("0xa"), asset_id="eth") == "0 eth"
+    # Other wallets keep their entries
+    assert get_balance(wallet("0xb"), asset_id="eth") == "1 eth"
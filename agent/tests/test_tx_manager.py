@@ -0,0 +1,171 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from web3.exceptions import TransactionNotFound
+
+from shared_state import SharedState
+from tx_manager import MIN_GAS_BUMP, SHARED_NONCES, SHARED_PENDING, NonceManager, TransactionManager
+
+SENDER = "0x000000000000000000000000000000000000dEaD"
+
+
+class FakeEth:
+    def __init__(self, nonce=7):
+        self.pending_count = nonce
+        self.mined_count = nonce
+        self.receipts = {}
+        self.sent = []
+
+    def get_transaction_count(self, address, block="latest"):
+        return self.pending_count if block == "pending" else self.mined_count
+
+    def send_raw_transaction(self, raw):
+        self.sent.append(raw)
+        return raw
+
+    def get_transaction_receipt(self, tx_hash):
+        if tx_hash not in self.receipts:
+            raise TransactionNotFound(tx_hash)
+        return self.receipts[tx_hash]
+
+
+class FakeAccount:
+    address = SENDER
+
+    def sign_transaction(self, transaction):
+        # Distinct raw bytes per nonce and fee, standing in for the hash
+        raw = f"{transaction['nonce']}:{transaction['maxFeePerGas']}".encode()
+        return SimpleNamespace(raw_transaction=raw)
+
+
+class FakeCall:
+    fn_name = "register"
+
+    def build_transaction(self, params):
+        return dict(params)
+
+
+def fee_oracle(max_fee=100, priority_fee=10):
+    return SimpleNamespace(
+        tx_params=lambda: {"maxFeePerGas": max_fee, "maxPriorityFeePerGas": priority_fee},
+        estimate_gas=lambda function, sender: 21000,
+    )
+
+
+@pytest.fixture
+def eth():
+    return FakeEth()
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.sqlite"))
+
+
+def manager(eth, state=None, owner="worker-a", **kwargs):
+    client = SimpleNamespace(
+        w3=SimpleNamespace(eth=eth, to_hex=lambda raw: "0x" + raw.hex()),
+        chain_id=84532,
+        account=lambda key: FakeAccount(),
+    )
+    kwargs.setdefault("fee_oracle", fee_oracle())
+    return TransactionManager(client, "key", state=state, owner=owner, **kwargs)
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_concurrent_allocations_never_reuse_a_nonce(eth, state, shared):
+    nonces = NonceManager(SimpleNamespace(eth=eth), SENDER, state if shared else None)
+    with ThreadPoolExecutor(8) as pool:
+        allocated = list(pool.map(lambda _: nonces.allocate(), range(50)))
+    assert sorted(allocated) == list(range(7, 57))
+
+
+def test_resync_moves_up_to_the_pending_count(eth, state):
+    nonces = NonceManager(SimpleNamespace(eth=eth), SENDER, state)
+    nonces.allocate()
+    eth.pending_count = 12
+    nonces.resync()
+    assert nonces.allocate() == 12
+
+
+def test_resync_reuses_an_unused_nonce_only_if_nothing_followed_it(eth, state):
+    nonces = NonceManager(SimpleNamespace(eth=eth), SENDER, state)
+    unused = nonces.allocate()
+    nonces.allocate()
+    nonces.resync(unused)
+    assert state.get(SHARED_NONCES, SENDER) == 9
+
+    last = nonces.allocate()
+    eth.pending_count = 9
+    nonces.resync(last)
+    assert nonces.allocate() == 9
+
+
+def test_send_records_the_pending_transaction(eth, state):
+    tm = manager(eth, state)
+    tx_hash = tm.send(FakeCall(), gas=50000)
+    record = state.get(SHARED_PENDING, f"{SENDER}:7")
+    assert record["tx_hashes"] == [tx_hash]
+    assert record["purpose"] == "register"
+    assert record["owner"] == "worker-a"
+
+
+def test_stuck_transaction_is_resubmitted_with_bumped_fees(eth):
+    tm = manager(eth, stuck_after=0, fee_oracle=fee_oracle(max_fee=100, priority_fee=10))
+    tm.send(FakeCall(), gas=50000)
+    tm.poll_once()
+    transaction = tm._pending[7].transaction
+    assert transaction["nonce"] == 7
+    assert transaction["maxFeePerGas"] >= 100 * MIN_GAS_BUMP
+    assert transaction["maxPriorityFeePerGas"] >= 10 * MIN_GAS_BUMP
+    assert len(eth.sent) == 2
+
+
+def test_replacement_pays_at_least_the_going_rate(eth):
+    tm = manager(eth, stuck_after=0)
+    tm.send(FakeCall(), gas=50000)
+    tm.fee_oracle = fee_oracle(max_fee=1000, priority_fee=10)
+    tm.poll_once()
+    assert tm._pending[7].transaction["maxFeePerGas"] == 1000
+
+
+def test_receipt_of_any_replacement_completes_the_transaction(eth, state):
+    tm = manager(eth, state, stuck_after=0)
+    receipts = []
+    first = tm.send(FakeCall(), gas=50000, on_mined=receipts.append)
+    tm.poll_once()
+    eth.receipts[first] = {"transactionHash": b"\x01", "status": 1}
+    assert tm.poll_once() == 1
+    assert receipts == [eth.receipts[first]]
+    assert tm.pending() == []
+    assert state.get(SHARED_PENDING, f"{SENDER}:7") is None
+
+
+def test_transaction_is_given_up_after_the_last_bump(eth, state):
+    tm = manager(eth, state, stuck_after=0, max_bumps=1)
+    receipts = []
+    tm.send(FakeCall(), gas=50000, on_mined=receipts.append)
+    tm.poll_once()
+    tm.poll_once()
+    assert tm.pending() == []
+    assert receipts[0]["status"] == 0 and receipts[0]["dropped"]
+    assert state.get(SHARED_PENDING, f"{SENDER}:7") is None
+
+
+def test_orphans_are_adopted_once_their_owner_stops_polling(eth, state):
+    crashed = manager(eth, state, owner="worker-a", stuck_after=60)
+    tx_hash = crashed.send(FakeCall(), gas=50000)
+    state.acquire_lease("tx_sender:worker-a", "worker-a", 0.2)
+
+    survivor = manager(eth, state, owner="worker-b", stuck_after=60)
+    assert survivor.adopt_orphans() == 0
+    time.sleep(0.3)
+    assert survivor.adopt_orphans() == 1
+    assert survivor.pending()[0]["transaction_hash"] == tx_hash
+    assert state.get(SHARED_PENDING, f"{SENDER}:7")["owner"] == "worker-b"
+
+    eth.receipts[tx_hash] = {"transactionHash": b"\x01", "status": 1}
+    assert survivor.poll_once() == 1
+    assert state.get(SHARED_PENDING, f"{SENDER}:7") is None
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from fakes import FakeWalletBackend
+from shared_state import SharedState
+from wallet_pool import WalletPool
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.sqlite"))
+
+
+def test_refill_tops_up_to_the_target(tmp_path):
+    pool = WalletPool(FakeWalletBackend(latency=0), path=str(tmp_path / "pool.json"), target_size=3)
+    assert pool.refill() == 3
+    assert pool.refill() == 0
+    assert len(pool) == 3
+
+
+def test_ready_wallets_survive_a_restart(tmp_path):
+    path = str(tmp_path / "pool.json")
+    pool = WalletPool(FakeWalletBackend(latency=0), path=path, target_size=2)
+    pool.refill()
+    taken = pool.take()
+    restarted = WalletPool(FakeWalletBackend(latency=0), path=path, target_size=2)
+    assert len(restarted) == 1
+    assert restarted.take() != taken
+
+
+def test_workers_never_take_the_same_wallet(tmp_path, state):
+    backend = FakeWalletBackend(latency=0)
+    first = WalletPool(backend, path=str(tmp_path / "a.json"), target_size=4, state=state)
+    second = WalletPool(backend, path=str(tmp_path / "b.json"), target_size=4, state=state)
+    first.refill()
+    taken = [first.take(), second.take(), first.take(), second.take()]
+    assert len({wallet["wallet_id"] for wallet in taken}) == 4
+    assert first.take() is None and second.take() is None
+
+
+def test_acquire_creates_inline_when_empty(tmp_path):
+    backend = FakeWalletBackend(latency=0)
+    pool = WalletPool(backend, path=str(tmp_path / "pool.json"), target_size=2)
+    wallet = asyncio.run(pool.acquire())
+    assert wallet["wallet_address"]
+    assert backend.created == 1
+
+
+def test_only_the_lease_holder_refills(tmp_path, state):
+    backend = FakeWalletBackend(latency=0)
+    pool = WalletPool(backend, path=str(tmp_path / "pool.json"), target_size=2, state=state)
+    allowed = []
+
+    async def scenario():
+        task = asyncio.create_task(pool.run(check_interval=0.02, should_refill=lambda: bool(allowed)))
+        await asyncio.sleep(0.1)
+        refilled_without_lease = len(pool)
+        allowed.append(True)
+        await asyncio.sleep(0.1)
+        task.cancel()
+        return refilled_without_lease
+
+    assert asyncio.run(scenario()) == 0
+    assert len(pool) == 2
+
+
+def test_taking_below_low_water_wakes_the_refill(tmp_path):
+    backend = FakeWalletBackend(latency=0)
+    pool = WalletPool(backend, path=str(tmp_path / "pool.json"), target_size=3, low_water=2)
+
+    async def scenario():
+        task = asyncio.create_task(pool.run(check_interval=60))
+        await asyncio.sleep(0.05)
+        await pool.acquire()
+        await pool.acquire()
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert len(pool) == 3
+    assert backend.created == 5
@@ -0,0 +1,543 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from web3 import Web3
+
+from metrics import logger
+
+TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)")
+# Uniswap V2 style pair events
+SWAP_TOPIC = Web3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)")
+SYNC_TOPIC = Web3.keccak(text="Sync(uint112,uint112)")
+
+ZERO_ADDRESS = "0x" + "00" * 20
+DAY = 86400
+HOUR = 3600
+# Used to date blocks when no timestamps are supplied (Base produces a block every 2s)
+BLOCK_TIME = 2
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+
+def _words(data: bytes) -> List[int]:
+    return [int.from_bytes(data[i:i + 32], "big") for i in range(0, len(data), 32)]
+
+
+def gini(values: np.ndarray) -> float:
+    """Gini coefficient of non-negative values, 0 for perfect equality and close to 1 for one holder."""
+    if values.size == 0 or values.sum() <= 0:
+        return 0.0
+    ordered = np.sort(values)
+    n = ordered.size
+    ranks = np.arange(1, n + 1)
+    return float((2 * np.sum(ranks * ordered)) / (n * ordered.sum()) - (n + 1) / n)
+
+
+class ColumnTable:
+    """Append-only set of equally long NumPy columns with amortized growth."""
+
+    def __init__(self, dtypes: Dict[str, str], capacity: int = 1024):
+        self.size = 0
+        self._columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def append(self, rows: Dict[str, np.ndarray]) -> None:
+        count = len(next(iter(rows.values())))
+        if count == 0:
+            return
+        needed = self.size + count
+        capacity = len(next(iter(self._columns.values())))
+        if needed > capacity:
+            capacity = max(needed, capacity * 2)
+            for name, column in self._columns.items():
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                self._columns[name] = grown
+        for name, values in rows.items():
+            self._columns[name][self.size:needed] = values
+        self.size = needed
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._columns[name][:self.size]
+
+    def to_dict(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {f"{prefix}.{name}": self[name] for name in self._columns}
+
+    def load(self, arrays, prefix: str) -> None:
+        rows = {name: arrays[f"{prefix}.{name}"] for name in self._columns}
+        self.size = 0
+        self.append(rows)
+
+
+class TokenAnalytics:
+    """
+    Columnar store of ERC-20 transfers and Uniswap V2 style pool swaps/syncs with
+    vectorized token metrics.
+
+    Logs are decoded once into NumPy columns (transfers, swaps, syncs). Each
+    ingest only applies its own rows: holder balances are updated with
+    `np.add.at` on the new transfers, and the per-token summary used for
+    screening (liquidity, holders, first seen) is updated from the new rows
+    alone, so an ingest costs the size of the batch rather than of the store.
+    Screening thousands of tokens is a handful of array comparisons.
+
+    Tokens and pools have to be registered before their logs are ingested, so
+    every pool knows which of its sides is WETH and amounts can be priced in ETH.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.tokens: Dict[str, int] = {}
+        self.token_addresses: List[str] = []
+        self.decimals: List[int] = []
+        self.pools: Dict[str, int] = {}
+        self.pool_token: List[int] = []
+        self.pool_eth_is_token0: List[bool] = []
+        # WETH reserve of each pool at its latest sync
+        self.pool_reserve_eth = np.zeros(0)
+        self.addresses: Dict[str, int] = {ZERO_ADDRESS: 0}
+        self.transfers = ColumnTable({"token": "i4", "block": "i8", "ts": "i8", "src": "i4", "dst": "i4", "value": "f8"})
+        self.swaps = ColumnTable({"pool": "i4", "block": "i8", "ts": "i8", "volume_eth": "f8"})
+        self.syncs = ColumnTable({"pool": "i4", "block": "i8", "ts": "i8", "reserve_token": "f8", "reserve_eth": "f8"})
+        self._balances: Dict[int, np.ndarray] = {}
+        self.liquidity = np.zeros(0)
+        self.holders = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0, dtype=np.int64)
+        self.head_block = 0
+        self.head_ts = 0
+        # Last block pulled by sync_from_chain, logs are read from the block after it
+        self.synced_block = 0
+
+    # Registration
+
+    def add_token(self, address: str, decimals: int = 18) -> int:
+        address = address.lower()
+        with self._lock:
+            if address in self.tokens:
+                return self.tokens[address]
+            index = len(self.token_addresses)
+            self.tokens[address] = index
+            self.token_addresses.append(address)
+            self.decimals.append(decimals)
+            self.liquidity = np.append(self.liquidity, 0.0)
+            self.holders = np.append(self.holders, 0)
+            self.first_seen = np.append(self.first_seen, 0)
+            return index
+
+    def add_pool(self, pool: str, token: str, eth_is_token0: bool) -> int:
+        """Register a token/WETH pair. `eth_is_token0` tells which reserve is WETH."""
+        pool = pool.lower()
+        token_index = self.add_token(token)
+        with self._lock:
+            if pool in self.pools:
+                return self.pools[pool]
+            index = len(self.pool_token)
+            self.pools[pool] = index
+            self.pool_token.append(token_index)
+            self.pool_eth_is_token0.append(eth_is_token0)
+            self.pool_reserve_eth = np.append(self.pool_reserve_eth, 0.0)
+            return index
+
+    def _address_index(self, address: str) -> int:
+        index = self.addresses.get(address)
+        if index is None:
+            index = len(self.addresses)
+            self.addresses[address] = index
+        return index
+
+    # Ingest
+
+    def ingest(self, logs: Iterable[dict], timestamps: Optional[Dict[int, int]] = None) -> int:
+        """
+        Decode and append a batch of raw logs. `timestamps` maps block numbers to
+        unix times; blocks without one are dated from the newest known block
+        using BLOCK_TIME. Returns the number of logs used.
+        """
+        timestamps = timestamps or {}
+        transfers = {k: [] for k in ("token", "block", "ts", "src", "dst", "value")}
+        swaps = {k: [] for k in ("pool", "block", "ts", "volume_eth")}
+        syncs = {k: [] for k in ("pool", "block", "ts", "reserve_token", "reserve_eth")}
+
+        with self._lock:
+            logs = sorted(logs, key=lambda log: (int(log["blockNumber"]), int(log["logIndex"])))
+            for block, ts in timestamps.items():
+                if block >= self.head_block:
+                    self.head_block, self.head_ts = block, ts
+
+            used = 0
+            for log in logs:
+                topics = [_to_bytes(t) for t in log["topics"]]
+                if not topics:
+                    continue
+                address = log["address"].lower()
+                block = int(log["blockNumber"])
+                ts = timestamps.get(block) or self.head_ts - (self.head_block - block) * BLOCK_TIME
+                data = _to_bytes(log["data"])
+
+                if topics[0] == TRANSFER_TOPIC and address in self.tokens and len(topics) == 3:
+                    token = self.tokens[address]
+                    scale = 10 ** self.decimals[token]
+                    transfers["token"].append(token)
+                    transfers["block"].append(block)
+                    transfers["ts"].append(ts)
+                    transfers["src"].append(self._address_index("0x" + topics[1][-20:].hex()))
+                    transfers["dst"].append(self._address_index("0x" + topics[2][-20:].hex()))
+                    transfers["value"].append(_words(data)[0] / scale)
+                elif topics[0] == SWAP_TOPIC and address in self.pools:
+                    pool = self.pools[address]
+                    amount0_in, amount1_in, amount0_out, amount1_out = _words(data)[:4]
+                    if self.pool_eth_is_token0[pool]:
+                        volume = amount0_in + amount0_out
+                    else:
+                        volume = amount1_in + amount1_out
+                    swaps["pool"].append(pool)
+                    swaps["block"].append(block)
+                    swaps["ts"].append(ts)
+                    swaps["volume_eth"].append(volume / 1e18)
+                elif topics[0] == SYNC_TOPIC and address in self.pools:
+                    pool = self.pools[address]
+                    reserve0, reserve1 = _words(data)[:2]
+                    scale = 10 ** self.decimals[self.pool_token[pool]]
+                    if self.pool_eth_is_token0[pool]:
+                        reserve_eth, reserve_token = reserve0, reserve1
+                    else:
+                        reserve_token, reserve_eth = reserve0, reserve1
+                    syncs["pool"].append(pool)
+                    syncs["block"].append(block)
+                    syncs["ts"].append(ts)
+                    syncs["reserve_token"].append(reserve_token / scale)
+                    syncs["reserve_eth"].append(reserve_eth / 1e18)
+                else:
+                    continue
+                used += 1
+                if block >= self.head_block:
+                    self.head_block, self.head_ts = block, ts
+
+            new_transfers = {k: np.asarray(v) for k, v in transfers.items()}
+            new_syncs = {k: np.asarray(v) for k, v in syncs.items()}
+            self.transfers.append(new_transfers)
+            self.swaps.append({k: np.asarray(v) for k, v in swaps.items()})
+            self.syncs.append(new_syncs)
+
+            self._apply_transfers(new_transfers)
+            self._apply_syncs(new_syncs)
+            return used
+
+    def _apply_transfers(self, rows: Dict[str, np.ndarray]) -> None:
+        """Apply only the new transfers to holder balances, holder counts and first seen times."""
+        if rows["token"].size == 0:
+            return
+        address_count = len(self.addresses)
+        for token in np.unique(rows["token"]):
+            mask = rows["token"] == token
+            balances = self._balances.get(int(token))
+            if balances is None or balances.size < address_count:
+                grown = np.zeros(address_count)
+                if balances is not None:
+                    grown[:balances.size] = balances
+                balances = grown
+                self._balances[int(token)] = balances
+            # Only the batch's senders and recipients can change holder status.
+            # Index 0 is the zero address, which only ever sends (mints)
+            touched = np.unique(np.concatenate([rows["src"][mask], rows["dst"][mask]]))
+            touched = touched[touched > 0]
+            before = np.count_nonzero(balances[touched] > 0)
+            np.subtract.at(balances, rows["src"][mask], rows["value"][mask])
+            np.add.at(balances, rows["dst"][mask], rows["value"][mask])
+            self.holders[token] += np.count_nonzero(balances[touched] > 0) - before
+
+        # first_seen is 0 until a token's first transfer
+        unseen = np.iinfo(np.int64).max
+        first_seen = np.where(self.first_seen > 0, self.first_seen, unseen)
+        np.minimum.at(first_seen, rows["token"], rows["ts"])
+        self.first_seen = np.where(first_seen < unseen, first_seen, 0)
+
+    def _apply_syncs(self, rows: Dict[str, np.ndarray]) -> None:
+        """Take each pool's reserve from its last sync in the batch and re-total token liquidity."""
+        if rows["pool"].size == 0:
+            return
+        # Reverse so np.unique's first occurrence is the latest sync of each pool
+        pools, last = np.unique(rows["pool"][::-1], return_index=True)
+        self.pool_reserve_eth[pools] = rows["reserve_eth"][::-1][last]
+        # Both sides of a pair hold equal value, so liquidity is twice the WETH reserve
+        self.liquidity = 2 * np.bincount(
+            np.asarray(self.pool_token, dtype=np.int64),
+            weights=self.pool_reserve_eth,
+            minlength=len(self.token_addresses),
+        )
+
+    # Queries
+
+    def analyze(self, token_address: str, top_n: int = 10, now: Optional[int] = None) -> Optional[dict]:
+        with self._lock:
+            token = self.tokens.get(token_address.lower())
+            if token is None:
+                return None
+            now = now or self.head_ts
+            balances = self._balances.get(token, np.zeros(1))[1:]
+            held = balances[balances > 0]
+            top = np.sort(held)[::-1][:top_n]
+            supply = held.sum()
+
+            pools = np.flatnonzero(np.asarray(self.pool_token) == token)
+            swap_mask = np.isin(self.swaps["pool"], pools) & (self.swaps["ts"] >= now - DAY)
+            sync_mask = np.isin(self.syncs["pool"], pools)
+            return {
+                "token_address": token_address,
+                "liquidity_eth": float(self.liquidity[token]),
+                "volume_24h_eth": float(self.swaps["volume_eth"][swap_mask].sum()),
+                "holders": int(self.holders[token]),
+                "gini": gini(held),
+                "top_holders_share": float(top.sum() / supply) if supply > 0 else 0.0,
+                "age_days": (now - int(self.first_seen[token])) / DAY if self.first_seen[token] else None,
+                "price_history": self._price_history(sync_mask),
+            }
+
+    def _price_history(self, sync_mask: np.ndarray, points: int = 24) -> List[dict]:
+        """Last price (ETH per token) in each hour, newest `points` hours."""
+        ts = self.syncs["ts"][sync_mask]
+        if ts.size == 0:
+            return []
+        reserve_token = self.syncs["reserve_token"][sync_mask]
+        prices = np.divide(
+            self.syncs["reserve_eth"][sync_mask], reserve_token,
+            out=np.zeros_like(reserve_token), where=reserve_token > 0,
+        )
+        hours = ts // HOUR
+        # Reverse so np.unique's first occurrence is the latest sync of each hour
+        unique_hours, last = np.unique(hours[::-1], return_index=True)
+        last = ts.size - 1 - last
+        return [
+            {"timestamp": int(hour * HOUR), "price_eth": float(prices[i])}
+            for hour, i in zip(unique_hours[-points:], last[-points:])
+        ]
+
+    def screen(
+        self,
+        min_liquidity: float = 0,
+        max_age: Optional[float] = None,
+        min_holders: int = 0,
+        now: Optional[int] = None,
+        limit: int = 20,
+    ) -> List[dict]:
+        """Tokens matching TokenDiscovery filters, most liquid first. `max_age` is in days."""
+        with self._lock:
+            now = now or self.head_ts
+            mask = (self.liquidity >= min_liquidity) & (self.holders >= min_holders) & (self.first_seen > 0)
+            if max_age is not None:
+                mask &= (now - self.first_seen) <= max_age * DAY
+            matches = np.flatnonzero(mask)
+            matches = matches[np.argsort(-self.liquidity[matches], kind="stable")][:limit]
+            return [
+                {
+                    "token_address": self.token_addresses[i],
+                    "liquidity_eth": float(self.liquidity[i]),
+                    "holders": int(self.holders[i]),
+                    "age_days": (now - int(self.first_seen[i])) / DAY,
+                }
+                for i in matches
+            ]
+
+    # Persistence
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            meta = {
+                "tokens": self.token_addresses,
+                "decimals": self.decimals,
+                "pools": sorted(self.pools, key=self.pools.get),
+                "pool_token": self.pool_token,
+                "pool_eth_is_token0": self.pool_eth_is_token0,
+                "addresses": sorted(self.addresses, key=self.addresses.get),
+                "head_block": self.head_block,
+                "head_ts": self.head_ts,
+                "synced_block": self.synced_block,
+            }
+            # Snapshot under the lock; compress and write outside it so queries aren't held up
+            arrays = {
+                name: column.copy()
+                for table in (self.transfers.to_dict("transfers"), self.swaps.to_dict("swaps"), self.syncs.to_dict("syncs"))
+                for name, column in table.items()
+            }
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "TokenAnalytics":
+        engine = cls()
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            for address, decimals in zip(meta["tokens"], meta["decimals"]):
+                engine.add_token(address, decimals)
+            for pool, token, eth_is_token0 in zip(meta["pools"], meta["pool_token"], meta["pool_eth_is_token0"]):
+                engine.add_pool(pool, meta["tokens"][token], eth_is_token0)
+            engine.addresses = {address: i for i, address in enumerate(meta["addresses"])}
+            engine.head_block, engine.head_ts = meta["head_block"], meta["head_ts"]
+            engine.synced_block = meta.get("synced_block", engine.head_block)
+            engine.transfers.load(arrays, "transfers")
+            engine.swaps.load(arrays, "swaps")
+            engine.syncs.load(arrays, "syncs")
+        # Rebuild balances and summaries from the stored columns, as one batch
+        engine._apply_transfers({name: engine.transfers[name] for name in ("token", "ts", "src", "dst", "value")})
+        engine._apply_syncs({name: engine.syncs[name] for name in ("pool", "reserve_eth")})
+        return engine
+
+
+def load_log_fixture(path: str) -> dict:
+    """
+    Read recorded logs from a JSON file shaped like
+    `{"tokens": [...], "pools": [...], "timestamps": {block: ts}, "logs": [...]}`
+    where logs use the eth_getLogs JSON format.
+    """
+    with open(path) as f:
+        fixture = json.load(f)
+    fixture["timestamps"] = {int(block): int(ts) for block, ts in fixture.get("timestamps", {}).items()}
+    return fixture
+
+
+def register_watchlist(engine: TokenAnalytics, watchlist: dict) -> None:
+    """Register `{"tokens": [{"address", "decimals"}], "pools": [{"address", "token", "eth_is_token0"}]}`."""
+    for token in watchlist.get("tokens", []):
+        engine.add_token(token["address"], token.get("decimals", 18))
+    for pool in watchlist.get("pools", []):
+        engine.add_pool(pool["address"], pool["token"], pool["eth_is_token0"])
+
+
+def engine_from_fixture(path: str) -> TokenAnalytics:
+    fixture = load_log_fixture(path)
+    engine = TokenAnalytics()
+    register_watchlist(engine, fixture)
+    engine.ingest(fixture["logs"], fixture["timestamps"])
+    return engine
+
+
+def sync_from_chain(engine: TokenAnalytics, client, from_block: int, to_block: int, chunk_size: int = 2000) -> int:
+    """
+    Pull transfer, swap and sync logs for every registered token and pool in
+    block chunks, advancing `engine.synced_block` after each one.
+    """
+    addresses = [Web3.to_checksum_address(a) for a in list(engine.tokens) + list(engine.pools)]
+    if not addresses:
+        # An empty address filter would match every log on the chain
+        return 0
+    topics = [[Web3.to_hex(TRANSFER_TOPIC), Web3.to_hex(SWAP_TOPIC), Web3.to_hex(SYNC_TOPIC)]]
+    used = 0
+    for start in range(from_block, to_block + 1, chunk_size):
+        end = min(start + chunk_size - 1, to_block)
+        logs = client.w3.eth.get_logs({"address": addresses, "fromBlock": start, "toBlock": end, "topics": topics})
+        block = client.w3.eth.get_block(end)
+        used += engine.ingest(logs, {end: block["timestamp"]})
+        with engine._lock:
+            engine.synced_block = end
+    return used
+
+
+class TokenAnalyticsSync:
+    """
+    Keeps an engine current with the chain. Every `poll_interval` seconds the
+    logs of new blocks are ingested, starting after the store's last synced
+    block (or at `start_block`, or the head, for a store that never synced),
+    and the store is saved at most every `save_interval` seconds, so a restart
+    resumes from the last save.
+
+    Args:
+        engine: Engine to extend
+        client: Shared chain client
+        store_path: `.npz` file the store is saved to
+        start_block: First block to sync into a store that never synced
+        poll_interval: Seconds between checks for new blocks
+        save_interval: Minimum seconds between saves
+        should_save: Whether this process saves, so workers sharing the file take turns
+    """
+
+    def __init__(
+        self,
+        engine: TokenAnalytics,
+        client,
+        store_path: str,
+        start_block: Optional[int] = None,
+        poll_interval: float = 12,
+        save_interval: float = 300,
+        should_save: Callable[[], bool] = lambda: True,
+    ):
+        self.engine = engine
+        self.client = client
+        self.store_path = store_path
+        self.start_block = start_block
+        self.poll_interval = poll_interval
+        self.save_interval = save_interval
+        self.should_save = should_save
+        self._saved_block = engine.synced_block
+        self._saved_at = time.monotonic()
+
+    def sync_once(self) -> int:
+        """Ingest the blocks after the last synced one. Returns the number of logs used."""
+        if not self.engine.tokens and not self.engine.pools:
+            return 0
+        head = self.client.w3.eth.block_number
+        if self.engine.synced_block:
+            from_block = self.engine.synced_block + 1
+        elif self.start_block is not None:
+            from_block = self.start_block
+        else:
+            from_block = head
+        if from_block > head:
+            return 0
+        return sync_from_chain(self.engine, self.client, from_block, head)
+
+    def save_if_due(self) -> bool:
+        if self.engine.synced_block == self._saved_block or time.monotonic() - self._saved_at < self.save_interval:
+            return False
+        self._saved_at = time.monotonic()
+        if not self.should_save():
+            return False
+        self.engine.save(self.store_path)
+        self._saved_block = self.engine.synced_block
+        return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+                await asyncio.to_thread(self.save_if_due)
+            except Exception as e:
+                logger.error(f"Token analytics: error syncing logs: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+
+_default_engine: Optional[TokenAnalytics] = None
+_default_engine_lock = threading.Lock()
+
+
+def get_default_engine() -> TokenAnalytics:
+    """
+    Engine loaded from TOKEN_ANALYTICS_STORE (a saved .npz store, or a .json
+    log fixture) when it exists, empty otherwise, with the tokens and pools
+    listed in the TOKEN_ANALYTICS_WATCHLIST file registered.
+    """
+    global _default_engine
+    # Tools reach this from worker threads; build the engine only once
+    with _default_engine_lock:
+        if _default_engine is None:
+            path = os.getenv("TOKEN_ANALYTICS_STORE", "token_analytics.npz")
+            if not os.path.exists(path):
+                engine = TokenAnalytics()
+            elif path.endswith(".json"):
+                engine = engine_from_fixture(path)
+            else:
+                engine = TokenAnalytics.load(path)
+            watchlist = os.getenv("TOKEN_ANALYTICS_WATCHLIST")
+            if watchlist and os.path.exists(watchlist):
+                with open(watchlist) as f:
+                    register_watchlist(engine, json.load(f))
+            _default_engine = engine
+    return _default_engine
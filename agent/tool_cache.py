@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Seconds a result stays fresh, per tool name. Tools that are not listed, or
+# listed with 0, are never cached, which keeps every state-changing tool
+# (transfers, trades, deployments, bets) uncached by default.
+TOOL_CACHE_TTLS: Dict[str, float] = {
+    "analyze_token": 300,
+    "discover_tokens": 120,
+    "get_risk_assessment": 300,
+    "get_balance": 15,
+    "get_wallet_details": 60,
+    "place_prediction_bet": 0,
+}
+
+# Cached reads of a wallet's own balances. Every uncached tool is taken to
+# change state, so calling one drops these entries for the calling wallet
+WALLET_BALANCE_TOOLS = ("get_balance", "get_wallet_details")
+
+TOOL_CACHE_ENABLED = os.getenv("TOOL_CACHE_ENABLED", "true").lower() != "false"
+
+
+def _wallet_key(value: Any) -> Optional[str]:
+    """Balances differ per wallet, so the wallet address is part of the key."""
+    address = getattr(value, "default_address", None)
+    if address is not None:
+        return getattr(address, "address_id", None)
+    return None
+
+
+class ToolResultCache:
+    """
+    Size bounded LRU of tool results with a TTL per entry.
+
+    Keys are built from the tool name, the wallet the tool runs against and the
+    validated `args_schema` values it is called with. Concurrent calls with the
+    same key wait for the first one instead of computing the result again.
+    Results that look like errors are not cached. `invalidate_wallet` drops a
+    wallet's cached balances once it has transacted.
+
+    Args:
+        maxsize: Maximum number of cached results
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any]) -> Any:
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[1]
+                waiting = self._in_flight.get(key)
+                if waiting is None:
+                    self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Someone else is computing this key, use their result once it lands
+            waiting.wait()
+
+        try:
+            value = compute()
+            if not (isinstance(value, str) and value.lstrip().startswith("Error")):
+                with self._lock:
+                    self._entries[key] = (time.monotonic() + ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+    def wrap(self, func: Callable, name: str, ttl: float) -> Callable:
+        """Cache `func` under `name`. The wrapper keeps func's signature, which CdpTool inspects."""
+
+        @functools.wraps(func)
+        def cached(*args, **kwargs):
+            parts = [name]
+            parts.extend(_wallet_key(arg) or repr(arg) for arg in args)
+            parts.append(json.dumps(kwargs, sort_keys=True, default=str))
+            key = "|".join(parts)
+            return self.get_or_compute(key, ttl, lambda: func(*args, **kwargs))
+
+        return cached
+
+    def invalidating(self, func: Callable, names=WALLET_BALANCE_TOOLS) -> Callable:
+        """Wrap a state-changing `func` so each call drops the calling wallet's cached `names` results."""
+
+        @functools.wraps(func)
+        def invalidating(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # Even a failed call may have sent a transaction
+                for arg in args:
+                    wallet = _wallet_key(arg)
+                    if wallet is not None:
+                        self.invalidate_wallet(wallet, names)
+
+        return invalidating
+
+    def invalidate_wallet(self, wallet: str, names=WALLET_BALANCE_TOOLS) -> int:
+        """Drop the cached `names` results of `wallet`. Returns how many were dropped."""
+        prefixes = tuple(f"{name}|{wallet}|" for name in names)
+        with self._lock:
+            stale = [key for key in self._entries if key.startswith(prefixes)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+tool_cache = ToolResultCache(maxsize=int(os.getenv("TOOL_CACHE_SIZE", "1024")))
+
+
+def cached_tool(name: str):
+    """Decorator caching a plain function with the TTL configured for `name`."""
+    def decorator(func: Callable) -> Callable:
+        ttl = TOOL_CACHE_TTLS.get(name, 0)
+        if not TOOL_CACHE_ENABLED or ttl <= 0:
+            return func
+        return tool_cache.wrap(func, name, ttl)
+    return decorator
+
+
+def cache_tools(tools: List[Any], cache: ToolResultCache = tool_cache) -> List[Any]:
+    """
+    Wrap the `func` of each CdpTool that has a TTL configured, and make every
+    other tool invalidate its wallet's cached balances. Tools are changed in
+    place and returned for convenience.
+    """
+    if not TOOL_CACHE_ENABLED:
+        return tools
+    for tool in tools:
+        ttl = TOOL_CACHE_TTLS.get(tool.name, 0)
+        func = getattr(tool, "func", None)
+        if func is None or hasattr(func, "__wrapped__"):
+            continue
+        if ttl > 0:
+            tool.func = cache.wrap(func, tool.name, ttl)
+        else:
+            tool.func = cache.invalidating(func)
+    return tools
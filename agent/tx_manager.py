@@ -0,0 +1,389 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from web3.exceptions import TransactionNotFound
+
+from chain_client import ChainClient
+from fee_oracle import FeeOracle, get_fee_oracle
+from metrics import logger, stage_seconds, span
+from shared_state import node_id
+
+# Replacement transactions must pay at least 10% more than the one they replace
+MIN_GAS_BUMP = 1.1
+# Headroom added on top of estimate_gas results
+GAS_ESTIMATE_MARGIN = 1.2
+# Shared state namespace of the next nonce per sender
+SHARED_NONCES = "nonce"
+# Shared state namespace of unmined transactions, keyed `<sender>:<nonce>`
+SHARED_PENDING = "pending_tx"
+# Seconds a pending transaction record outlives its last write
+PENDING_TTL = 86400
+
+
+class NonceManager:
+    """
+    Hands out nonces for one sender address without an RPC per transaction.
+
+    The starting nonce is read once from the pending transaction count, after
+    that nonces are allocated locally under a lock, so concurrent registrations
+    never reuse a nonce. Call `resync` after a nonce error, or with a nonce that
+    was allocated but never broadcast, to re-read the chain.
+
+    With `state` (see shared_state.py) the next nonce is a shared counter, so
+    several worker processes sending from the same key don't collide.
+    """
+
+    def __init__(self, w3, address: str, state=None):
+        self.w3 = w3
+        self.address = address
+        self.state = state
+        self._next: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        if self.state is not None:
+            if self.state.get(SHARED_NONCES, self.address) is None:
+                pending = self.w3.eth.get_transaction_count(self.address, "pending")
+                self.state.set_if_absent(SHARED_NONCES, self.address, pending)
+            return self.state.incr(SHARED_NONCES, self.address) - 1
+        with self._lock:
+            if self._next is None:
+                self._next = self.w3.eth.get_transaction_count(self.address, "pending")
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def resync(self, unused_nonce: Optional[int] = None) -> None:
+        """
+        Move the next nonce up to the pending transaction count. It only moves
+        back, to reuse `unused_nonce`, when nothing was allocated after it.
+        """
+        pending = self.w3.eth.get_transaction_count(self.address, "pending")
+        if self.state is not None:
+            current = self.state.get(SHARED_NONCES, self.address)
+            if current is None:
+                self.state.set_if_absent(SHARED_NONCES, self.address, pending)
+            elif pending > current or (unused_nonce is not None and current == unused_nonce + 1):
+                # Loses to a concurrent allocation, which has the counter right already
+                self.state.compare_and_set(SHARED_NONCES, self.address, current, pending)
+            return
+        with self._lock:
+            if self._next is None or pending > self._next or (unused_nonce is not None and self._next == unused_nonce + 1):
+                self._next = pending
+
+
+@dataclass
+class PendingTransaction:
+    nonce: int
+    transaction: dict
+    tx_hashes: List[str]
+    submitted_at: float
+    on_mined: Optional[Callable[[dict], None]] = None
+    purpose: str = ""
+    bumps: int = 0
+    # First broadcast, kept across resubmissions to time the whole confirmation
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def tx_hash(self) -> str:
+        return self.tx_hashes[-1]
+
+    def to_dict(self, owner: str) -> dict:
+        return {
+            "nonce": self.nonce,
+            "transaction": self.transaction,
+            "tx_hashes": self.tx_hashes,
+            "purpose": self.purpose,
+            "bumps": self.bumps,
+            "owner": owner,
+        }
+
+
+class TransactionManager:
+    """
+    Submits transactions from the registrar key without waiting for them to be mined.
+
+    `send` signs and broadcasts a transaction and returns its hash straight away.
+    A background loop (`run`) polls for receipts, calls each transaction's
+    `on_mined` callback with the receipt, and re-broadcasts transactions that
+    have been pending longer than `stuck_after` seconds with higher fees. A
+    transaction still pending `stuck_after` seconds after its last allowed
+    resubmission is given up on: `on_mined` gets a receipt with status 0 and
+    `dropped` set. Fees and gas estimates come from the fee oracle, so a send
+    makes no fee RPC.
+
+    With `state` the pending transactions are also recorded in shared state.
+    While `run` is polling, the manager holds a lease as `owner`. Transactions
+    whose owner lost its lease (a crashed or restarted worker) are adopted and
+    followed to the end, without their callbacks.
+
+    Args:
+        client: Shared chain client
+        private_key: Private key of the sending account
+        poll_interval: Seconds between receipt polls
+        stuck_after: Seconds before a pending transaction is resubmitted
+        gas_bump: Gas price multiplier applied on each resubmission
+        max_bumps: Maximum number of resubmissions per transaction
+        state: Optional shared state for nonces and pending transactions across worker processes
+        fee_oracle: Fee source, the process-wide oracle for `client` by default
+        owner: Identifies this process in shared state, `node_id()` by default
+    """
+
+    def __init__(
+        self,
+        client: ChainClient,
+        private_key: str,
+        poll_interval: float = 2,
+        stuck_after: float = 60,
+        gas_bump: float = 1.125,
+        max_bumps: int = 5,
+        state=None,
+        fee_oracle: Optional[FeeOracle] = None,
+        owner: Optional[str] = None,
+    ):
+        self.client = client
+        self.fee_oracle = fee_oracle or get_fee_oracle(client)
+        self.account = client.account(private_key)
+        self.nonces = NonceManager(client.w3, self.account.address, state)
+        self.poll_interval = poll_interval
+        self.stuck_after = stuck_after
+        self.gas_bump = max(gas_bump, MIN_GAS_BUMP)
+        self.max_bumps = max_bumps
+        self.state = state
+        self.owner = owner or node_id()
+        self._pending: Dict[int, PendingTransaction] = {}
+        self._lock = threading.Lock()
+
+    def _record_key(self, nonce: int) -> str:
+        return f"{self.account.address}:{nonce}"
+
+    def _record(self, tx: PendingTransaction) -> None:
+        if self.state is None:
+            return
+        try:
+            self.state.set(SHARED_PENDING, self._record_key(tx.nonce), tx.to_dict(self.owner), ttl=PENDING_TTL)
+        except Exception as e:
+            logger.error(f"Error recording pending transaction {tx.tx_hash}: {e}")
+
+    def _forget(self, tx: PendingTransaction) -> None:
+        if self.state is not None:
+            self.state.delete(SHARED_PENDING, self._record_key(tx.nonce))
+
+    def estimate_gas(self, contract_function, cached: bool = False) -> int:
+        """
+        Estimate gas for a call from the sender. A fresh estimate raises if the
+        call would revert; a `cached` one reuses the estimate for the same call
+        signature.
+        """
+        if cached:
+            estimate = self.fee_oracle.estimate_gas(contract_function, self.account.address)
+        else:
+            estimate = self.fee_oracle.remember_gas(
+                contract_function, contract_function.estimate_gas({'from': self.account.address})
+            )
+        return int(estimate * GAS_ESTIMATE_MARGIN)
+
+    def send(
+        self,
+        contract_function,
+        gas: Optional[int] = None,
+        on_mined: Optional[Callable[[dict], None]] = None,
+        purpose: Optional[str] = None,
+    ) -> str:
+        """
+        Sign and broadcast a contract call, returning the transaction hash without
+        waiting for it. Gas is estimated once per call signature when `gas` is
+        not given. `purpose` describes the transaction in logs and shared state,
+        the function name by default.
+        """
+        if gas is None:
+            gas = self.estimate_gas(contract_function, cached=True)
+        for attempt in range(2):
+            nonce = self.nonces.allocate()
+            try:
+                with span("tx_build"):
+                    transaction = contract_function.build_transaction({
+                        'from': self.account.address,
+                        'nonce': nonce,
+                        'chainId': self.client.chain_id,
+                        'gas': gas,
+                        **self.fee_oracle.tx_params(),
+                    })
+                tx_hash = self._broadcast(transaction)
+                break
+            except Exception as e:
+                # The allocated nonce was not used, re-read it so no gap is left behind
+                self.nonces.resync(nonce)
+                # Another process used the key, try once more with the fresh nonce
+                if attempt == 0 and "nonce" in str(e).lower():
+                    continue
+                raise
+
+        tx = PendingTransaction(
+            nonce=nonce,
+            transaction=transaction,
+            tx_hashes=[tx_hash],
+            submitted_at=time.monotonic(),
+            on_mined=on_mined,
+            purpose=purpose or contract_function.fn_name,
+        )
+        with self._lock:
+            self._pending[nonce] = tx
+        self._record(tx)
+        return tx_hash
+
+    def _broadcast(self, transaction: dict) -> str:
+        with span("tx_sign"):
+            signed_txn = self.account.sign_transaction(transaction)
+        with span("tx_send"):
+            return self.client.w3.to_hex(self.client.w3.eth.send_raw_transaction(signed_txn.raw_transaction))
+
+    def pending(self) -> List[dict]:
+        with self._lock:
+            return [
+                {"nonce": p.nonce, "transaction_hash": p.tx_hash, "purpose": p.purpose, "bumps": p.bumps}
+                for p in self._pending.values()
+            ]
+
+    def poll_once(self) -> int:
+        """Check every pending transaction once. Returns the number that were mined."""
+        with self._lock:
+            pending = list(self._pending.values())
+
+        mined = 0
+        for tx in pending:
+            receipt = self._find_receipt(tx)
+            if receipt is not None:
+                mined += 1
+                stage_seconds.observe(time.monotonic() - tx.created_at, stage="tx_receipt")
+                self._finish(tx, receipt)
+            elif time.monotonic() - tx.submitted_at > self.stuck_after:
+                if tx.bumps < self.max_bumps:
+                    self._resubmit(tx)
+                else:
+                    self._give_up(tx)
+        return mined
+
+    def _finish(self, tx: PendingTransaction, receipt: dict) -> None:
+        with self._lock:
+            self._pending.pop(tx.nonce, None)
+        self._forget(tx)
+        if tx.on_mined:
+            try:
+                tx.on_mined(receipt)
+            except Exception as e:
+                logger.error(f"Error handling receipt for {tx.tx_hash}: {e}")
+        elif receipt["status"] != 1:
+            logger.warning(f"Transaction {tx.tx_hash} ({tx.purpose}) failed")
+
+    def _give_up(self, tx: PendingTransaction) -> None:
+        logger.error(
+            f"Giving up on transaction nonce {tx.nonce} ({tx.purpose}), "
+            f"still pending after {tx.bumps} resubmissions"
+        )
+        # Let the nonce be reused if it never made it into the mempool
+        try:
+            self.nonces.resync(tx.nonce)
+        except Exception as e:
+            logger.error(f"Error resyncing nonces: {e}")
+        self._finish(tx, {
+            "transactionHash": bytes.fromhex(tx.tx_hash[2:]),
+            "status": 0,
+            "dropped": True,
+        })
+
+    def adopt_orphans(self) -> int:
+        """
+        Take over the recorded transactions of owners that lost their lease,
+        between the sender's mined and next nonce. Returns how many were adopted.
+        """
+        if self.state is None:
+            return 0
+        next_nonce = self.state.get(SHARED_NONCES, self.account.address)
+        if next_nonce is None:
+            return 0
+        adopted = 0
+        for nonce in range(self.client.w3.eth.get_transaction_count(self.account.address), next_nonce):
+            with self._lock:
+                if nonce in self._pending:
+                    continue
+            record = self.state.get(SHARED_PENDING, self._record_key(nonce))
+            if record is None:
+                continue
+            # A record of our own owner id that isn't local is left from before a restart
+            if record["owner"] != self.owner and self.state.lease_holder(f"tx_sender:{record['owner']}") is not None:
+                continue
+            # Two adopters may notice the same orphan
+            if not self.state.acquire_lease(f"tx_adopt:{self._record_key(nonce)}", self.owner, self.stuck_after):
+                continue
+            tx = PendingTransaction(
+                nonce=nonce,
+                transaction=record["transaction"],
+                tx_hashes=record["tx_hashes"],
+                submitted_at=time.monotonic(),
+                purpose=record["purpose"],
+                bumps=record["bumps"],
+            )
+            with self._lock:
+                self._pending[nonce] = tx
+            self._record(tx)
+            adopted += 1
+            logger.info(f"Adopted pending transaction nonce {nonce} ({tx.purpose}) from {record['owner']}")
+        return adopted
+
+    def _find_receipt(self, tx: PendingTransaction) -> Optional[dict]:
+        # Any of the replacements sharing this nonce may be the one that got mined
+        for tx_hash in reversed(tx.tx_hashes):
+            try:
+                return self.client.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _resubmit(self, tx: PendingTransaction) -> None:
+        transaction = dict(tx.transaction)
+        current = self.fee_oracle.tx_params()
+        # A replacement must raise every fee field, and pay at least the going rate
+        for field_name in ('maxFeePerGas', 'maxPriorityFeePerGas', 'gasPrice'):
+            if field_name in transaction:
+                transaction[field_name] = max(
+                    int(transaction[field_name] * self.gas_bump) + 1,
+                    current.get(field_name, 0),
+                )
+        try:
+            tx_hash = self._broadcast(transaction)
+        except Exception as e:
+            # "nonce too low" means one of the earlier hashes was mined meanwhile
+            logger.error(f"Error resubmitting transaction {tx.tx_hash}: {e}")
+            return
+        logger.info(f"Resubmitted stuck transaction nonce {tx.nonce} as {tx_hash}")
+        tx.transaction = transaction
+        tx.tx_hashes.append(tx_hash)
+        tx.bumps += 1
+        tx.submitted_at = time.monotonic()
+        self._record(tx)
+
+    def _heartbeat(self, adopt: bool) -> None:
+        self.state.acquire_lease(f"tx_sender:{self.owner}", self.owner, max(self.poll_interval * 10, 30))
+        if adopt:
+            self.adopt_orphans()
+
+    async def run(self) -> None:
+        """Poll for receipts forever, off the event loop."""
+        adopted_at = None
+        while True:
+            try:
+                if self.state is not None:
+                    # Look for orphans on start, then once per stuck period
+                    adopt = adopted_at is None or time.monotonic() - adopted_at > self.stuck_after
+                    if adopt:
+                        adopted_at = time.monotonic()
+                    await asyncio.to_thread(self._heartbeat, adopt)
+                if self._pending:
+                    await asyncio.to_thread(self.poll_once)
+            except Exception as e:
+                logger.error(f"Error polling transaction receipts: {e}")
+            await asyncio.sleep(self.poll_interval)
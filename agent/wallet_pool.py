@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+from metrics import logger
+
+# Queue holding the ready wallets in shared state
+SHARED_POOL = "wallet_pool"
+
+_cdp_configured = False
+_cdp_lock = threading.Lock()
+
+
+def configure_cdp() -> None:
+    """Configure the CDP SDK once per process."""
+    global _cdp_configured
+    with _cdp_lock:
+        if _cdp_configured:
+            return
+        from cdp import Cdp
+
+        api_key_name = os.environ.get('CDP_API_KEY_NAME')
+        api_key_private_key = os.environ.get('CDP_API_KEY_PRIVATE_KEY')
+
+        if not api_key_name or not api_key_private_key:
+            raise ValueError("CDP API Key Name or CDP API Key Private Key is missing")
+
+        # Configure the SDK with proper key formatting
+        Cdp.configure(api_key_name, api_key_private_key.replace('\\n', '\n'))
+        _cdp_configured = True
+
+
+class CdpWalletBackend:
+    """
+    Creates wallets through the CDP SDK.
+
+    Any object with a `create() -> dict` method returning `wallet_address` and
+    `wallet_id` can be used as a WalletPool backend, e.g. a fake in tests.
+    """
+
+    def create(self) -> dict:
+        configure_cdp()
+        from cdp import Wallet
+
+        wallet = Wallet.create()
+        return {
+            "wallet_address": wallet.default_address.address_id,
+            "wallet_id": wallet.id
+        }
+
+
+class WalletPool:
+    """
+    Pool of pre-created wallets so NPC creation doesn't wait on the CDP API.
+
+    `acquire` hands out a ready wallet in constant time and only creates one
+    inline when the pool is empty. Whenever the pool drops to `low_water`
+    wallets, the background `run` loop tops it back up to `target_size`. The
+    pool is written to `path` after every change so ready wallets survive
+    restarts, and a wallet is removed from the file before it is handed out so
+    it is never issued twice.
+
+    With `state` (see shared_state.py) the ready wallets live in a queue shared
+    by every worker instead of the file, and each wallet is popped atomically
+    by exactly one of them. Pass `run` a `should_refill` lease check so only
+    one worker tops up the shared queue.
+
+    Args:
+        backend: Object creating wallets, see CdpWalletBackend
+        path: JSON file persisting the ready wallets
+        target_size: Number of wallets to keep ready
+        low_water: Refill once this many or fewer wallets remain
+        state: Optional shared state holding the pool instead of `path`
+    """
+
+    def __init__(self, backend, path: str = "wallet_pool.json", target_size: int = 5, low_water: int = 2, state=None):
+        self.backend = backend
+        self.path = Path(path)
+        self.target_size = target_size
+        self.low_water = low_water
+        self.state = state
+        self._wallets: deque = deque(self._load() if state is None else ())
+        self._lock = threading.Lock()
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _load(self) -> list:
+        if not self.path.exists():
+            return []
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading wallet pool: {e}")
+            return []
+
+    def _save(self) -> None:
+        # Write to a temporary file first so a crash never leaves a truncated pool
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self._wallets), f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        if self.state is not None:
+            return self.state.length(SHARED_POOL)
+        return len(self._wallets)
+
+    def take(self) -> Optional[dict]:
+        """Pop a ready wallet, or None when the pool is empty."""
+        if self.state is not None:
+            wallet = self.state.pop(SHARED_POOL)
+            if wallet is None:
+                return None
+            remaining = len(self)
+        else:
+            with self._lock:
+                if not self._wallets:
+                    return None
+                wallet = self._wallets.popleft()
+                self._save()
+                remaining = len(self._wallets)
+        if remaining <= self.low_water:
+            self.request_refill()
+        return wallet
+
+    def put(self, wallet: dict) -> None:
+        if self.state is not None:
+            self.state.push(SHARED_POOL, wallet)
+            return
+        with self._lock:
+            self._wallets.append(wallet)
+            self._save()
+
+    async def acquire(self) -> dict:
+        """Return a pooled wallet, creating one inline only if the pool is empty."""
+        wallet = await asyncio.to_thread(self.take)
+        if wallet is None:
+            self.request_refill()
+            wallet = await asyncio.to_thread(self.backend.create)
+        return wallet
+
+    def request_refill(self) -> None:
+        # Called from `take` in a worker thread as well as from the loop
+        if self._refill_needed is not None:
+            self._loop.call_soon_threadsafe(self._refill_needed.set)
+
+    def refill(self) -> int:
+        """Create wallets until the pool is back at `target_size`. Returns how many were added."""
+        added = 0
+        while len(self) < self.target_size:
+            self.put(self.backend.create())
+            added += 1
+        return added
+
+    async def run(self, check_interval: float = 30, should_refill: Callable[[], bool] = lambda: True) -> None:
+        """
+        Keep the pool topped up in the background, on request and every
+        `check_interval` seconds, whenever `should_refill` allows it.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        while True:
+            try:
+                # Other workers drain a shared pool without waking this one
+                await asyncio.wait_for(self._refill_needed.wait(), check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_needed.clear()
+            try:
+                if not await asyncio.to_thread(should_refill):
+                    continue
+                added = await asyncio.to_thread(self.refill)
+                if added:
+                    logger.info(f"Wallet pool refilled with {added} wallets")
+            except Exception as e:
+                logger.error(f"Error refilling wallet pool: {e}")
+                await asyncio.sleep(5)
+                self._refill_needed.set()
+
+    def stats(self) -> dict:
+        return {"ready": len(self), "target_size": self.target_size, "low_water": self.low_water}
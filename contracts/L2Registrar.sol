@@ -25,6 +25,9 @@ contract L2Registrar {
     /// @param owner The owner of the newly registered name
     event NameRegistered(string indexed label, address indexed owner);
 
+    /// @notice Thrown when batch arguments have different lengths
+    error LengthMismatch();
+
     /// @notice Reference to the target registry contract
     /// @dev Immutable to save gas and prevent manipulation
     IL2Registry public immutable targetRegistry;
@@ -66,7 +69,7 @@ contract L2Registrar {
     /// @notice Registers a new name
     /// @param label The name to register
     /// @param owner The address that will own the name
-    function register(string memory label, address owner) external {
+    function register(string memory label, address owner) public {
         targetRegistry.register(label, owner);
         // Set the mainnet resolved address
         targetRegistry.setAddr(
@@ -76,4 +79,20 @@ contract L2Registrar {
         );
         emit NameRegistered(label, owner);
     }
+
+    /// @notice Registers several names in one transaction
+    /// @param labels The names to register
+    /// @param owners The owner of each name, matched to labels by index
+    /// @dev Reverts as a whole if any single registration fails
+    function registerBatch(
+        string[] calldata labels,
+        address[] calldata owners
+    ) external {
+        if (labels.length != owners.length) {
+            revert LengthMismatch();
+        }
+        for (uint256 i = 0; i < labels.length; i++) {
+            register(labels[i], owners[i]);
+        }
+    }
 }